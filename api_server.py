@@ -0,0 +1,334 @@
+"""本地HTTP/JSON接口：在后台线程中运行asyncio服务器，向下载引擎提交任务、查询状态、订阅进度和取消任务
+
+接口（只监听本机地址）：
+    POST   /jobs          提交任务，请求体 {"urls": [...], "type": "视频", "expand": true, "profile": {...}, "priority": 0}
+                          expand为true时展开播放列表，任务id通过/events推送；为false时直接返回任务id
+                          profile为格式要求，如{"max_height": 720, "video_codecs": ["h264"]}，见formats.py
+                          priority越大越先下载，高于正在下载的任务时会抢占它们的下载名额
+    GET    /jobs          所有任务的状态，可用 ?state=下载中 筛选
+    GET    /jobs/<id>     单个任务的状态
+    PATCH  /jobs/<id>     修改优先级，请求体 {"priority": 10}
+    DELETE /jobs/<id>     取消任务
+    POST   /jobs/<id>/pause   暂停任务，已下载的部分保留
+    POST   /jobs/<id>/resume  继续已暂停的任务
+    GET    /events        Server-Sent Events进度流，事件名为added、updated、finished，数据为任务JSON
+    GET    /metrics       Prometheus文本格式的运行指标（见metrics.py）
+"""
+import asyncio
+import json
+import sys
+import threading
+from collections import OrderedDict
+from urllib.parse import parse_qs, urlparse
+
+from engine import DownloadJob
+from formats import FormatProfile
+
+DEFAULT_PORT = 8765
+# 请求头和请求体的大小上限
+MAX_HEADER_SIZE = 64 * 1024
+MAX_BODY_SIZE = 1024 * 1024
+# SSE心跳间隔（秒），让客户端和代理知道连接仍然有效
+HEARTBEAT_INTERVAL = 15
+
+REASONS = {
+    200: "OK", 201: "Created", 202: "Accepted", 400: "Bad Request", 404: "Not Found",
+    405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error",
+}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class EventStream:
+    """单个SSE客户端的待发送事件
+
+    同一任务的同一种事件只保留最新的一条，客户端读取较慢时不会积压，也不会拖慢下载线程。
+    """
+
+    def __init__(self):
+        self.pending = OrderedDict()
+        self.ready = asyncio.Event()
+
+    def push(self, event, data):
+        key = (event, data["id"])
+        self.pending.pop(key, None)
+        self.pending[key] = data
+        self.ready.set()
+
+    def take(self):
+        events = [(event, data) for (event, _), data in self.pending.items()]
+        self.pending.clear()
+        self.ready.clear()
+        return events
+
+
+class ApiServer:
+    """在独立线程的事件循环中运行HTTP接口，所有引擎操作都很轻量，不会阻塞事件循环"""
+
+    def __init__(self, engine, host="127.0.0.1", port=DEFAULT_PORT):
+        self.engine = engine
+        self.host = host
+        self.port = port
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._streams = set()
+        self._started = threading.Event()
+        self._error = None
+
+    def start(self):
+        """启动服务器线程，端口被占用等错误在这里抛出"""
+        self._thread = threading.Thread(target=self._run, name="api-server", daemon=True)
+        self._thread.start()
+        self._started.wait()
+        if self._error is not None:
+            raise self._error
+        self.engine.subscribe(self._on_event)
+        return self
+
+    def stop(self):
+        if self._loop is None:
+            return
+        self.engine.unsubscribe(self._on_event)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop = None
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            self._server = loop.run_until_complete(
+                asyncio.start_server(self._handle_connection, self.host, self.port, limit=MAX_HEADER_SIZE)
+            )
+        except OSError as e:
+            self._error = e
+            self._started.set()
+            loop.close()
+            return
+        # 端口为0时使用系统分配的端口
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._loop = loop
+        self._started.set()
+        try:
+            loop.run_forever()
+        finally:
+            self._server.close()
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.close()
+
+    def _on_event(self, event, job):
+        # 在下载线程中调用：先在当前线程生成快照，再交给事件循环
+        loop = self._loop
+        if loop is not None and self._streams:
+            loop.call_soon_threadsafe(self._broadcast, event, job.to_dict())
+
+    def _broadcast(self, event, data):
+        for stream in self._streams:
+            stream.push(event, data)
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            # HTTP/1.1连接默认保持，轮询状态的客户端不必每次重新建立连接
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, path, query, body, keep_alive = request
+                if method == "GET" and path == "/events":
+                    await self._stream_events(writer)
+                    break
+                try:
+                    if method == "GET" and path == "/metrics":
+                        self._write_body(
+                            writer, 200, "text/plain; version=0.0.4; charset=utf-8",
+                            self.engine.render_metrics().encode("utf-8"), keep_alive,
+                        )
+                    else:
+                        if method in ("POST", "PATCH", "DELETE"):
+                            # 写任务日志等操作放到线程池中，事件循环只处理网络读写
+                            status, payload = await asyncio.get_running_loop().run_in_executor(
+                                None, self._dispatch, method, path, query, body
+                            )
+                        else:
+                            status, payload = self._dispatch(method, path, query, body)
+                        self._write_json(writer, status, payload, keep_alive)
+                except HttpError as e:
+                    self._write_json(writer, e.status, {"error": str(e)}, keep_alive)
+                except Exception as e:
+                    # 引擎或数据库的意外错误也要给出响应，不能直接断开连接
+                    print("API request %s %s failed: %s: %s" % (method, path, type(e).__name__, e), file=sys.stderr)
+                    self._write_json(writer, 500, {"error": "内部错误: %s" % e}, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except HttpError as e:
+            self._write_json(writer, e.status, {"error": str(e)}, False)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        except asyncio.CancelledError:
+            # 服务器关闭时取消所有连接
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            return None
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ", 2)
+        except ValueError:
+            raise HttpError(400, "无效的请求行")
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            raise HttpError(400, "无效的Content-Length")
+        if length > MAX_BODY_SIZE:
+            raise HttpError(413, "请求体过大")
+        body = await reader.readexactly(length) if length else b""
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+        url = urlparse(target)
+        return method.upper(), url.path.rstrip("/") or "/", parse_qs(url.query), body, keep_alive
+
+    def _dispatch(self, method, path, query, body):
+        parts = path.strip("/").split("/")
+        if parts[0] != "jobs" or len(parts) > 3:
+            raise HttpError(404, "未知的路径")
+        if len(parts) == 1:
+            if method == "GET":
+                states = query.get("state")
+                jobs = [job.to_dict() for job in self.engine.get_jobs() if not states or job.state in states]
+                return 200, {"jobs": jobs}
+            if method == "POST":
+                return self._submit(body)
+            raise HttpError(405, "不支持的方法")
+        try:
+            job_id = int(parts[1])
+        except ValueError:
+            raise HttpError(404, "无效的任务id")
+        job = self.engine.jobs.get(job_id)
+        if job is None:
+            raise HttpError(404, "任务不存在")
+        if len(parts) == 3:
+            return self._control(method, job, parts[2])
+        if method == "GET":
+            return 200, job.to_dict()
+        if method == "PATCH":
+            priority = self._read_object(body).get("priority")
+            if not isinstance(priority, int) or isinstance(priority, bool):
+                raise HttpError(400, "priority必须是整数")
+            if not self.engine.set_priority(job_id, priority):
+                raise HttpError(409, "任务已结束")
+            return 200, job.to_dict()
+        if method == "DELETE":
+            if not self.engine.cancel(job_id):
+                # 按任务当前的状态说明原因：后处理中的任务很快结束，不支持取消
+                reason = "正在后处理" if job.state == DownloadJob.PROCESSING else "状态为%s" % job.state
+                raise HttpError(409, "任务%s，不能取消" % reason)
+            return 200, job.to_dict()
+        raise HttpError(405, "不支持的方法")
+
+    def _control(self, method, job, action):
+        if action not in ("pause", "resume"):
+            raise HttpError(404, "未知的路径")
+        if method != "POST":
+            raise HttpError(405, "不支持的方法")
+        if action == "pause" and not self.engine.pause(job.id):
+            raise HttpError(409, "任务不能暂停")
+        if action == "resume" and not self.engine.resume(job.id):
+            raise HttpError(409, "任务未暂停")
+        return 200, job.to_dict()
+
+    def _read_object(self, body):
+        try:
+            request = json.loads(body or b"{}")
+        except ValueError:
+            raise HttpError(400, "请求体不是有效的JSON")
+        if not isinstance(request, dict):
+            raise HttpError(400, "请求体必须是JSON对象")
+        return request
+
+    def _submit(self, body):
+        request = self._read_object(body)
+        urls = request.get("urls") or ([request["url"]] if request.get("url") else [])
+        if not isinstance(urls, list):
+            raise HttpError(400, "urls必须是数组")
+        if not urls or not all(isinstance(url, str) for url in urls):
+            raise HttpError(400, "缺少urls")
+        download_type = request.get("type", "视频")
+        if download_type not in ("视频", "音频"):
+            raise HttpError(400, "type只能是视频或音频")
+        profile = None
+        if request.get("profile") is not None:
+            try:
+                profile = FormatProfile.from_dict(request["profile"])
+            except ValueError as e:
+                raise HttpError(400, str(e))
+        priority = request.get("priority", 0)
+        if not isinstance(priority, int) or isinstance(priority, bool):
+            raise HttpError(400, "priority必须是整数")
+        if request.get("expand", True):
+            self.engine.add_batch(urls, download_type, profile, priority)
+            return 202, {"accepted": len(urls)}
+        return 201, {
+            "jobs": [self.engine.add(url, download_type, profile=profile, priority=priority) for url in urls]
+        }
+
+    def _write_json(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self._write_body(writer, status, "application/json; charset=utf-8", body, keep_alive)
+
+    def _write_body(self, writer, status, content_type, body, keep_alive):
+        writer.write(
+            (
+                "HTTP/1.1 %d %s\r\n"
+                "Content-Type: %s\r\n"
+                "Content-Length: %d\r\n"
+                "Connection: %s\r\n\r\n"
+                % (status, REASONS[status], content_type, len(body), "keep-alive" if keep_alive else "close")
+            ).encode("ascii")
+            + body
+        )
+
+    async def _stream_events(self, writer):
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream; charset=utf-8\r\n"
+            b"Cache-Control: no-cache\r\n"
+            b"Connection: close\r\n\r\n"
+        )
+        stream = EventStream()
+        # 先推送当前所有任务的状态，客户端不必另外查询
+        for job in self.engine.get_jobs():
+            stream.push("added", job.to_dict())
+        self._streams.add(stream)
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(stream.ready.wait(), HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    writer.write(b": keep-alive\n\n")
+                else:
+                    for event, data in stream.take():
+                        writer.write(
+                            ("event: %s\ndata: %s\n\n" % (event, json.dumps(data, ensure_ascii=False))).encode("utf-8")
+                        )
+                await writer.drain()
+        finally:
+            self._streams.discard(stream)
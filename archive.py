@@ -0,0 +1,158 @@
+import os
+import sqlite3
+import threading
+import time
+
+# 视为已下载媒体的扩展名
+VIDEO_EXTENSIONS = (".mp4", ".mkv", ".avi", ".webm")
+AUDIO_EXTENSIONS = (".mp3", ".m4a", ".opus", ".ogg", ".flac", ".wav")
+MEDIA_EXTENSIONS = VIDEO_EXTENSIONS + AUDIO_EXTENSIONS
+
+
+def get_title_key(title):
+    """与默认输出模板一致的文件名（不含扩展名），用于匹配扫描得到的已有文件"""
+    import yt_dlp
+
+    return yt_dlp.utils.sanitize_filename(title or "")
+
+
+class DownloadArchive:
+    """已下载文件的索引（sqlite），按提取器和视频id去重
+
+    首次打开时扫描视频/音频目录，已有文件只知道标题（文件名），
+    之后按标题命中时会补全提取器和视频id。
+    """
+
+    def __init__(self, path="archive.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS archive (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                extractor TEXT,
+                video_id TEXT,
+                download_type TEXT NOT NULL,
+                title_key TEXT,
+                path TEXT NOT NULL,
+                size INTEGER,
+                content_hash TEXT,
+                added_at REAL NOT NULL,
+                checksum TEXT
+            )
+            """
+        )
+        # 旧版本的索引没有checksum列
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(archive)")]
+        if "checksum" not in columns:
+            self._db.execute("ALTER TABLE archive ADD COLUMN checksum TEXT")
+        self._db.execute("CREATE INDEX IF NOT EXISTS archive_video ON archive (extractor, video_id, download_type)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS archive_title ON archive (download_type, title_key)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS archive_hash ON archive (content_hash)")
+        # 同一个文件可能对应多个视频id（重复上传的视频共用一份文件）
+        self._db.execute("CREATE INDEX IF NOT EXISTS archive_path ON archive (path)")
+        self._db.commit()
+
+    def seed(self, folders):
+        """扫描目录，把索引中没有的媒体文件加入索引，并删除文件已不存在的记录
+
+        folders为{下载类型: 目录}。
+        """
+        with self._lock:
+            known = {row[0] for row in self._db.execute("SELECT path FROM archive")}
+            found = set()
+            now = time.time()
+            for download_type, folder in folders.items():
+                if not os.path.isdir(folder):
+                    continue
+                for entry in os.scandir(folder):
+                    if not entry.is_file() or not entry.name.lower().endswith(MEDIA_EXTENSIONS):
+                        continue
+                    path = os.path.normpath(entry.path)
+                    found.add(path)
+                    if path in known:
+                        continue
+                    self._db.execute(
+                        "INSERT INTO archive (download_type, title_key, path, size, added_at) VALUES (?, ?, ?, ?, ?)",
+                        (download_type, os.path.splitext(entry.name)[0], path, entry.stat().st_size, now),
+                    )
+            for path in known - found:
+                if not os.path.exists(path):
+                    self._db.execute("DELETE FROM archive WHERE path = ?", (path,))
+            self._db.commit()
+
+    def find(self, info, download_type):
+        """返回元数据对应的已下载文件路径，没有则返回None"""
+        extractor = info.get("extractor_key") or info.get("ie_key")
+        video_id = info.get("id")
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, path FROM archive WHERE extractor = ? AND video_id = ? AND download_type = ?",
+                (extractor, video_id, download_type),
+            ).fetchall()
+            if not rows and info.get("title"):
+                # 扫描得到的文件只能按标题匹配，匹配后补全id
+                rows = self._db.execute(
+                    "SELECT id, path FROM archive WHERE extractor IS NULL AND download_type = ? AND title_key = ?",
+                    (download_type, get_title_key(info["title"])),
+                ).fetchall()
+                for row_id, _ in rows:
+                    self._db.execute(
+                        "UPDATE archive SET extractor = ?, video_id = ? WHERE id = ?", (extractor, video_id, row_id)
+                    )
+                self._db.commit()
+            for row_id, path in rows:
+                if os.path.exists(path):
+                    return path
+                self._db.execute("DELETE FROM archive WHERE id = ?", (row_id,))
+            self._db.commit()
+        return None
+
+    def find_by_hash(self, content_hash, exclude_path=None):
+        """返回内容哈希相同的已有文件路径，用于识别换了标题重新上传的视频"""
+        if not content_hash:
+            return None
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT path FROM archive WHERE content_hash = ? AND path != ?", (content_hash, exclude_path or "")
+            ).fetchall()
+        for (path,) in rows:
+            if os.path.exists(path):
+                return path
+        return None
+
+    def get_checksum(self, path):
+        """文件下载时记录的校验和（见hashing.CHECKSUM_ALGORITHM），扫描得到的文件没有校验和，返回None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT checksum FROM archive WHERE path = ? AND checksum IS NOT NULL LIMIT 1",
+                (os.path.normpath(path),),
+            ).fetchone()
+        return row[0] if row else None
+
+    def record(self, info, download_type, path, content_hash=None, checksum=None):
+        """记录下载完成的文件"""
+        path = os.path.normpath(path)
+        size = os.path.getsize(path) if os.path.exists(path) else None
+        extractor = info.get("extractor_key") or info.get("ie_key")
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM archive WHERE (extractor = ? AND video_id = ? AND download_type = ?)"
+                " OR (extractor IS NULL AND path = ?)",
+                (extractor, info.get("id"), download_type, path),
+            )
+            self._db.execute(
+                "INSERT INTO archive"
+                " (extractor, video_id, download_type, title_key, path, size, content_hash, added_at, checksum)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    extractor, info.get("id"), download_type,
+                    os.path.splitext(os.path.basename(path))[0], path, size, content_hash, time.time(), checksum,
+                ),
+            )
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
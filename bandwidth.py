@@ -0,0 +1,255 @@
+"""全局带宽调度：所有任务共享一个总速率上限，按权重分配，任务用不完的带宽分给其他任务
+
+每个任务有自己的令牌桶，调度器每隔REBALANCE_INTERVAL秒按实际用量重新分配速率（加权max-min公平）：
+实际速率明显低于分配速率的任务（受服务器限速等）只保留用量加余量，剩余带宽按权重分给其余任务；
+任务开始或结束时立即重新分配。下载线程在进度回调中领取令牌，令牌不足时睡眠，
+接收缓冲区填满后TCP会让服务器放慢发送，实际速率即被限制在分配的速率附近。
+"""
+import threading
+import time
+
+# 按用量重新分配的间隔（秒）
+REBALANCE_INTERVAL = 1.0
+# 令牌桶容量（秒），允许的突发量为速率×BURST_SECONDS
+BURST_SECONDS = 0.5
+# 实际速率低于分配速率的这个比例时，认为任务不需要更多带宽
+SATISFIED_RATIO = 0.9
+# 不需要更多带宽的任务保留的余量，速率上升时可以逐步恢复
+HEADROOM = 1.25
+# 单个任务的最低速率（字节/秒），避免分配到接近0后长时间无法恢复
+MIN_RATE = 16 * 1024
+# 单次睡眠的最长时间（秒），醒来后按重新分配后的速率计算剩余等待时间
+MAX_SLEEP = 0.25
+
+RATE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+def parse_rate(text):
+    """解析"2M"、"500K"、"1048576"等速率（字节/秒），0或空表示不限速"""
+    text = str(text or "0").strip().upper()
+    for suffix in ("/S", "B"):
+        if text.endswith(suffix):
+            text = text[:-len(suffix)]
+    unit = text[-1:] if text[-1:] in RATE_UNITS else ""
+    try:
+        value = float(text[:len(text) - len(unit)])
+    except ValueError:
+        raise ValueError("无效的速率: %s" % text)
+    if value < 0:
+        raise ValueError("无效的速率: %s" % text)
+    return int(value * RATE_UNITS[unit])
+
+
+def parse_time(text):
+    hours, _, minutes = text.strip().partition(":")
+    try:
+        hours, minutes = int(hours), int(minutes or 0)
+    except ValueError:
+        raise ValueError("无效的时间: %s" % text)
+    if not (0 <= hours <= 24 and 0 <= minutes < 60):
+        raise ValueError("无效的时间: %s" % text)
+    return hours * 60 + minutes
+
+
+def parse_schedule(text):
+    """解析分时段限速，如"08:00-23:00=1M,23:00-08:00=0"，返回[(开始分钟, 结束分钟, 速率)]"""
+    schedule = []
+    for item in filter(None, (part.strip() for part in (text or "").split(","))):
+        period, sep, rate = item.partition("=")
+        start, dash, end = period.partition("-")
+        if not sep or not dash:
+            raise ValueError("无效的时段: %s" % item)
+        schedule.append((parse_time(start), parse_time(end), parse_rate(rate)))
+    return schedule
+
+
+class TokenBucket:
+    """令牌桶：令牌以rate字节/秒的速度补充，允许欠账，欠账时返回需要等待的时间"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate * BURST_SECONDS
+        self._updated = time.monotonic()
+
+    def set_rate(self, rate):
+        self._refill(time.monotonic())
+        self.rate = rate
+        self.tokens = min(self.tokens, rate * BURST_SECONDS)
+
+    def take(self, count):
+        """领取count个令牌，返回需要睡眠的秒数"""
+        self.tokens -= count
+        return self.delay()
+
+    def delay(self):
+        """还清欠账需要等待的秒数"""
+        self._refill(time.monotonic())
+        return max(0, -self.tokens / self.rate)
+
+    def _refill(self, now):
+        self.tokens = min(self.rate * BURST_SECONDS, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class JobThrottle:
+    """单个任务的限速器，在下载线程的进度回调中调用update()"""
+
+    def __init__(self, scheduler, weight):
+        self.scheduler = scheduler
+        self.weight = weight
+        self.bucket = TokenBucket(MIN_RATE)
+        # 从这个时间起的用量才能反映需求：刚开始的任务还在建立连接，刚提速的任务还没达到新速率
+        self.measured_from = time.monotonic()
+        # 上次重新分配以来领取的字节数，以及测得的需求（None表示还需要更多带宽）
+        self.used = 0
+        self.demand = None
+        self._last_bytes = {}
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+
+    def update(self, d):
+        """根据yt_dlp风格的进度回调计算新下载的字节数，超出分配的速率时睡眠"""
+        if d.get("status") != "downloading" or not self.scheduler.limited:
+            return
+        filename = d.get("filename")
+        downloaded = d.get("downloaded_bytes") or 0
+        with self._lock:
+            # 并发下载分片时各线程上报的字节数可能回退，只统计超过已记录最大值的部分
+            count = downloaded - self._last_bytes.get(filename, 0)
+            if count > 0:
+                self._last_bytes[filename] = downloaded
+        if count > 0:
+            delay = self.scheduler.consume(self, count)
+            # 分段睡眠，等待期间分配的速率变化时按新速率计算；取消任务时立即醒来
+            while delay and not self._cancelled.wait(min(delay, MAX_SLEEP)):
+                delay = self.scheduler.delay(self)
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def close(self):
+        self.scheduler.unregister(self)
+
+
+class BandwidthScheduler:
+    """所有任务共享的速率上限，rate为0且没有匹配的时段时不限速"""
+
+    def __init__(self, rate=0, schedule=None):
+        self.rate = rate
+        # [(开始分钟, 结束分钟, 速率)]，结束早于开始时跨过午夜
+        self.schedule = list(schedule or [])
+        self.limited = False
+        self._throttles = []
+        self._limit = 0
+        self._rebalanced_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._refresh_limit()
+
+    def set_rate(self, rate):
+        with self._lock:
+            self.rate = rate
+            self._refresh_limit()
+            self._allocate()
+
+    def set_schedule(self, schedule):
+        with self._lock:
+            self.schedule = list(schedule)
+            self._refresh_limit()
+            self._allocate()
+
+    def current_limit(self):
+        """当前时段的速率上限（字节/秒），0表示不限速"""
+        now = time.localtime()
+        minute = now.tm_hour * 60 + now.tm_min
+        for start, end, rate in self.schedule:
+            if start <= minute < end or (end < start and (minute >= start or minute < end)):
+                return rate
+        return self.rate
+
+    def register(self, weight=1):
+        """任务开始下载时登记，返回该任务的JobThrottle"""
+        throttle = JobThrottle(self, weight)
+        with self._lock:
+            self._throttles.append(throttle)
+            self._allocate()
+        return throttle
+
+    def unregister(self, throttle):
+        """任务结束时注销，它的份额立即分给其余任务"""
+        with self._lock:
+            if throttle in self._throttles:
+                self._throttles.remove(throttle)
+                self._allocate()
+
+    def set_weight(self, throttle, weight):
+        with self._lock:
+            throttle.weight = weight
+            self._allocate()
+
+    def consume(self, throttle, count):
+        """领取count字节的令牌，返回需要睡眠的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._rebalanced_at >= REBALANCE_INTERVAL:
+                self._rebalance(now)
+            if not self._limit:
+                return 0
+            throttle.used += count
+            return throttle.bucket.take(count)
+
+    def delay(self, throttle):
+        """任务还需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._rebalanced_at >= REBALANCE_INTERVAL:
+                self._rebalance(now)
+            if not self._limit:
+                return 0
+            return throttle.bucket.delay()
+
+    def _refresh_limit(self):
+        self._limit = self.current_limit()
+        self.limited = bool(self._limit or self.schedule)
+
+    def _rebalance(self, now):
+        elapsed = now - self._rebalanced_at
+        for throttle in self._throttles:
+            usage = throttle.used / elapsed
+            throttle.used = 0
+            # 没用完分配的速率说明瓶颈在别处，只按实际用量分配；不限速期间不统计用量
+            measured = self._limit and throttle.measured_from <= self._rebalanced_at
+            throttle.demand = usage if measured and usage < throttle.bucket.rate * SATISFIED_RATIO else None
+        self._rebalanced_at = now
+        # 分时段限速在这里切换
+        self._refresh_limit()
+        self._allocate()
+
+    def _allocate(self):
+        """加权max-min公平分配：需求低于份额的任务按需求分配，剩余带宽按权重分给其余任务"""
+        if not self._limit or not self._throttles:
+            return
+        remaining = self._limit
+        unsatisfied = list(self._throttles)
+        while unsatisfied:
+            total_weight = sum(throttle.weight for throttle in unsatisfied)
+            satisfied = [
+                throttle for throttle in unsatisfied
+                if throttle.demand is not None
+                and throttle.demand * HEADROOM < remaining * throttle.weight / total_weight
+            ]
+            if not satisfied:
+                break
+            for throttle in satisfied:
+                rate = max(MIN_RATE, throttle.demand * HEADROOM)
+                self._set_rate(throttle, rate)
+                remaining -= rate
+                unsatisfied.remove(throttle)
+        if unsatisfied:
+            total_weight = sum(throttle.weight for throttle in unsatisfied)
+            for throttle in unsatisfied:
+                self._set_rate(throttle, max(MIN_RATE, remaining * throttle.weight / total_weight))
+
+    def _set_rate(self, throttle, rate):
+        if rate > throttle.bucket.rate:
+            throttle.measured_from = time.monotonic()
+        throttle.bucket.set_rate(rate)
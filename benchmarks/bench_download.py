@@ -0,0 +1,254 @@
+"""下载基准：在本地媒体服务器上测量直链、分段、HLS和DASH下载的性能
+
+每次下载在新的Python进程和新的临时工作目录中进行，用yt_dlp的通用提取器解析本地链接，
+再经engine.Downloader（core.DownloadThread使用的同一下载器，不需要Qt）下载，只测量下载阶段，不执行合并。
+每个任务记录：吞吐量、首字节时间、CPU时间、峰值内存、进度回调和进度快照的频率。
+
+结果以JSON写入 --output，记录提交号和参数，可以用 --compare 与另一次的结果对比；
+吞吐量下降超过 --max-regression 时以非零状态退出。
+
+用法：
+    python benchmarks/bench_download.py --runs 3 --bandwidth 8 --error-rate 0.02 --output results.json
+    python benchmarks/bench_download.py --compare results.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.local_server import LocalMediaServer  # noqa: E402
+
+SCENARIOS = ("progressive", "segmented", "hls", "dash")
+# 参与对比的指标，True表示越大越好
+METRICS = {
+    "throughput_mbps": True,
+    "ttfb_seconds": False,
+    "cpu_seconds": False,
+    "peak_rss_mb": False,
+    "progress_events_per_second": False,
+}
+
+# 子进程：下载一个链接，最后一行输出JSON格式的测量结果
+JOB_SCRIPT = """
+import json, os, sys, time
+sys.path.insert(0, %(root)r)
+from engine import Downloader
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux上单位为KB，macOS上为字节
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+class BenchDownloader(Downloader):
+    hook_events = 0
+    first_byte = None
+
+    def my_hook(self, d):
+        self.hook_events += 1
+        if self.first_byte is None and d.get("downloaded_bytes"):
+            self.first_byte = time.monotonic()
+        super().my_hook(d)
+
+
+snapshots = []
+downloader = BenchDownloader(%(url)r, "视频", "%%(title)s.%%(ext)s", connections=%(connections)d,
+                             on_progress=snapshots.append)
+downloader.ydl_opts.update(quiet=True, noprogress=True)
+import yt_dlp.version
+
+baseline_rss = peak_rss_mb()
+cpu_started = time.process_time()
+started = time.monotonic()
+success = downloader.run()
+wall = time.monotonic() - started
+cpu = time.process_time() - cpu_started
+size = sum(os.path.getsize(name) for name in os.listdir(".") if os.path.isfile(name))
+download_seconds = downloader.timings.get("下载") or wall
+print(json.dumps({
+    "success": success,
+    "error": downloader.error,
+    "plan": downloader.plan,
+    "retries": sum(downloader.retries.values()),
+    "yt_dlp": yt_dlp.version.__version__,
+    "bytes": size,
+    "wall_seconds": wall,
+    "extract_seconds": downloader.timings.get("解析"),
+    "download_seconds": download_seconds,
+    "throughput_mbps": size / download_seconds / 1e6 if download_seconds else None,
+    "ttfb_seconds": downloader.first_byte - started if downloader.first_byte else None,
+    "cpu_seconds": cpu,
+    "cpu_percent": 100 * cpu / wall if wall else None,
+    "baseline_rss_mb": baseline_rss,
+    "peak_rss_mb": peak_rss_mb(),
+    "hook_events_per_second": downloader.hook_events / wall if wall else None,
+    "progress_events_per_second": len(snapshots) / wall if wall else None,
+}), flush=True)
+"""
+
+
+def scenario_url(name, server, args):
+    """返回(链接, 连接数)"""
+    if name in ("progressive", "segmented"):
+        url = "%s/file/%d.mp4" % (server.base_url, args.size * 1024 * 1024)
+        return url, 1 if name == "progressive" else args.connections
+    playlist = "index.m3u8" if name == "hls" else "manifest.mpd"
+    return "%s/%s/%dx%d/%s" % (server.base_url, name, args.fragments, args.fragment_size * 1024, playlist), \
+        args.connections
+
+
+def run_job(url, connections, timeout=600):
+    with tempfile.TemporaryDirectory() as workdir:
+        result = subprocess.run(
+            [sys.executable, "-c", JOB_SCRIPT % {"root": ROOT, "url": url, "connections": connections}],
+            cwd=workdir, capture_output=True, text=True, timeout=timeout,
+        )
+    lines = result.stdout.strip().splitlines()
+    if result.returncode != 0 or not lines:
+        return {"success": False, "error": (result.stderr.strip().splitlines() or ["子进程没有输出"])[-1]}
+    return json.loads(lines[-1])
+
+
+def median(runs, key):
+    values = [run[key] for run in runs if run.get("success") and run.get(key) is not None]
+    return statistics.median(values) if values else None
+
+
+def bench_scenario(name, server, args):
+    url, connections = scenario_url(name, server, args)
+    runs = []
+    for _ in range(args.runs):
+        server.reset_stats()
+        run = run_job(url, connections)
+        run["server"] = dict(server.stats)
+        runs.append(run)
+    sample = next((run for run in runs if run.get("success")), {})
+    keys = [key for key, value in sample.items() if isinstance(value, (int, float)) and not isinstance(value, bool)]
+    return {
+        "url": url,
+        "connections": connections,
+        "failures": sum(1 for run in runs if not run.get("success")),
+        "median": {key: median(runs, key) for key in keys},
+        "runs": runs,
+    }
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, capture_output=True, text=True
+        ).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def compare(baseline, results, max_regression):
+    """输出与基准结果的对比，返回吞吐量下降超过max_regression%的场景"""
+    regressions = []
+    print("对比基准 %s" % (baseline.get("commit") or "未知提交")[:12])
+    for name, scenario in results["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if old is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            before, after = old["median"].get(metric), scenario["median"].get(metric)
+            if not before or after is None:
+                continue
+            change = 100.0 * (after - before) / before
+            worse = change < 0 if higher_is_better else change > 0
+            print("  %-12s %-28s %10.3f → %10.3f  %+6.1f%%%s" % (
+                name, metric, before, after, change, "  变差" if worse and abs(change) >= 5 else "",
+            ))
+            if metric == "throughput_mbps" and max_regression is not None and -change > max_regression:
+                regressions.append("%s 吞吐量下降 %.1f%%" % (name, -change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS), help="要测量的场景")
+    parser.add_argument("--runs", type=int, default=3, help="每个场景的测量次数，结果取中位数")
+    parser.add_argument("--size", type=int, default=32, help="直链文件大小（MB）")
+    parser.add_argument("--fragments", type=int, default=32, help="HLS/DASH分片数量")
+    parser.add_argument("--fragment-size", type=int, default=512, help="HLS/DASH视频分片大小（KB）")
+    parser.add_argument("--connections", type=int, default=8, help="分段和分片下载的连接数")
+    parser.add_argument("--latency", type=float, default=0.02, help="每个请求的延迟（秒）")
+    parser.add_argument("--bandwidth", type=float, default=0, help="单连接带宽（MB/s，0表示不限）")
+    parser.add_argument("--error-rate", type=float, default=0, help="媒体请求返回503的概率")
+    parser.add_argument("--drop-rate", type=float, default=0, help="媒体请求中途断开的概率")
+    parser.add_argument("--seed", type=int, default=0, help="故障注入的随机种子")
+    parser.add_argument("--output", help="把结果写入JSON文件")
+    parser.add_argument("--compare", metavar="JSON", help="与之前保存的结果对比")
+    parser.add_argument("--max-regression", type=float, help="吞吐量下降超过这个百分比时以非零状态退出")
+    args = parser.parse_args()
+
+    if subprocess.run([sys.executable, "-c", "import yt_dlp"], capture_output=True).returncode != 0:
+        print("未安装yt_dlp，无法运行下载基准", file=sys.stderr)
+        sys.exit(2)
+    commit, dirty = git_revision()
+    results = {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {
+            key: getattr(args, key) for key in (
+                "runs", "size", "fragments", "fragment_size", "connections", "latency", "bandwidth",
+                "error_rate", "drop_rate", "seed",
+            )
+        },
+        "scenarios": {},
+    }
+    server = LocalMediaServer(
+        latency=args.latency, bandwidth=int(args.bandwidth * 1e6), error_rate=args.error_rate,
+        drop_rate=args.drop_rate, seed=args.seed,
+    ).start()
+    try:
+        for name in args.scenarios:
+            scenario = bench_scenario(name, server, args)
+            results["scenarios"][name] = scenario
+            summary = scenario["median"]
+            print("%-12s %8s MB/s  首字节 %6s 秒  CPU %6s 秒  内存 %7s MB  进度 %6s 次/秒  失败 %d/%d" % (
+                name, format_number(summary.get("throughput_mbps")), format_number(summary.get("ttfb_seconds")),
+                format_number(summary.get("cpu_seconds")), format_number(summary.get("peak_rss_mb")),
+                format_number(summary.get("progress_events_per_second")), scenario["failures"], args.runs,
+            ))
+    finally:
+        server.stop()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    regressions = []
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(json.load(f), results, args.max_regression)
+        for regression in regressions:
+            print("性能回退：" + regression)
+    sys.exit(1 if regressions else 0)
+
+
+def format_number(value):
+    return "-" if value is None else "%.2f" % value
+
+
+if __name__ == "__main__":
+    main()
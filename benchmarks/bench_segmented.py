@@ -0,0 +1,84 @@
+"""分段下载基准：对比单连接与多连接下载直链文件和HLS分片
+
+用法：
+    python benchmarks/bench_segmented.py --size 64 --connections 8 --bandwidth 4
+"""
+import argparse
+import importlib.util
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.local_server import LocalMediaServer, expected_bytes  # noqa: E402
+from segmented import SegmentedDownloader  # noqa: E402
+
+
+def bench_file(url, size, connections, workdir):
+    filename = os.path.join(workdir, "file-%d.mp4" % connections)
+    started = time.monotonic()
+    SegmentedDownloader(url, filename, segments=connections, min_segment_size=256 * 1024).download()
+    elapsed = time.monotonic() - started
+    with open(filename, "rb") as f:
+        assert f.read() == expected_bytes(size), "下载内容与源文件不一致"
+    os.remove(filename)
+    return elapsed
+
+
+def bench_hls(url, total, connections, workdir):
+    import yt_dlp
+
+    ydl_opts = {
+        "quiet": True,
+        "outtmpl": os.path.join(workdir, "hls-%d.%%(ext)s" % connections),
+        "concurrent_fragment_downloads": connections,
+        "fixup": "never",
+    }
+    started = time.monotonic()
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=True)
+        filename = ydl.prepare_filename(info)
+    elapsed = time.monotonic() - started
+    assert os.path.getsize(filename) == total, "分片拼接后的大小不正确"
+    os.remove(filename)
+    return elapsed
+
+
+def report(name, connections, size, elapsed):
+    print("%-6s 连接数=%-3d %8.2f 秒 %8.2f MB/s" % (name, connections, elapsed, size / elapsed / 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=64, help="直链文件大小（MB）")
+    parser.add_argument("--fragments", type=int, default=64, help="HLS分片数量")
+    parser.add_argument("--fragment-size", type=int, default=512, help="HLS分片大小（KB）")
+    parser.add_argument("--connections", type=int, default=8, help="多连接模式的连接数")
+    parser.add_argument("--latency", type=float, default=0.02, help="每个请求的延迟（秒）")
+    parser.add_argument("--bandwidth", type=float, default=4, help="单连接带宽（MB/s，0表示不限）")
+    args = parser.parse_args()
+
+    server = LocalMediaServer(latency=args.latency, bandwidth=int(args.bandwidth * 1e6)).start()
+    size = args.size * 1024 * 1024
+    fragment_size = args.fragment_size * 1024
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            file_url = "%s/file/%d.mp4" % (server.base_url, size)
+            for connections in (1, args.connections):
+                report("直链", connections, size, bench_file(file_url, size, connections, workdir))
+            # 与bench_download.py相同，只检查yt_dlp是否可用，不在这里导入
+            if importlib.util.find_spec("yt_dlp") is None:
+                print("未安装yt_dlp，跳过HLS基准", file=sys.stderr)
+                return
+            hls_url = "%s/hls/%dx%d/index.m3u8" % (server.base_url, args.fragments, fragment_size)
+            total = args.fragments * fragment_size
+            for connections in (1, args.connections):
+                report("HLS", connections, total, bench_hls(hls_url, total, connections, workdir))
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
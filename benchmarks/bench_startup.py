@@ -0,0 +1,176 @@
+"""启动时间基准：测量冷启动到窗口首次绘制、到第一个下载开始传输数据的时间
+
+每次测量都在新的Python进程和新的临时工作目录中进行，时间从启动子进程开始计算。
+超过 --max-paint / --max-download 预算时以非零状态退出，可用于发现启动时间的回退。
+
+用法：
+    python benchmarks/bench_startup.py --runs 5 --max-paint 1.5 --max-download 3
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.local_server import LocalMediaServer  # noqa: E402
+
+# 子进程：创建主窗口，第一次收到绘制事件时输出时间
+PAINT_SCRIPT = """
+import json, sys, time
+sys.path.insert(0, %(root)r)
+from PyQt5.QtCore import QEvent, QObject, QTimer
+from PyQt5.QtWidgets import QApplication
+
+app = QApplication(sys.argv)
+from ui import MainWindow
+
+
+class FirstPaint(QObject):
+    def __init__(self):
+        super().__init__()
+        self.painted = False
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Paint and not self.painted:
+            self.painted = True
+            print(json.dumps({"paint": time.time(), "yt_dlp_loaded": "yt_dlp" in sys.modules}), flush=True)
+            QTimer.singleShot(0, app.quit)
+        return False
+
+
+first_paint = FirstPaint()
+app.installEventFilter(first_paint)
+window = MainWindow()
+window.show()
+app.exec_()
+window.close()
+"""
+
+# 子进程：用下载引擎下载一个本地文件，输出开始传输数据和下载完成的时间
+DOWNLOAD_SCRIPT = """
+import json, sys, threading, time
+sys.path.insert(0, %(root)r)
+from engine import DownloadEngine, DownloadJob
+
+times = {}
+done = threading.Event()
+
+
+def on_event(event, job):
+    if "first_byte" not in times and job.progress > 0:
+        times["first_byte"] = time.time()
+    if event == "finished":
+        times["finished"] = time.time()
+        times["success"] = job.state == DownloadJob.DONE
+        done.set()
+
+
+engine = DownloadEngine("视频", "音频", connections=%(connections)d)
+engine.subscribe(on_event)
+engine.add(%(url)r, "视频")
+done.wait(120)
+print(json.dumps(times), flush=True)
+"""
+
+
+def run_child(script, timeout=120):
+    """在新的工作目录中运行子进程，返回(启动时间, 子进程输出的最后一行JSON)"""
+    env = dict(os.environ)
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    with tempfile.TemporaryDirectory() as workdir:
+        started = time.time()
+        result = subprocess.run(
+            [sys.executable, "-c", script], cwd=workdir, env=env, capture_output=True, text=True, timeout=timeout
+        )
+    if result.returncode != 0 or not result.stdout.strip():
+        raise RuntimeError(result.stderr.strip() or "子进程没有输出")
+    return started, json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def bench_paint(runs):
+    samples = []
+    loaded = False
+    for _ in range(runs):
+        started, data = run_child(PAINT_SCRIPT % {"root": ROOT})
+        samples.append(data["paint"] - started)
+        loaded = loaded or data["yt_dlp_loaded"]
+    return {"median": statistics.median(samples), "samples": samples, "yt_dlp_loaded_before_paint": loaded}
+
+
+def bench_download(runs, url, connections):
+    first_byte, finished = [], []
+    for _ in range(runs):
+        started, data = run_child(DOWNLOAD_SCRIPT % {"root": ROOT, "url": url, "connections": connections})
+        if not data.get("success"):
+            raise RuntimeError("下载失败：%s" % url)
+        first_byte.append(data["first_byte"] - started)
+        finished.append(data["finished"] - started)
+    return {
+        "first_byte_median": statistics.median(first_byte),
+        "finished_median": statistics.median(finished),
+        "first_byte_samples": first_byte,
+        "finished_samples": finished,
+    }
+
+
+def module_available(name):
+    return subprocess.run([sys.executable, "-c", "import %s" % name], capture_output=True).returncode == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="每项测量的次数，结果取中位数")
+    parser.add_argument("--size", type=int, default=4, help="下载测试文件大小（MB）")
+    parser.add_argument("--connections", type=int, default=8, help="每个任务的连接数")
+    parser.add_argument("--max-paint", type=float, help="首次绘制时间预算（秒）")
+    parser.add_argument("--max-download", type=float, help="开始传输数据时间预算（秒）")
+    parser.add_argument("--json", action="store_true", help="以JSON输出结果")
+    args = parser.parse_args()
+
+    results = {}
+    if module_available("PyQt5"):
+        results["first_paint"] = bench_paint(args.runs)
+    else:
+        print("未安装PyQt5，跳过首次绘制测量", file=sys.stderr)
+    if module_available("yt_dlp"):
+        server = LocalMediaServer().start()
+        try:
+            url = "%s/file/%d.mp4" % (server.base_url, args.size * 1024 * 1024)
+            results["first_download"] = bench_download(args.runs, url, args.connections)
+        finally:
+            server.stop()
+    else:
+        print("未安装yt_dlp，跳过首次下载测量", file=sys.stderr)
+
+    failures = []
+    paint = results.get("first_paint")
+    if paint:
+        if args.max_paint is not None and paint["median"] > args.max_paint:
+            failures.append("首次绘制 %.3f 秒，超过预算 %.3f 秒" % (paint["median"], args.max_paint))
+        if paint["yt_dlp_loaded_before_paint"]:
+            failures.append("首次绘制前已导入yt_dlp")
+    download = results.get("first_download")
+    if download and args.max_download is not None and download["first_byte_median"] > args.max_download:
+        failures.append("开始传输数据 %.3f 秒，超过预算 %.3f 秒" % (download["first_byte_median"], args.max_download))
+
+    if args.json:
+        print(json.dumps(dict(results, failures=failures), ensure_ascii=False, indent=2))
+    else:
+        if paint:
+            print("首次绘制      %8.3f 秒" % paint["median"])
+        if download:
+            print("开始传输数据  %8.3f 秒" % download["first_byte_median"])
+            print("下载完成      %8.3f 秒" % download["finished_median"])
+        for failure in failures:
+            print("超出预算：" + failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""界面刷新基准：模拟大量任务同时下载，测量界面线程的CPU占用
+
+在临时工作目录中创建主窗口，直接向下载队列加入模拟任务（不联网、不下载），
+每个任务在自己的线程中按 --rate 次/秒更新进度并发出引擎事件，与真实下载的进度回调相同；
+运行 --duration 秒后所有任务结束。界面线程的CPU时间用time.thread_time()在界面线程中测量。
+超过 --max-cpu 预算（百分比）时以非零状态退出。
+
+用法：
+    python benchmarks/bench_ui.py --jobs 50 --rate 10 --duration 10 --max-cpu 5
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def simulate(engine, job, rate, duration, stop):
+    """模拟一个任务的下载过程：进度从0增长到100，速度和剩余时间随机波动"""
+    from engine import DownloadJob
+    from progress import PHASE_DOWNLOADING
+
+    started = time.monotonic()
+    job.state = DownloadJob.RUNNING
+    engine._notify("updated", job)
+    while not stop.is_set():
+        elapsed = time.monotonic() - started
+        if elapsed >= duration:
+            break
+        job.phase = PHASE_DOWNLOADING
+        job.progress = 100.0 * elapsed / duration
+        job.speed = random.uniform(1, 10) * 1024 * 1024
+        job.eta = duration - elapsed
+        engine._notify("updated", job)
+        stop.wait(1 / rate)
+    job.phase = job.speed = job.eta = None
+    job.progress = 100.0
+    job.state = DownloadJob.DONE
+    job.timings = {"下载": duration}
+    job.plan = "直接使用 (mp4)"
+    engine._notify("updated", job)
+    engine._notify("finished", job)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=50, help="同时下载的任务数")
+    parser.add_argument("--rate", type=float, default=10, help="每个任务每秒的进度事件数")
+    parser.add_argument("--duration", type=float, default=10, help="每个任务的下载时间（秒）")
+    parser.add_argument("--max-cpu", type=float, help="界面线程CPU占用预算（百分比）")
+    parser.add_argument("--json", action="store_true", help="以JSON输出结果")
+    args = parser.parse_args()
+
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    os.chdir(tempfile.mkdtemp(prefix="bench_ui_"))
+    from PyQt5.QtCore import QTimer
+    from PyQt5.QtWidgets import QApplication
+
+    app = QApplication(sys.argv[:1])
+    from engine import DownloadJob
+    from ui import MainWindow
+
+    window = MainWindow()
+    window.show()
+    engine = window.download_queue.engine
+    stop = threading.Event()
+    threads = []
+    result = {}
+
+    def start():
+        for i in range(args.jobs):
+            job = DownloadJob(-1 - i, "http://127.0.0.1/file/%d.mp4" % i, "视频", None, title="任务 %d" % i)
+            with engine._lock:
+                engine.jobs[job.id] = job
+            engine._notify("added", job)
+            thread = threading.Thread(target=simulate, args=(engine, job, args.rate, args.duration, stop), daemon=True)
+            thread.start()
+            threads.append(thread)
+        result["wall"] = time.monotonic()
+        result["cpu"] = time.thread_time()
+        QTimer.singleShot(int(args.duration * 1000) + 500, finish)
+
+    def finish():
+        result["wall"] = time.monotonic() - result["wall"]
+        result["cpu"] = time.thread_time() - result["cpu"]
+        stop.set()
+        app.quit()
+
+    # 窗口显示并完成启动后的后台工作后再开始计时
+    QTimer.singleShot(1000, start)
+    app.exec_()
+    window.close()
+
+    events = args.jobs * args.rate * args.duration
+    report = {
+        "jobs": args.jobs,
+        "events": int(events),
+        "ui_cpu_seconds": round(result["cpu"], 3),
+        "ui_cpu_percent": round(100 * result["cpu"] / result["wall"], 2),
+    }
+    if args.json:
+        print(json.dumps(report))
+    else:
+        print("%d个任务，约%d个进度事件，界面线程CPU %.2f秒（%.2f%%）" % (
+            report["jobs"], report["events"], report["ui_cpu_seconds"], report["ui_cpu_percent"],
+        ))
+    if args.max_cpu is not None and report["ui_cpu_percent"] > args.max_cpu:
+        print("界面线程CPU占用超出预算 %.2f%%" % args.max_cpu, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
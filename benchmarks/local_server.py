@@ -0,0 +1,234 @@
+"""本地测试用媒体服务器：提供支持Range的合成文件、HLS播放列表和DASH清单
+
+路由：
+    /file/<字节数>.mp4                        单个文件，支持Range请求
+    /hls/<分片数>x<分片字节数>/index.m3u8       HLS媒体播放列表
+    /hls/<分片数>x<分片字节数>/seg<序号>.ts      HLS分片
+    /dash/<分片数>x<分片字节数>/manifest.mpd    DASH清单，含一路视频和一路音频（音频分片为视频的1/8）
+    /dash/<分片数>x<分片字节数>/<v|a>/init.mp4  DASH初始化分片
+    /dash/<分片数>x<分片字节数>/<v|a>/seg<序号>.m4s DASH分片
+
+可以模拟请求延迟、单连接带宽和故障：媒体请求（文件和分片，不含播放列表/清单）按error_rate返回503，
+按drop_rate只发送一半内容后断开连接。
+"""
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 合成内容的基本块，第i个字节为 i % 251，便于校验下载结果
+PATTERN = bytes(i % 251 for i in range(251 * 256))
+WRITE_SIZE = 64 * 1024
+
+
+def synthetic_bytes(start, end):
+    """生成[start, end)区间的合成内容，分块返回"""
+    offset = start
+    while offset < end:
+        pattern_offset = offset % 251
+        size = min(WRITE_SIZE, end - offset, len(PATTERN) - pattern_offset)
+        yield PATTERN[pattern_offset:pattern_offset + size]
+        offset += size
+
+
+def expected_bytes(size):
+    return b"".join(synthetic_bytes(0, size))
+
+
+def dash_sizes(segments, segment_size):
+    """DASH清单中视频、音频两路的总字节数（含初始化分片）"""
+    audio_size = max(1, segment_size // 8)
+    return (DASH_INIT_SIZE + segments * segment_size, DASH_INIT_SIZE + segments * audio_size)
+
+
+# DASH初始化分片的大小，以及每个分片的时长（秒）
+DASH_INIT_SIZE = 1024
+SEGMENT_DURATION = 4
+
+MPD_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" profiles="urn:mpeg:dash:profile:isoff-live:2011"
+     minBufferTime="PT2S" mediaPresentationDuration="PT%(duration)dS">
+  <Period id="0" start="PT0S">
+    <AdaptationSet contentType="video" mimeType="video/mp4" segmentAlignment="true">
+      <Representation id="v" codecs="avc1.64001f" width="1280" height="720" frameRate="30"
+                      bandwidth="%(video_bandwidth)d">
+        <SegmentTemplate timescale="1" duration="%(segment_duration)d" startNumber="0"
+                         initialization="v/init.mp4" media="v/seg$Number$.m4s"/>
+      </Representation>
+    </AdaptationSet>
+    <AdaptationSet contentType="audio" mimeType="audio/mp4" lang="und" segmentAlignment="true">
+      <Representation id="a" codecs="mp4a.40.2" audioSamplingRate="44100" bandwidth="%(audio_bandwidth)d">
+        <SegmentTemplate timescale="1" duration="%(segment_duration)d" startNumber="0"
+                         initialization="a/init.mp4" media="a/seg$Number$.m4s"/>
+      </Representation>
+    </AdaptationSet>
+  </Period>
+</MPD>
+"""
+
+
+class MediaRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.handle_request(send_body=False)
+
+    def do_GET(self):
+        self.handle_request(send_body=True)
+
+    def handle_request(self, send_body):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        match = re.fullmatch(r"/file/(\d+)\.mp4", self.path)
+        if match:
+            return self.send_media(int(match.group(1)), "video/mp4", send_body)
+        match = re.fullmatch(r"/hls/(\d+)x(\d+)/index\.m3u8", self.path)
+        if match:
+            return self.send_playlist(int(match.group(1)), send_body)
+        match = re.fullmatch(r"/hls/(\d+)x(\d+)/seg(\d+)\.ts", self.path)
+        if match and int(match.group(3)) < int(match.group(1)):
+            return self.send_media(int(match.group(2)), "video/mp2t", send_body)
+        match = re.fullmatch(r"/dash/(\d+)x(\d+)/manifest\.mpd", self.path)
+        if match:
+            return self.send_manifest(int(match.group(1)), int(match.group(2)), send_body)
+        match = re.fullmatch(r"/dash/(\d+)x(\d+)/([va])/(?:init\.mp4|seg(\d+)\.m4s)", self.path)
+        if match and (match.group(4) is None or int(match.group(4)) < int(match.group(1))):
+            size = int(match.group(2)) if match.group(3) == "v" else max(1, int(match.group(2)) // 8)
+            if match.group(4) is None:
+                size = DASH_INIT_SIZE
+            return self.send_media(size, "video/mp4" if match.group(3) == "v" else "audio/mp4", send_body)
+        self.send_error(404)
+
+    def send_text(self, body, content_type, send_body):
+        body = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def send_manifest(self, segments, segment_size, send_body):
+        self.send_text(MPD_TEMPLATE % {
+            "duration": segments * SEGMENT_DURATION,
+            "segment_duration": SEGMENT_DURATION,
+            "video_bandwidth": segment_size * 8 // SEGMENT_DURATION,
+            "audio_bandwidth": max(1, segment_size // 8) * 8 // SEGMENT_DURATION,
+        }, "application/dash+xml", send_body)
+
+    def send_playlist(self, segments, send_body):
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:4", "#EXT-X-MEDIA-SEQUENCE:0"]
+        for index in range(segments):
+            lines += ["#EXTINF:4.0,", "seg%d.ts" % index]
+        lines.append("#EXT-X-ENDLIST")
+        self.send_text("\n".join(lines) + "\n", "application/vnd.apple.mpegurl", send_body)
+
+    def send_media(self, size, content_type, send_body):
+        fault = self.server.inject_fault()
+        if fault == "error":
+            self.server.count("errors")
+            self.send_error(503)
+            return
+        self.server.count("media_requests")
+        start, end = 0, size
+        match = re.fullmatch(r"bytes=(\d*)-(\d*)", self.headers.get("Range", ""))
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)) + 1, size) if match.group(2) else size
+            else:
+                start = max(0, size - int(match.group(2)))
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */%d" % size)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes %d-%d/%d" % (start, end - 1, size))
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start))
+        self.end_headers()
+        if not send_body:
+            return
+        # 断开连接的故障只发送一半内容，客户端会收到不完整的响应
+        limit = start + (end - start) // 2 if fault == "drop" else end
+        started = time.monotonic()
+        sent = 0
+        for chunk in synthetic_bytes(start, limit):
+            self.wfile.write(chunk)
+            sent += len(chunk)
+            self.server.count("bytes_sent", len(chunk))
+            if self.server.bandwidth:
+                # 按单连接带宽限速，模拟CDN对单连接的限速
+                delay = sent / self.server.bandwidth - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+        if fault == "drop":
+            self.server.count("drops")
+            self.close_connection = True
+
+
+class LocalMediaServer(ThreadingHTTPServer):
+    """latency为每个请求的延迟（秒），bandwidth为单连接带宽（字节/秒，0表示不限）
+
+    error_rate和drop_rate为媒体请求返回503和中途断开的概率，seed固定时故障序列可以复现。
+    """
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, bandwidth=0, error_rate=0.0, drop_rate=0.0, seed=0):
+        super().__init__((host, port), MediaRequestHandler)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        # 请求数、注入的故障数和发送的字节数
+        self.stats = {"media_requests": 0, "errors": 0, "drops": 0, "bytes_sent": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def inject_fault(self):
+        """按概率返回"error"、"drop"或None"""
+        with self._lock:
+            value = self._random.random()
+        if value < self.error_rate:
+            return "error"
+        if value < self.error_rate + self.drop_rate:
+            return "drop"
+        return None
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.stats[name] += value
+
+    def reset_stats(self):
+        with self._lock:
+            for name in self.stats:
+                self.stats[name] = 0
+
+    def handle_error(self, request, client_address):
+        # 客户端中途断开连接是正常情况（例如取消下载），不打印异常
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+    @property
+    def base_url(self):
+        return "http://%s:%d" % self.server_address[:2]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
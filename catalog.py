@@ -0,0 +1,139 @@
+import json
+import os
+import sqlite3
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 目录中每个文件的元数据字段
+FIELDS = (
+    "path", "size", "mtime", "duration", "width", "height",
+    "video_codec", "audio_codec", "downloaded_at", "probed_at",
+)
+
+
+def probe_media(path, timeout=30):
+    """用ffprobe读取时长、分辨率和编码，ffprobe不可用或失败时返回空字典"""
+    try:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path],
+            capture_output=True, timeout=timeout, check=True,
+        )
+        data = json.loads(result.stdout)
+    except (OSError, subprocess.SubprocessError, ValueError):
+        return {}
+    info = {}
+    duration = data.get("format", {}).get("duration")
+    if duration:
+        info["duration"] = float(duration)
+    for stream in data.get("streams", []):
+        if stream.get("codec_type") == "video" and "video_codec" not in info:
+            # 封面图片也是视频流，跳过
+            if stream.get("disposition", {}).get("attached_pic"):
+                continue
+            info["video_codec"] = stream.get("codec_name")
+            info["width"] = stream.get("width")
+            info["height"] = stream.get("height")
+        elif stream.get("codec_type") == "audio" and "audio_codec" not in info:
+            info["audio_codec"] = stream.get("codec_name")
+    return info
+
+
+class MediaCatalog:
+    """媒体文件元数据目录（sqlite），按路径保存大小、修改时间和ffprobe结果"""
+
+    def __init__(self, path="catalog.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS media (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                duration REAL,
+                width INTEGER,
+                height INTEGER,
+                video_codec TEXT,
+                audio_codec TEXT,
+                downloaded_at REAL,
+                probed_at REAL
+            )
+            """
+        )
+        self._db.commit()
+
+    def all(self):
+        """返回{路径: 元数据字典}"""
+        with self._lock:
+            rows = self._db.execute("SELECT %s FROM media" % ", ".join(FIELDS)).fetchall()
+        return {row[0]: dict(zip(FIELDS, row)) for row in rows}
+
+    def get(self, path):
+        with self._lock:
+            row = self._db.execute("SELECT %s FROM media WHERE path = ?" % ", ".join(FIELDS), (path,)).fetchone()
+        return dict(zip(FIELDS, row)) if row else None
+
+    def save(self, record):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO media (%s) VALUES (%s)" % (", ".join(FIELDS), ", ".join("?" * len(FIELDS))),
+                tuple(record.get(field) for field in FIELDS),
+            )
+            self._db.commit()
+
+    def remove(self, paths):
+        with self._lock:
+            self._db.executemany("DELETE FROM media WHERE path = ?", [(path,) for path in paths])
+            self._db.commit()
+
+
+class MediaIndexer:
+    """用线程池在后台探测媒体文件，只重新探测大小或修改时间变化的文件
+
+    每个文件探测完成后写入目录，并以元数据字典调用on_indexed（在线程池的线程中调用）。
+    """
+
+    def __init__(self, catalog, on_indexed=None, max_workers=None):
+        self.catalog = catalog
+        self.on_indexed = on_indexed
+        # ffprobe是独立进程，线程只负责等待
+        self._pool = ThreadPoolExecutor(max_workers or min(8, os.cpu_count() or 1))
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def submit(self, path, size, mtime):
+        """文件大小或修改时间与目录中的记录不同时加入探测队列"""
+        record = self.catalog.get(path)
+        if record is not None and record["size"] == size and record["mtime"] == mtime and record["probed_at"]:
+            return
+        with self._lock:
+            if path in self._pending:
+                return
+            self._pending.add(path)
+        self._pool.submit(self._index, path, size, mtime, record)
+
+    def _index(self, path, size, mtime, previous):
+        try:
+            record = {"path": path, "size": size, "mtime": mtime}
+            record.update(probe_media(path))
+            # 下载时间只在第一次发现文件时记录；ctime在文件下载完成改名时更新，比mtime更接近下载时间
+            if previous and previous.get("downloaded_at"):
+                record["downloaded_at"] = previous["downloaded_at"]
+            else:
+                try:
+                    record["downloaded_at"] = os.stat(path).st_ctime
+                except OSError:
+                    record["downloaded_at"] = time.time()
+            record["probed_at"] = time.time()
+            self.catalog.save(record)
+        finally:
+            with self._lock:
+                self._pending.discard(path)
+        if self.on_indexed is not None:
+            self.on_indexed(record)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,235 @@
+"""命令行/守护进程模式：python -m cli [链接 ...]，不导入PyQt5
+
+链接可以来自命令行参数或标准输入（每行一个或用空格分隔）。
+--daemon模式持续从标准输入读取链接，直到标准输入关闭，适合从管道或FIFO接收任务。
+--api模式同时开启本地HTTP接口（见api_server.py）。
+--store使用共享任务队列（见job_store.py）：只提交链接并显示进度，由工作进程下载；
+同时指定--worker时作为工作进程运行，从队列领取任务下载，直到Ctrl+C。
+--subscribe把链接（播放列表/频道）加为订阅，--sync下载所有订阅中新增的视频，适合放在定时任务中。
+--verify按任务日志中记录的大小和校验和检查已下载的文件，不下载。
+"""
+import argparse
+import sys
+import threading
+import time
+
+from api_server import DEFAULT_PORT, ApiServer
+from bandwidth import parse_rate, parse_schedule
+from engine import DownloadEngine, DownloadJob
+from formats import FormatProfile
+from hashing import VERIFY_OK, verify_file
+from job_store import JobStore, RemoteQueue
+from journal import JobJournal
+from progress import PHASE_FINISHED, format_bytes, format_eta, format_timings
+from worker import Worker
+
+# 写入指标文件的间隔（秒）
+METRICS_INTERVAL = 10
+
+
+class ConsoleReporter:
+    """把引擎事件输出到标准错误：状态变化时输出一行，下载中按进度快照刷新"""
+
+    def __init__(self, quiet=False):
+        self.quiet = quiet
+        self.failed = 0
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event, job):
+        with self._lock:
+            if event == "finished":
+                if job.state == DownloadJob.FAILED:
+                    self.failed += 1
+                    self._print(job, job.error or "")
+                else:
+                    self._print(job, "  ".join(filter(None, (job.plan, format_timings(job.timings)))))
+            elif not job.is_active():
+                # 结束的任务由finished事件输出
+                pass
+            elif job.state == DownloadJob.RUNNING and job.phase is not None:
+                if not self.quiet and job.phase != PHASE_FINISHED:
+                    self._print(job, "%.1f%% %s %s" % (
+                        job.progress, format_bytes(job.speed) + "/s" if job.speed else "", format_eta(job.eta),
+                    ))
+            elif self._states.get(job.id) != job.state:
+                self._print(job)
+            self._states[job.id] = job.state
+
+    def _print(self, job, detail=""):
+        line = "[%d] %s %s" % (job.id, job.phase or job.state, job.title or job.url)
+        if detail:
+            line += "  " + detail
+        print(line, file=sys.stderr, flush=True)
+
+
+def read_urls(stream):
+    for line in stream:
+        for url in line.split():
+            yield url
+
+
+def write_metrics(engine, path, interval=METRICS_INTERVAL):
+    while True:
+        engine.write_metrics(path)
+        time.sleep(interval)
+
+
+def verify(quick):
+    """检查任务日志中记录的输出文件，有文件缺失或损坏时返回1"""
+    journal = JobJournal()
+    checked = failed = 0
+    for job_id, title, path, size, checksum in journal.outputs():
+        result = verify_file(path, size, checksum, quick)
+        checked += 1
+        if result != VERIFY_OK:
+            failed += 1
+            print("[%d] %s %s" % (job_id, result, path), flush=True)
+    print("检查了%d个文件，%d个异常" % (checked, failed), file=sys.stderr)
+    return 1 if failed else 0
+
+
+def run_worker(engine, args):
+    worker = Worker(JobStore(args.store), engine)
+    print("工作进程 %s 开始领取任务" % worker.name, file=sys.stderr)
+    if args.metrics_file:
+        threading.Thread(target=write_metrics, args=(engine, args.metrics_file), daemon=True).start()
+    stop_event = threading.Event()
+    thread = threading.Thread(target=worker.run, args=(stop_event,))
+    thread.start()
+    try:
+        # 定时唤醒，使Ctrl+C可以中断等待
+        while thread.is_alive():
+            thread.join(0.5)
+    except KeyboardInterrupt:
+        # 未完成的任务放回队列，由其他工作进程从断点继续
+        print("正在退出，未完成的任务放回队列", file=sys.stderr)
+        stop_event.set()
+        thread.join()
+        return 130
+    finally:
+        if args.metrics_file:
+            engine.write_metrics(args.metrics_file)
+        engine.shutdown()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m cli", description="并发下载视频或音频，不需要图形界面")
+    parser.add_argument("urls", nargs="*", help="视频链接，省略或为 - 时从标准输入读取")
+    parser.add_argument("-t", "--type", choices=("视频", "音频"), default="视频", help="下载类型")
+    parser.add_argument("--video-dir", default="视频", help="视频保存目录")
+    parser.add_argument("--audio-dir", default="音频", help="音频保存目录")
+    parser.add_argument("-j", "--workers", type=int, default=3, help="同时下载的任务数")
+    parser.add_argument("--per-host", type=int, default=2, help="单个站点的并发上限")
+    parser.add_argument("-c", "--connections", type=int, default=8, help="每个任务的连接数")
+    parser.add_argument("--archive-mode", choices=("skip", "link"), default="skip",
+                        help="已下载过的视频：跳过或链接已有文件")
+    parser.add_argument("--audio-codec", choices=("auto", "mp3", "aac", "opus", "vorbis", "flac"), default="auto",
+                        help="音频模式的输出编码，auto时保留AAC/Opus/MP3等常见编码不转码")
+    parser.add_argument("--container", choices=("auto", "mp4", "mkv", "webm"), default="auto", help="视频封装格式")
+    parser.add_argument("--max-height", type=int, help="最高分辨率，如720")
+    parser.add_argument("--max-fps", type=int, help="最高帧率")
+    parser.add_argument("--vcodec", action="append", default=[], help="优先的视频编码（h264、vp9、av1等），可重复")
+    parser.add_argument("--acodec", action="append", default=[], help="优先的音频编码（aac、opus等），可重复")
+    parser.add_argument("--max-size", type=int, metavar="MB", help="文件大小上限（MB），超出时降低画质")
+    parser.add_argument("--no-premuxed", action="store_true", help="不优先使用预合并格式")
+    parser.add_argument("-r", "--limit-rate", type=parse_rate, default=0, metavar="RATE",
+                        help="所有任务合计的下载速率上限，如2M、500K，默认不限速")
+    parser.add_argument("--schedule", type=parse_schedule, default=[], metavar="PERIODS",
+                        help="分时段限速，如08:00-23:00=1M,23:00-08:00=0，时段外使用--limit-rate")
+    parser.add_argument("-p", "--priority", type=int, default=0,
+                        help="任务优先级，越大越先下载，高于正在下载的任务时会抢占它们")
+    parser.add_argument("--hash", action="store_true", help="计算内容哈希以识别重复文件")
+    parser.add_argument("--resume", action="store_true", help="继续上次未完成的任务")
+    parser.add_argument("--daemon", action="store_true", help="持续从标准输入读取链接，直到标准输入关闭")
+    parser.add_argument("--api", type=int, metavar="PORT", nargs="?", const=DEFAULT_PORT,
+                        help="开启本地HTTP接口（默认端口%d），一直运行直到Ctrl+C" % DEFAULT_PORT)
+    parser.add_argument("--metrics-file", metavar="PATH",
+                        help="定期把Prometheus格式的运行指标写入文件（供node_exporter的textfile收集器读取）")
+    parser.add_argument("--log-json", metavar="PATH", help="每个任务结束时向文件追加一行JSON日志")
+    parser.add_argument("--subscribe", action="store_true",
+                        help="把链接加为订阅（播放列表或频道），立即下载其中未见过的视频")
+    parser.add_argument("--sync", action="store_true", help="下载所有订阅中新增的视频")
+    parser.add_argument("--sync-limit", type=int, metavar="N",
+                        help="每个订阅一次最多下载N个新视频（第一次同步很长的频道时只取最新的N个）")
+    parser.add_argument("--verify", choices=("quick", "full"), nargs="?", const="full",
+                        help="检查已下载的文件：full（默认）重新计算校验和，quick只比较文件大小")
+    parser.add_argument("--store", metavar="PATH",
+                        help="共享任务队列文件（sqlite），链接提交到队列，由工作进程下载")
+    parser.add_argument("--worker", action="store_true", help="作为工作进程从--store指定的队列领取任务，直到Ctrl+C")
+    parser.add_argument("-q", "--quiet", action="store_true", help="不输出下载进度")
+    args = parser.parse_args(argv)
+    if args.verify:
+        return verify(args.verify == "quick")
+    if args.worker and not args.store:
+        parser.error("--worker需要同时指定--store")
+
+    if args.store and not args.worker:
+        # 下载参数由各工作进程决定，这里只提交和显示进度
+        engine = RemoteQueue(JobStore(args.store))
+    else:
+        engine = DownloadEngine(args.video_dir, args.audio_dir, args.workers, args.per_host, args.connections)
+    engine.set_archive_mode(args.archive_mode)
+    engine.set_hash_content(args.hash)
+    engine.set_audio_codec(args.audio_codec)
+    engine.set_container(args.container)
+    engine.set_rate_limit(args.limit_rate)
+    engine.set_bandwidth_schedule(args.schedule)
+    engine.set_metrics_log(args.log_json)
+    reporter = ConsoleReporter(args.quiet)
+    engine.subscribe(reporter)
+    if args.worker:
+        return run_worker(engine, args)
+    if args.resume:
+        engine.restore()
+    if args.api is not None:
+        server = ApiServer(engine, port=args.api).start()
+        print("本地接口: http://%s:%d" % (server.host, server.port), file=sys.stderr)
+
+    profile = FormatProfile(
+        args.max_height, args.max_fps, args.vcodec, args.acodec,
+        args.max_size * 1024 * 1024 if args.max_size else None, not args.no_premuxed,
+    )
+    urls = [url for url in args.urls if url != "-"]
+    if args.subscribe:
+        subscription_ids = [engine.add_subscription(url, args.type, profile, args.priority) for url in urls]
+        engine.sync_subscriptions(None if args.sync else subscription_ids, args.sync_limit)
+    elif args.sync:
+        engine.sync_subscriptions(limit=args.sync_limit)
+    if urls and not args.subscribe:
+        engine.add_batch(urls, args.type, profile, args.priority)
+    if args.daemon:
+        # 每行链接立即加入队列，与正在进行的下载并发执行
+        for line in sys.stdin:
+            if line.split():
+                engine.add_batch(line.split(), args.type, profile, args.priority)
+    elif "-" in args.urls or (not urls and args.api is None and not args.sync and not args.subscribe):
+        stdin_urls = list(read_urls(sys.stdin))
+        if stdin_urls:
+            engine.add_batch(stdin_urls, args.type, profile, args.priority)
+
+    if args.metrics_file:
+        threading.Thread(target=write_metrics, args=(engine, args.metrics_file), daemon=True).start()
+
+    try:
+        if args.api is not None:
+            # 接口模式一直运行，由Ctrl+C结束
+            while True:
+                time.sleep(1)
+        # 定时唤醒，使Ctrl+C可以中断等待
+        while not engine.wait(0.5):
+            pass
+    except KeyboardInterrupt:
+        # 未完成的任务保留在任务日志中，可用--resume继续
+        print("已中断，使用 --resume 继续未完成的任务", file=sys.stderr)
+        return 130
+    finally:
+        if args.metrics_file:
+            engine.write_metrics(args.metrics_file)
+        engine.shutdown()
+    return 1 if reporter.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
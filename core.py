@@ -1,91 +1,95 @@
 import os
 
-import yt_dlp
-from PyQt5.QtCore import QThread, pyqtSignal
+from PyQt5.QtCore import QObject, QThread, pyqtSignal
+
+# 下载逻辑在不依赖Qt的engine模块中，这里只把回调转换为Qt信号
+from engine import OUTPUT_TEMPLATE, DownloadEngine, Downloader, DownloadJob
+from job_store import JobStore, RemoteQueue
 
 
 class DownloadThread(QThread):
-    # 定义下载进度信号
-    progress = pyqtSignal(int)
+    # 定义下载进度信号，参数为progress.ProgressSnapshot
+    progress = pyqtSignal(object)
     # 定义下载完成信号
     finished = pyqtSignal()
     
     # 初始化方法
-    def __init__(self, url, download_type, video_output_dir, audio_output_dir):
+    def __init__(self, url, download_type, video_output_dir, audio_output_dir, info=None, cache=None,
+                 connections=8, outtmpl=None, archive=None, archive_mode="skip", hash_content=False, throttle=None):
         super().__init__()
         self.url = url
         self.download_type = download_type
         self.video_output_dir = video_output_dir
         self.audio_output_dir = audio_output_dir
-        self.cookies = None
-        self.success = False
-        self.ydl_opts = {
-            "progress_hooks": [self.my_hook],
-            "outtmpl": self.get_output_template(download_type),
-            "format": (
-                "bestaudio/best"
-                if self.download_type == "音频"
-                else "bestvideo+bestaudio"
-            ),
-        }
+        output_dir = video_output_dir if download_type == "视频" else audio_output_dir
+        self.downloader = Downloader(
+            url, download_type, outtmpl or os.path.join(output_dir, OUTPUT_TEMPLATE), info, cache, connections,
+            archive, archive_mode, hash_content, on_progress=self.progress.emit, throttle=throttle,
+        )
     
-    def get_output_template(self, download_type):
-        if download_type == "视频":
-            return os.path.join(self.video_output_dir, '%(title)s.%(ext)s')
-        else:
-            return os.path.join(self.audio_output_dir, '%(title)s.%(ext)s')
+    @property
+    def success(self):
+        return self.downloader.success
     
-    def update_format(self, download_type):
-        if download_type == "视频":
-            self.ydl_opts["format"] = "bestvideo+bestaudio"
-        else:
-            self.ydl_opts["format"] = "bestaudio/best"
-        self.ydl_opts["outtmpl"] = self.get_output_template(download_type)
+    @property
+    def skipped(self):
+        return self.downloader.skipped
+    
+    # 设置cookies参数
     def set_cookies(self, cookies_path):
-        """设置cookies参数"""
-        self.cookies = cookies_path
+        self.downloader.set_cookies(cookies_path)
+    
+    def update_format(self, download_type):
+        self.download_type = download_type
+        output_dir = self.video_output_dir if download_type == "视频" else self.audio_output_dir
+        self.downloader.update_format(download_type, os.path.join(output_dir, OUTPUT_TEMPLATE))
     
-    # 线程执行方法
+    # 请求取消下载（可在界面线程中调用），已下载的部分保留，再次下载时从断点继续
+    def cancel(self):
+        self.downloader.cancel()
+    
+    # 线程运行方法
     def run(self):
-        # 判断本地目录是否存在cookies.txt文件
-        if os.path.exists("cookies.txt"):
-            self.set_cookies("cookies.txt")
-            self.ydl_opts["cookiefile"] = self.cookies
-        
-        try:
-            if self.ydl_opts.get("format") == "bestaudio/best":
-                self.ydl_opts["postprocessors"] = [
-                    {
-                        "key": "FFmpegExtractAudio",
-                        "preferredcodec": "mp3",
-                        "preferredquality": "192",
-                    }
-                ]
-            # 使用yt_dlp下载视频或音频
-            with yt_dlp.YoutubeDL(self.ydl_opts) as ydl:
-                # 判断下载类型，设置ydl_opts中的format参数
-                ydl.extract_info(self.url, download=True)
-                # ydl.download([self.url])
-            self.success = True  # 下载成功时，设置success为True
-        
-        except yt_dlp.utils.DownloadError:
-            # 下载出错时，发送完成信号
-            self.finished.emit()
-            print("Requested format is not available for this video.")
-        else:
-            # 下载成功时，发送完成信号
-            self.finished.emit()
+        # 单独使用时在本线程中完成后处理
+        if self.downloader.run() and self.downloader.task is not None:
+            self.downloader.postprocess()
+        if not self.downloader.success:
+            print(self.downloader.error)
+        self.finished.emit()
+
+
+class DownloadQueue(QObject):
+    """下载队列的Qt适配：把engine.DownloadEngine的事件转换为信号，其余属性和方法直接转发给引擎
+
+    指定store（共享任务队列文件）时只提交和监视任务，由工作进程下载，见job_store.RemoteQueue。
+    """
+    # 新任务加入队列信号，参数为任务id
+    job_added = pyqtSignal(int)
+    # 任务状态或进度变化信号，参数为任务id
+    job_updated = pyqtSignal(int)
+    # 任务结束信号，参数为任务id和是否成功
+    job_finished = pyqtSignal(int, bool)
     
-    def update_format(self, download_type):
-        # 读取下载类型，设置ydl_opts中的format参数
-        if download_type == "视频":
-            self.ydl_opts["format"] = "bestvideo+bestaudio"
+    def __init__(self, video_output_dir, audio_output_dir, max_workers=3, per_host_limit=2, connections=8,
+                 parent=None, store=None):
+        super().__init__(parent)
+        if store:
+            self.engine = RemoteQueue(JobStore(store))
         else:
-            self.ydl_opts["format"] = "bestaudio/best"
+            self.engine = DownloadEngine(video_output_dir, audio_output_dir, max_workers, per_host_limit, connections)
+        # 引擎在工作线程中回调，信号会排队到界面线程处理
+        self.engine.subscribe(self._on_event)
     
-    # 自定义下载进度钩子函数
-    def my_hook(self, d):
-        # 当下载状态为进行中时，发送进度信号
-        if d["status"] == "downloading":
-            p = d["_percent_str"].replace("%", "")
-            self.progress.emit(int(float(p)))
\ No newline at end of file
+    def __getattr__(self, name):
+        # jobs、add、add_batch、restore、set_*等都由引擎实现
+        if name == "engine":
+            raise AttributeError(name)
+        return getattr(self.engine, name)
+    
+    def _on_event(self, event, job):
+        if event == "added":
+            self.job_added.emit(job.id)
+        elif event == "updated":
+            self.job_updated.emit(job.id)
+        else:
+            self.job_finished.emit(job.id, job.state in (DownloadJob.DONE, DownloadJob.SKIPPED))
@@ -0,0 +1,116 @@
+"""磁盘空间准入：开始下载前按元数据中的文件大小预留空间，空间不够时任务等待，不在批量下载进行到一半时写满磁盘
+
+预留的大小为选中格式的估计大小之和（见estimate_size）；需要合并或转码时再加上同样大小的输出文件，
+后处理完成、删除输入文件之前两者同时存在。任务已写入的字节从它的预留中扣除，
+同一文件系统上所有任务剩余的预留加上MIN_FREE不能超过可用空间（视频和音频目录可以在不同的磁盘上）。
+其他任务的后处理删除了输入文件、或用户清理出空间后，等待的任务继续下载；
+其他任务的预留全部释放也不够时不再等待，任务以DiskSpaceError失败，不一直占用下载名额。
+"""
+import os
+import shutil
+import threading
+
+from formats import estimate_size as format_size
+from progress import format_bytes
+
+# 始终保留的可用空间，估计的大小不准确时留有余量
+MIN_FREE = 256 * 1024 * 1024
+# 格式既没有大小也没有码率时按这些码率（kbit/s）估计，取常见格式的上限
+FALLBACK_VIDEO_TBR = 8000
+FALLBACK_AUDIO_TBR = 320
+# 连时长也不知道时（如直播）每个格式预留的大小
+UNKNOWN_SIZE = 1024 * 1024 * 1024
+# 等待空间时重新检查可用空间的间隔（秒），其他程序释放的空间不会通知
+CHECK_INTERVAL = 1.0
+
+
+class DiskSpaceError(Exception):
+    """即使其他任务的预留全部释放，可用空间也不够"""
+
+
+class Reservation:
+    """一个任务预留的空间，written为任务已写入的字节数，由下载线程更新"""
+
+    def __init__(self, device, size):
+        self.device = device
+        self.size = size
+        self.written = 0
+
+    def remaining(self):
+        return max(0, self.size - self.written)
+
+
+class DiskSpace:
+    """按文件系统记录各任务预留的空间，可在任意线程中预留和释放"""
+
+    def __init__(self, min_free=MIN_FREE):
+        self.min_free = min_free
+        self._reservations = []
+        self._changed = threading.Condition()
+
+    def available(self, directory):
+        """directory所在文件系统扣除其他任务剩余预留和MIN_FREE后的可用字节数"""
+        device = os.stat(directory).st_dev
+        with self._changed:
+            return self._available(directory, device)
+
+    def _pending(self, device):
+        return sum(reservation.remaining() for reservation in self._reservations if reservation.device == device)
+
+    def _available(self, directory, device):
+        return shutil.disk_usage(directory).free - self._pending(device) - self.min_free
+
+    def reserve(self, directory, size, cancelled=None, on_wait=None):
+        """在directory所在的文件系统上预留size字节，空间不够时阻塞等待
+
+        开始等待时以还差的字节数调用on_wait；cancelled()返回True时放弃等待并返回None。
+        其他任务剩余的预留不足以弥补差额时抛出DiskSpaceError。
+        """
+        device = os.stat(directory).st_dev
+        reservation = Reservation(device, size)
+        waiting = False
+        while True:
+            with self._changed:
+                shortage = size - self._available(directory, device)
+                if shortage <= 0:
+                    self._reservations.append(reservation)
+                    return reservation
+                if cancelled is not None and cancelled():
+                    return None
+                if shortage > self._pending(device):
+                    raise DiskSpaceError("磁盘空间不足: 需要%s，还差%s（保留%s）" % (
+                        format_bytes(size), format_bytes(shortage), format_bytes(self.min_free),
+                    ))
+                if waiting or on_wait is None:
+                    self._changed.wait(CHECK_INTERVAL)
+                    continue
+            # 在锁外回调：回调会通知界面和接口等订阅者，较慢时不能阻塞其他任务的预留和释放
+            waiting = True
+            on_wait(shortage)
+
+    def release(self, reservation):
+        """任务结束（或暂停）时释放剩余的预留"""
+        with self._changed:
+            if reservation in self._reservations:
+                self._reservations.remove(reservation)
+            self._changed.notify_all()
+
+
+def estimate_size(formats, duration=None):
+    """格式列表的估计总大小（字节）
+
+    按filesize、filesize_approx或码率×时长估计（见formats.estimate_size）；HLS/DASH等没有这些信息的格式
+    按保守的码率估计，连时长也不知道时每个格式按UNKNOWN_SIZE计算，宁可多预留也不按0计算。
+    """
+    total = 0
+    for fmt in formats:
+        size = format_size(fmt, duration)
+        if size is None:
+            if duration:
+                # 编码未知的格式按视频估计
+                bitrate = FALLBACK_AUDIO_TBR if fmt.get("vcodec") == "none" else FALLBACK_VIDEO_TBR
+                size = int(bitrate * 1000 / 8 * duration)
+            else:
+                size = UNKNOWN_SIZE
+        total += size
+    return total
@@ -0,0 +1,1206 @@
+"""下载引擎：不依赖Qt，图形界面（core.py）和命令行（cli.py）共用
+
+yt_dlp导入很慢（包含全部提取器），只在真正解析或下载时才导入，不影响界面启动。
+"""
+import copy
+import glob
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+
+from archive import DownloadArchive, get_title_key
+from bandwidth import BandwidthScheduler
+from diskspace import DiskSpace, estimate_size
+from extract_cache import ExtractCache, is_expired
+from formats import FormatProfile, select_formats
+from hashing import StreamingHasher, hash_file
+from journal import JobJournal
+from metrics import JobMetrics
+from postprocess import PostProcessError, PostProcessPool
+from progress import PHASE_DISK, ProgressTracker, format_bytes
+from remux import OutputPolicy, find_premuxed, plan_audio, plan_video, use_premuxed
+from retry import (
+    AUTH, FRAGMENT_RETRIES, HTTP_RETRIES, JOB_ATTEMPTS, UNAVAILABLE, classify, is_retryable, job_delay,
+    sleep_fragment, sleep_http,
+)
+from segmented import SegmentedDownloader, SegmentedDownloadError
+from session_pool import SessionPool
+from subscriptions import SubscriptionStore, find_new_entries
+
+# 输出文件命名规则
+OUTPUT_TEMPLATE = '%(title)s.%(ext)s'
+# 选中的格式无法下载时，最多改用几次次优的格式
+FORMAT_FALLBACKS = 2
+
+
+def preload():
+    """在后台线程中提前导入yt_dlp，第一个下载开始时不必再等待导入"""
+    import importlib
+
+    threading.Thread(target=importlib.import_module, args=("yt_dlp",), daemon=True).start()
+
+
+def get_format(download_type):
+    """根据下载类型返回yt_dlp的format参数"""
+    if download_type == "视频":
+        # 没有单独的视频格式时退回到最好的预合并格式
+        return "bv*+ba/b"
+    return "bestaudio/best"
+
+
+class YdlLogger:
+    """yt_dlp的日志对象：照常输出信息，同时统计重试次数（yt_dlp只在日志中报告重试）"""
+    RETRY_PATTERN = re.compile(r"Retrying.*\(\d+/\d+\)")
+
+    def __init__(self, on_retry):
+        self.on_retry = on_retry
+
+    def debug(self, msg):
+        self._check(msg)
+        # 调试信息和以\r开头的进度行不输出，进度由ProgressTracker上报
+        if not msg.startswith(("[debug] ", "\r")):
+            print(msg)
+
+    def warning(self, msg):
+        self._check(msg)
+        print("WARNING: %s" % msg, file=sys.stderr)
+
+    def error(self, msg):
+        print(msg, file=sys.stderr)
+
+    def _check(self, msg):
+        if self.RETRY_PATTERN.search(msg):
+            self.on_retry()
+
+
+class Downloader:
+    """下载单个链接：解析（或使用已有元数据）、查重、下载，并生成合并或提取音频的后处理任务"""
+
+    def __init__(self, url, download_type, outtmpl, info=None, cache=None, connections=8,
+                 archive=None, archive_mode="skip", hash_content=False, on_progress=None, policy=None,
+                 profile=None, throttle=None, sessions=None, disk=None):
+        self.url = url
+        self.download_type = download_type
+        # 批量解析阶段已经取得的元数据，有则直接下载，不再重复解析
+        self.info = info
+        # 解析结果缓存，重试、切换格式或重复下载时跳过解析
+        self.cache = cache
+        # 每个任务的连接数：直链文件的分段数，HLS/DASH的分片并发数
+        self.connections = connections
+        # 下载索引：已下载过的视频跳过（skip）或链接已有文件（link）
+        self.archive = archive
+        self.archive_mode = archive_mode
+        # 边下载边计算每个文件的哈希：作为输出文件的校验和，hash_content时还用于识别换了标题的重复视频
+        self.hash_content = hash_content
+        self.hasher = StreamingHasher()
+        # 输出文件的路径、大小和校验和，成功下载（并完成后处理）后设置
+        self.output_path = None
+        self.output_size = None
+        self.checksum = None
+        # 进度回调，参数为progress.ProgressSnapshot，在下载线程中调用
+        self.on_progress = on_progress
+        self.cookies = None
+        self.success = False
+        self.skipped = False
+        # 取消标志，在进度回调中检查，中止后保留已下载的部分
+        self.cancelled = False
+        self._wakeup = threading.Event()
+        self.error = None
+        # 失败的类别（retry模块中的transient、throttled、unavailable、auth、fatal）
+        self.error_category = None
+        # 本次尝试的元数据是否刚刚解析得到（而不是来自缓存或批量解析）
+        self.extracted = False
+        # 下载失败的格式id，改用次优格式时排除
+        self.failed_format = None
+        self.failed_target = None
+        self.excluded_formats = set()
+        # 正在进行的分段下载，取消时通知它停止
+        self.segmented = None
+        self.title = info.get("title") if info else None
+        # 输出要求（目标编码和封装），决定下载后直接使用、流复制还是转码
+        self.policy = policy or OutputPolicy()
+        # 格式要求（分辨率、帧率、编码、大小上限），决定下载哪些格式
+        self.profile = profile or FormatProfile()
+        # 格式选择后的元数据、待执行的后处理任务和所选处理方式的说明
+        self.selected = None
+        # 实际下载的格式id，如"137+140"
+        self.format_id = None
+        self.task = None
+        self.plan = None
+        # 各阶段耗时（秒），如{"解析": 0.8, "下载": 12.3, "合并": 1.1}
+        self.timings = {}
+        # 各阶段下载或写出的字节数和重试次数
+        self.bytes = {}
+        self.retries = {}
+        # 当前阶段，重试次数和指标按它归类；在download()设置之前发生的重试算作解析阶段
+        self.stage = "解析"
+        # 把逐块的进度回调合并为限频的进度快照
+        self.tracker = ProgressTracker()
+        # 全局带宽调度分配给本任务的限速器（bandwidth.JobThrottle），None时不限速
+        self.throttle = throttle
+        # 共享的YoutubeDL会话池（session_pool.SessionPool），None时每次下载新建实例
+        self.sessions = sessions
+        # 磁盘空间准入（diskspace.DiskSpace），None时不预留空间；reservation为本任务当前的预留
+        self.disk = disk
+        self.reservation = None
+        self.ydl_opts = {
+            "progress_hooks": [self.my_hook],
+            # 只有整体交给yt_dlp下载的播放列表会在下载线程中后处理
+            "postprocessor_hooks": [self.pp_hook],
+            "outtmpl": outtmpl,
+            "format": get_format(download_type),
+            "concurrent_fragment_downloads": connections,
+            # 保留.part文件和分片进度，中断后可以从断点继续下载
+            "continuedl": True,
+            # 单个请求和单个分片失败后以带抖动的指数退避重试，已完成的分片保留
+            "retries": HTTP_RETRIES,
+            "fragment_retries": FRAGMENT_RETRIES,
+            "retry_sleep_functions": {"http": sleep_http, "fragment": sleep_fragment},
+            # 分片重试耗尽时让任务失败并保留已下载的分片，不生成缺少分片的文件
+            "skip_unavailable_fragments": False,
+            "logger": YdlLogger(self.count_retry),
+        }
+
+    def set_cookies(self, cookies_path):
+        """设置cookies参数"""
+        self.cookies = cookies_path
+
+    def update_format(self, download_type, outtmpl=None):
+        # 读取下载类型，设置ydl_opts中的format参数
+        self.download_type = download_type
+        self.ydl_opts["format"] = get_format(download_type)
+        if outtmpl:
+            self.ydl_opts["outtmpl"] = outtmpl
+
+    def run(self):
+        """执行下载阶段，成功返回True
+
+        需要合并或提取音频时，后处理任务保存在self.task中，由调用方执行postprocess()；
+        否则下载完成时已登记到下载索引。
+        """
+        import yt_dlp
+
+        # 判断本地目录是否存在cookies.txt文件
+        if os.path.exists("cookies.txt"):
+            self.set_cookies("cookies.txt")
+        if self.cookies:
+            self.ydl_opts["cookiefile"] = self.cookies
+
+        attempt = 0
+        while True:
+            try:
+                # 使用yt_dlp下载视频或音频
+                with self.open_session() as ydl:
+                    self.download(ydl)
+                self.success = True
+                self.error = self.error_category = None
+                if self.task is None:
+                    self.report(self.tracker.finish())
+                return True
+            except yt_dlp.utils.DownloadCancelled:
+                self.error = self.error_category = None
+                return False
+            except Exception as e:
+                # 分段下载时取消会表现为分段失败，以取消标志为准
+                if self.cancelled:
+                    self.error = self.error_category = None
+                    return False
+                # yt_dlp内部偶尔抛出DownloadError以外的异常（如并发下载分片时的文件错误），同样按类别处理
+                self.error = str(e) if isinstance(e, yt_dlp.utils.DownloadError) else "%s: %s" % (type(e).__name__, e)
+                self.error_category = classify(e)
+            if self.error_category == UNAVAILABLE and self.failed_format is not None and not self.extracted:
+                # 缓存或批量解析得到的签名链接可能已经失效（403等），丢弃旧的元数据，重新解析后再试同一格式
+                print("Format %s unavailable, extracting again: %s" % (self.failed_format, self.error))
+                self.info = None
+                if self.cache is not None:
+                    self.cache.invalidate(self.url)
+                delay = 0
+            elif is_retryable(self.error_category) and attempt < JOB_ATTEMPTS - 1:
+                # 已下载的.part文件、分片和分段保留，重试时从断点继续
+                delay = job_delay(self.error_category, attempt)
+                attempt += 1
+            elif self.failed_format is not None and self.error_category != AUTH \
+                    and len(self.excluded_formats) < FORMAT_FALLBACKS:
+                # 选中的格式无法下载，排除后按同样的要求选择次优的格式
+                print("Format %s failed, trying the next best format: %s" % (self.failed_format, self.error))
+                self.excluded_formats.add(self.failed_format)
+                self.discard_partial(self.failed_target)
+                delay = 0
+                attempt = 0
+            else:
+                return False
+            self.failed_format = None
+            self.count_retry()
+            if delay:
+                self.report(self.tracker.waiting(delay))
+                if self._wakeup.wait(delay):
+                    self.error = self.error_category = None
+                    return False
+
+    def download(self, ydl):
+        """解析（或使用已有元数据）、查重并下载"""
+        import yt_dlp
+
+        self.stage = "解析"
+        started = time.monotonic()
+        info = self.info
+        if info is not None and is_expired(info):
+            # 在队列中等待（或暂停）太久，批量解析得到的签名链接已过期，直接下载会得到403
+            info = self.info = None
+        if info is None and self.cache is not None:
+            info = self.cache.get(self.url)
+        self.extracted = info is None
+        if info is None:
+            # 先只解析不下载，便于把结果写入缓存
+            info = ydl.extract_info(self.url, download=False, process=False)
+            if self.cache is not None:
+                self.cache.put(self.url, info)
+        self.timings["解析"] = time.monotonic() - started
+        self.title = info.get("title") or self.title
+        if self.cancelled:
+            raise yt_dlp.utils.DownloadCancelled()
+        existing = None
+        if self.archive is not None and info.get("_type") in (None, "video"):
+            existing = self.archive.find(info, self.download_type)
+        self.stage = "下载"
+        started = time.monotonic()
+        try:
+            if existing is not None:
+                # 开始下载前发现已下载过，不再传输任何数据
+                self.use_existing(info, existing)
+                self.skipped = True
+                self.plan = "已存在"
+            elif info.get("_type") in (None, "video"):
+                self.download_formats(ydl, info)
+            else:
+                # 播放列表等整体交给yt_dlp下载，并在本线程中完成后处理
+                self.download_playlist(ydl, info)
+                self.plan = "yt_dlp"
+        finally:
+            # 重试时累计各次尝试的下载耗时
+            self.timings["下载"] = self.timings.get("下载", 0) + time.monotonic() - started
+            self.bytes["下载"] = self.tracker.downloaded_bytes
+
+    def discard_partial(self, target):
+        """删除不再续传的未完成文件（.part、分片、分段进度等）"""
+        for path in glob.glob(glob.escape(target) + ".*"):
+            os.remove(path)
+        # 已计入哈希的部分随文件一起作废
+        self.hasher.reset()
+
+    def open_session(self):
+        """返回YoutubeDL实例的上下文管理器：有会话池时从池中借出，否则新建"""
+        import yt_dlp
+
+        if self.sessions is not None:
+            return self.sessions.session(self.ydl_opts)
+        return yt_dlp.YoutubeDL(self.ydl_opts)
+
+    def download_playlist(self, ydl, info):
+        """整体交给yt_dlp下载，提取音频时在本线程中完成后处理"""
+        import yt_dlp
+        from yt_dlp.postprocessor import FFmpegExtractAudioPP
+
+        if self.download_type == "视频":
+            ydl.process_ie_result(info, download=True)
+            return
+        # 添加后处理器会改变实例，不能用共享的会话，单独新建一个
+        with yt_dlp.YoutubeDL(self.ydl_opts) as playlist_ydl:
+            playlist_ydl.add_post_processor(
+                FFmpegExtractAudioPP(playlist_ydl, preferredcodec="mp3", preferredquality="192")
+            )
+            playlist_ydl.process_ie_result(info, download=True)
+
+    def postprocess(self):
+        """执行后处理任务并登记下载结果，成功返回True（在后处理池中调用）"""
+        self.stage = self.task.name
+        started = time.monotonic()
+        try:
+            try:
+                path = self.task.run()
+            finally:
+                self.timings[self.task.name] = time.monotonic() - started
+            self.bytes[self.task.name] = os.path.getsize(path)
+            self.record_download(self.selected, path)
+        except PostProcessError as e:
+            self.success = False
+            self.error = str(e)
+            return False
+        except Exception as e:
+            # 改名、读取输出文件或写下载索引失败（如磁盘已满），在后处理池中抛出的异常不会被任何人看到
+            self.success = False
+            self.error = "%s: %s" % (type(e).__name__, e)
+            print("Post-processing failed: %s" % self.error, file=sys.stderr)
+            return False
+        self.report(self.tracker.finish())
+        return True
+
+    def count_retry(self):
+        self.retries[self.stage] = self.retries.get(self.stage, 0) + 1
+
+    def cancel(self):
+        """请求取消下载，下一次进度回调时中止（可在任意线程中调用）"""
+        self.cancelled = True
+        # 正在等待重试时立即醒来
+        self._wakeup.set()
+        segmented = self.segmented
+        if segmented is not None:
+            segmented.cancel()
+        if self.throttle is not None:
+            # 正在限速等待时立即醒来
+            self.throttle.cancel()
+
+    def download_formats(self, ydl, info):
+        """分别下载选中的每个格式，合并和提取音频留给后处理阶段"""
+        import yt_dlp
+
+        # 只做格式选择，不修改原始元数据
+        info = copy.deepcopy(info)
+        if self.excluded_formats:
+            formats = [fmt for fmt in info.get("formats") or [] if fmt.get("format_id") not in self.excluded_formats]
+            if not formats:
+                raise yt_dlp.utils.DownloadError("没有其他可用的格式")
+            info["formats"] = formats
+        chosen = None
+        if not self.profile.is_default():
+            chosen = select_formats(info.get("formats") or [], self.profile, self.download_type, info.get("duration"))
+        if chosen:
+            # 只把选中的格式交给yt_dlp，由它按选中的格式生成下载和合并方案
+            info["formats"] = chosen
+        selected = ydl.process_ie_result(info, download=False)
+        premuxed = find_premuxed(selected) if not chosen and self.profile.prefer_premuxed else None
+        if premuxed is not None:
+            # 有同等质量的预合并格式，下载一个文件即可，不需要合并
+            selected = use_premuxed(selected, premuxed)
+        self.selected = selected
+        self.format_id = "+".join(
+            str(fmt.get("format_id")) for fmt in selected.get("requested_formats") or [selected]
+        )
+        filename = ydl.prepare_filename(selected)
+        # 直接调用ydl.dl下载时yt_dlp不会创建输出目录
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        formats = selected.get("requested_formats")
+        if formats:
+            # 需要合并的格式，各部分保存为 标题.f<格式id>.<扩展名>
+            downloads = [
+                (fmt, yt_dlp.utils.prepend_extension(filename, "f%s" % fmt["format_id"], selected["ext"]))
+                for fmt in formats
+            ]
+        else:
+            downloads = [(selected, filename)]
+        # 处理方案只取决于选中的格式，先确定下来以便估计后处理需要的磁盘空间
+        if self.download_type == "视频":
+            self.task, self.plan = plan_video(selected, downloads, filename, self.policy)
+        else:
+            self.task, self.plan = plan_audio(selected, filename, self.policy)
+        if premuxed is not None:
+            self.plan = "预合并格式%s, %s" % (premuxed.get("format_id"), self.plan)
+        self.reserve_space(filename, [fmt for fmt, _ in downloads], selected.get("duration"))
+        for fmt, target in downloads:
+            try:
+                self.download_format(ydl, selected, fmt, target)
+            except Exception:
+                self.failed_format = fmt.get("format_id")
+                self.failed_target = target
+                raise
+        if self.task is None:
+            self.record_download(selected, filename)
+
+    def reserve_space(self, filename, formats, duration=None):
+        """按选中格式的大小预留磁盘空间，空间不够时在这里等待，显示为"等待磁盘空间"阶段"""
+        import yt_dlp
+
+        if self.disk is None:
+            return
+        # 重试或改用次优格式时按新的格式重新预留
+        self.release_space()
+        size = estimate_size(formats, duration)
+        if self.task is not None:
+            # 后处理完成、删除输入文件之前，输出文件与输入文件同时存在
+            size *= 2
+
+        def on_wait(shortage):
+            print("Not enough disk space (%s more needed), waiting: %s" % (format_bytes(shortage), filename))
+            self.report(self.tracker.waiting(None, PHASE_DISK))
+
+        directory = os.path.dirname(os.path.abspath(filename))
+        self.reservation = self.disk.reserve(directory, size, lambda: self.cancelled, on_wait)
+        if self.reservation is None:
+            raise yt_dlp.utils.DownloadCancelled()
+
+    def release_space(self):
+        """释放预留的磁盘空间（任务结束或暂停时由引擎调用）"""
+        if self.reservation is not None:
+            self.disk.release(self.reservation)
+            self.reservation = None
+
+    def download_format(self, ydl, selected, fmt, target):
+        import yt_dlp
+
+        # 上次已下载完成但未来得及后处理的部分直接使用
+        if os.path.exists(target) or self.download_segmented(ydl, fmt, target):
+            return
+        fmt_info = dict(selected)
+        fmt_info.pop("requested_formats", None)
+        fmt_info.update(fmt)
+        result = ydl.dl(target, fmt_info)
+        if not (result[0] if isinstance(result, tuple) else result):
+            raise yt_dlp.utils.DownloadError("下载失败: %s" % target)
+
+    def download_segmented(self, ydl, fmt, target):
+        """直链格式用多连接分段下载，完成返回True；不适用或服务器不支持时返回False，由yt_dlp下载"""
+        import yt_dlp
+
+        if self.connections <= 1 or fmt.get("protocol") not in ("http", "https"):
+            return False
+        headers = dict(fmt.get("http_headers") or {})
+        cookie = ydl.cookiejar.get_cookie_header(fmt["url"])
+        if cookie:
+            headers["Cookie"] = cookie
+        downloader = SegmentedDownloader(
+            fmt["url"], target, headers, segments=self.connections, progress_hook=self.my_hook,
+            on_retry=self.count_retry,
+        )
+        self.segmented = downloader
+        try:
+            downloader.download()
+        except SegmentedDownloadError as e:
+            if e.resumable:
+                # 已下载的分段保留在磁盘上，任务失败后重新下载会从断点继续
+                raise yt_dlp.utils.DownloadError(str(e))
+            # 服务器不支持分段时交给yt_dlp按原方式下载
+            print("Segmented download failed, falling back to yt_dlp: %s" % e)
+            downloader.discard()
+            # 已计入哈希的部分随临时文件一起作废
+            self.hasher.reset()
+            return False
+        finally:
+            self.segmented = None
+        return True
+
+    def link_existing(self, existing, target):
+        """在target处创建指向已有文件的硬链接，返回实际可用的路径"""
+        if self.archive_mode != "link" or os.path.exists(target):
+            return existing
+        try:
+            os.link(existing, target)
+        except OSError:
+            # 跨磁盘或文件系统不支持硬链接时直接使用已有文件
+            return existing
+        return target
+
+    def use_existing(self, info, existing):
+        output_dir = os.path.dirname(self.ydl_opts["outtmpl"])
+        target = os.path.join(output_dir, get_title_key(info.get("title")) + os.path.splitext(existing)[1])
+        path = self.link_existing(existing, target)
+        # 已有文件下载时记录的校验和，任务的输出即为这个文件（或指向它的硬链接）
+        checksum = self.archive.get_checksum(existing)
+        if path != existing:
+            self.archive.record(info, self.download_type, path, checksum=checksum)
+        self.output_path = path
+        self.output_size = os.path.getsize(path)
+        self.checksum = checksum
+        print("Already downloaded: %s" % existing)
+
+    def record_download(self, info, path):
+        """记录输出文件的校验和，并把文件写入下载索引，内容哈希与已有文件相同时只保留一份"""
+        if not os.path.exists(path):
+            return
+        # 直接使用的下载文件在下载过程中已算好哈希；后处理的输出刚刚写完，读取时仍在页缓存中
+        checksum = self.hasher.hashes.get(path) or hash_file(path)
+        if self.archive is not None:
+            content_hash = self.hasher.content_hash if self.hash_content else None
+            duplicate = self.archive.find_by_hash(content_hash, os.path.normpath(path))
+            if duplicate is not None:
+                os.remove(path)
+                path = self.link_existing(duplicate, path)
+                if self.task is not None:
+                    # 内容哈希按下载的输入文件计算，后处理的输出不一定逐字节相同，校验实际保留的文件
+                    checksum = hash_file(path)
+            self.archive.record(info, self.download_type, path, content_hash, checksum)
+        # 重复的文件被删除后，记录实际保留的文件（硬链接或已有文件）
+        self.output_path = path
+        self.output_size = os.path.getsize(path)
+        self.checksum = checksum
+
+    def report(self, snapshot):
+        if snapshot is not None and self.on_progress is not None:
+            self.on_progress(snapshot)
+
+    # 自定义下载进度钩子函数
+    def my_hook(self, d):
+        if self.cancelled:
+            import yt_dlp
+
+            raise yt_dlp.utils.DownloadCancelled()
+        if self.throttle is not None:
+            # 超出分配的速率时在下载线程中睡眠
+            self.throttle.update(d)
+        self.hasher.update(d)
+        # 每个数据块都会回调，只有需要刷新界面时才上报进度
+        self.report(self.tracker.update(d))
+        if self.reservation is not None:
+            # 已写入的部分不再占用预留
+            self.reservation.written = self.tracker.downloaded_bytes
+
+    # 合并、转码等后处理阶段的钩子函数
+    def pp_hook(self, d):
+        self.report(self.tracker.update_phase(d))
+
+
+def extract_options(download_type):
+    """只解析不下载时的yt_dlp选项，批量解析和订阅同步共用，可以借用会话池中的同一批实例"""
+    opts = {
+        "quiet": True,
+        "format": get_format(download_type),
+        # 播放列表只取条目链接，条目的完整元数据由线程池并行解析
+        "extract_flat": "in_playlist",
+    }
+    if os.path.exists("cookies.txt"):
+        opts["cookiefile"] = "cookies.txt"
+    return opts
+
+
+class BatchExtractor:
+    """批量解析：展开播放列表/频道，并用线程池并行解析每个条目的元数据
+
+    每个条目解析完成后立即以(链接, 下载类型, 元数据)调用on_entry，失败时以(链接, 错误信息)调用on_failed。
+    """
+
+    def __init__(self, urls, download_type, on_entry, on_failed, max_workers=8, cache=None, sessions=None):
+        self.urls = urls
+        self.download_type = download_type
+        self.on_entry = on_entry
+        self.on_failed = on_failed
+        self.max_workers = max_workers
+        self.cache = cache
+        self.ydl_opts = extract_options(download_type)
+        # 共享的会话池，有则从池中借出实例，解析结束后归还给后面的批量解析
+        self.sessions = sessions
+        # YoutubeDL不是线程安全的，每个工作线程使用自己的实例
+        self._local = threading.local()
+        self._instances = []
+        self._lock = threading.Lock()
+
+    def _get_ydl(self):
+        ydl = getattr(self._local, "ydl", None)
+        if ydl is None:
+            import yt_dlp
+
+            if self.sessions is not None:
+                session = self.sessions.acquire(self.ydl_opts)
+                ydl = session.ydl
+            else:
+                session = ydl = yt_dlp.YoutubeDL(self.ydl_opts)
+            self._local.ydl = ydl
+            with self._lock:
+                self._instances.append(session)
+        return ydl
+
+    def _extract(self, url):
+        if self.cache is not None:
+            info = self.cache.get(url)
+            if info is not None:
+                return "info", info
+        # 不处理结果，播放列表的条目保持为未解析的链接
+        info = self._get_ydl().extract_info(url, download=False, process=False)
+        if self.cache is not None:
+            self.cache.put(url, info)
+        if info.get("_type") in ("playlist", "multi_video"):
+            entries = []
+            for entry in info.get("entries") or []:
+                if entry:
+                    entries.append(entry.get("webpage_url") or entry.get("url"))
+            return "entries", entries
+        if info.get("_type") in ("url", "url_transparent"):
+            return "entries", [info["url"]]
+        # 单个视频已经是完整元数据，直接进入下载队列
+        return "info", info
+
+    def run(self):
+        import yt_dlp
+
+        with ThreadPoolExecutor(self.max_workers) as pool:
+            futures = {pool.submit(self._extract, url): url for url in self.urls}
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url = futures.pop(future)
+                    try:
+                        kind, result = future.result()
+                    except yt_dlp.utils.DownloadError as e:
+                        self.on_failed(url, str(e))
+                        continue
+                    if kind == "info":
+                        self.on_entry(result.get("webpage_url") or url, self.download_type, result)
+                    else:
+                        for entry_url in result:
+                            if entry_url:
+                                futures[pool.submit(self._extract, entry_url)] = entry_url
+        for session in self._instances:
+            if self.sessions is not None:
+                self.sessions.release(session)
+            else:
+                session.close()
+
+
+class DownloadJob:
+    """下载队列中的单个任务"""
+    # 任务状态
+    PENDING = "等待中"
+    RUNNING = "下载中"
+    DONE = "已完成"
+    SKIPPED = "已存在"
+    FAILED = "失败"
+    CANCELLED = "已取消"
+    # 下载已完成，正在合并或提取音频
+    PROCESSING = "处理中"
+    # 用户暂停，已下载的部分保留，继续后从断点下载
+    PAUSED = "已暂停"
+
+    def __init__(self, job_id, url, download_type, outtmpl, info=None, title=None, profile=None, priority=0):
+        self.id = job_id
+        self.url = url
+        self.download_type = download_type
+        self.outtmpl = outtmpl
+        self.info = info
+        self.title = info.get("title") if info else title
+        # 格式要求，None时使用默认选择
+        self.profile = profile
+        # 带宽分配权重，越大分到的带宽越多
+        self.weight = 1
+        # 优先级，越大越先下载，高于正在下载的任务时可以抢占它的下载名额
+        self.priority = priority
+        # 正在下载时收到的暂停（"pause"）或抢占（"preempt"）请求，下载线程结束时处理
+        self.interrupt = None
+        # 实际下载的格式id
+        self.format_id = None
+        # 按主机名限制并发，避免同一站点被过多连接限流
+        self.host = urlparse(url).hostname or ""
+        self.state = DownloadJob.PENDING
+        self.progress = 0.0
+        # 下载阶段、速度（字节/秒）和剩余时间（秒），未知时为None
+        self.phase = None
+        self.speed = None
+        self.eta = None
+        self.error = None
+        # 失败的类别，见retry模块
+        self.error_category = None
+        # 各阶段耗时（秒）、字节数和重试次数
+        self.timings = {}
+        self.bytes = {}
+        self.retries = {}
+        # 下载后的处理方式，如"流复制 合并 → mkv"、"转码 vorbis → mp3"
+        self.plan = None
+        # 输出文件和下载时计算的校验和（sha256），完成后设置
+        self.path = None
+        self.checksum = None
+
+    def is_active(self):
+        return self.state in (DownloadJob.PENDING, DownloadJob.RUNNING, DownloadJob.PROCESSING, DownloadJob.PAUSED)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "url": self.url,
+            "type": self.download_type,
+            "title": self.title,
+            "state": self.state,
+            "phase": self.phase,
+            "progress": round(self.progress, 1),
+            "speed": self.speed,
+            "eta": self.eta,
+            "error": self.error,
+            "error_category": self.error_category,
+            "timings": self.timings,
+            "bytes": self.bytes,
+            "retries": self.retries,
+            "plan": self.plan,
+            "profile": self.profile.to_dict() if self.profile else None,
+            "format": self.format_id,
+            "path": self.path,
+            "checksum": self.checksum,
+            "weight": self.weight,
+            "priority": self.priority,
+        }
+
+
+class DownloadEngine:
+    """下载队列：用有限数量的工作线程并发执行任务，并限制单个站点的并发数
+
+    任务变化通过subscribe注册的回调通知，回调参数为(事件, 任务)，事件为"added"、"updated"或"finished"，
+    回调可能在任意线程中调用。
+    """
+
+    def __init__(self, video_output_dir="视频", audio_output_dir="音频", max_workers=3, per_host_limit=2,
+                 connections=8):
+        self.video_output_dir = video_output_dir
+        self.audio_output_dir = audio_output_dir
+        self.max_workers = max(1, max_workers)
+        self.per_host_limit = max(1, per_host_limit)
+        self.connections = max(1, connections)
+        # 已下载过的视频：跳过（skip）或在新文件名处链接已有文件（link）
+        self.archive_mode = "skip"
+        self.hash_content = False
+        # 输出要求：音频编码、视频封装，以及是否优先使用预合并格式
+        self.policy = OutputPolicy()
+        self.jobs = {}
+        self._pending = deque()
+        # 正在运行的任务id -> Downloader
+        self._running = {}
+        # 正在后处理的任务id -> Downloader，不占用下载名额
+        self._processing = {}
+        self.postprocessor = PostProcessPool()
+        # 所有任务共享的YoutubeDL实例和cookies，复用提取器和keep-alive连接
+        self.sessions = SessionPool()
+        # 全局带宽上限，所有正在下载的任务按权重共享
+        self.bandwidth = BandwidthScheduler()
+        # 磁盘空间准入，开始下载前按估计的大小预留空间
+        self.disk = DiskSpace()
+        # 正在运行的批量解析数
+        self._extractors = 0
+        self._subscribers = []
+        # 运行指标，任务结束时汇总
+        self.metrics = JobMetrics()
+        self._subscribers.append(self.metrics.on_event)
+        self._lock = threading.RLock()
+        self._idle = threading.Condition(self._lock)
+        self.cache = ExtractCache()
+        # 任务日志，任务id由日志分配，重启后保持不变
+        self.journal = JobJournal()
+        # 订阅的播放列表/频道和其中见过的条目
+        self.subscriptions = SubscriptionStore()
+        # 下载索引，首次使用时扫描已有的视频/音频目录
+        self.archive = DownloadArchive()
+        # 目录扫描在后台进行，扫描期间的查重会等待扫描完成
+        threading.Thread(
+            target=self.archive.seed, args=({"视频": video_output_dir, "音频": audio_output_dir},), daemon=True
+        ).start()
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def _notify(self, event, job):
+        for callback in list(self._subscribers):
+            callback(event, job)
+
+    def get_output_template(self, download_type):
+        output_dir = self.video_output_dir if download_type == "视频" else self.audio_output_dir
+        return os.path.join(output_dir, OUTPUT_TEMPLATE)
+
+    def get_jobs(self):
+        """返回所有任务的列表（可在任意线程中安全遍历）"""
+        with self._lock:
+            return list(self.jobs.values())
+
+    def add(self, url, download_type, info=None, profile=None, priority=0):
+        """添加下载任务，返回任务id；profile为formats.FormatProfile，priority越大越先下载"""
+        outtmpl = self.get_output_template(download_type)
+        title = info.get("title") if info else None
+        job_id = self.journal.add(
+            url, download_type, outtmpl, DownloadJob.PENDING, title, profile=profile.to_dict() if profile else None,
+            priority=priority,
+        )
+        job = DownloadJob(job_id, url, download_type, outtmpl, info, profile=profile, priority=priority)
+        self._enqueue(job)
+        return job.id
+
+    def restore(self):
+        """重新加入上次关闭或崩溃时未完成的任务，下载会从已有的.part文件和分片继续；已暂停的任务保持暂停"""
+        for job_id, url, download_type, outtmpl, title, profile, state, priority in self.journal.unfinished():
+            profile = FormatProfile.from_dict(profile) if profile else None
+            job = DownloadJob(job_id, url, download_type, outtmpl, title=title, profile=profile, priority=priority)
+            if state == DownloadJob.PAUSED:
+                job.state = DownloadJob.PAUSED
+            self._enqueue(job)
+
+    def _enqueue(self, job):
+        with self._lock:
+            self.jobs[job.id] = job
+            if job.state == DownloadJob.PENDING:
+                self._pending.append(job)
+            # 在锁内通知，保证"added"一定先于该任务的其他事件
+            self._notify("added", job)
+        self._schedule()
+
+    def add_batch(self, urls, download_type, profile=None, priority=0):
+        """批量添加链接：播放列表/频道会被展开，每个条目解析完成后立即进入下载队列"""
+        extractor = BatchExtractor(
+            urls, download_type,
+            lambda url, download_type, info: self.add(url, download_type, info, profile, priority),
+            lambda url, message: self._add_failed(url, download_type, message),
+            cache=self.cache, sessions=self.sessions,
+        )
+        with self._lock:
+            self._extractors += 1
+        threading.Thread(target=self._run_extractor, args=(extractor,), daemon=True).start()
+
+    def _run_extractor(self, extractor):
+        try:
+            extractor.run()
+        finally:
+            with self._lock:
+                self._extractors -= 1
+                self._idle.notify_all()
+
+    def add_subscription(self, url, download_type, profile=None, priority=0):
+        """订阅播放列表或频道，返回订阅id；新视频在sync_subscriptions时加入下载队列"""
+        return self.subscriptions.add(url, download_type, profile, priority)
+
+    def sync_subscriptions(self, subscription_ids=None, limit=None):
+        """在后台同步订阅（默认全部），只读取到见过的条目为止，新条目按发布顺序加入下载队列"""
+        with self._lock:
+            self._extractors += 1
+        threading.Thread(target=self._run_sync, args=(subscription_ids, limit), daemon=True).start()
+
+    def _run_sync(self, subscription_ids, limit):
+        import yt_dlp
+
+        try:
+            for subscription in self.subscriptions.list():
+                if subscription_ids is not None and subscription.id not in subscription_ids:
+                    continue
+                try:
+                    with self.sessions.session(extract_options(subscription.download_type)) as ydl:
+                        entries = find_new_entries(ydl, subscription, self.subscriptions, limit)
+                except yt_dlp.utils.DownloadError as e:
+                    self._add_failed(subscription.url, subscription.download_type, str(e))
+                    continue
+                if entries:
+                    self.subscriptions.mark_pending(subscription.id, [entry_id for entry_id, _ in entries])
+                    self._add_entries(subscription, entries)
+                # 更新同步时间
+                self.subscriptions.mark_seen(subscription.id, [])
+        finally:
+            with self._lock:
+                self._extractors -= 1
+                self._idle.notify_all()
+
+    def _add_entries(self, subscription, entries):
+        """解析并加入订阅的新条目，每个条目写入任务日志后才记为见过，解析失败的条目在下次同步时重试"""
+        entry_ids = {}
+        for entry_id, url in entries:
+            entry_ids[url] = entry_ids[entry_id] = entry_id
+
+        def on_entry(url, download_type, info):
+            self.add(url, download_type, info, subscription.profile, subscription.priority)
+            # 解析后的链接可能与播放列表中的不同，依次按传入的链接、解析后的链接和视频id对应
+            for key in (info.get("original_url"), url, info.get("id")):
+                if key in entry_ids:
+                    self.subscriptions.mark_seen(subscription.id, [entry_ids[key]])
+                    break
+
+        # 在本同步线程中运行，解析完所有新条目后同步才算结束
+        BatchExtractor(
+            [url for _, url in entries], subscription.download_type, on_entry,
+            lambda url, message: self._add_failed(url, subscription.download_type, message),
+            cache=self.cache, sessions=self.sessions,
+        ).run()
+
+    def _add_failed(self, url, download_type, message):
+        # 解析失败的链接也显示在任务列表中
+        outtmpl = self.get_output_template(download_type)
+        job_id = self.journal.add(url, download_type, outtmpl, DownloadJob.FAILED, error=message)
+        job = DownloadJob(job_id, url, download_type, outtmpl)
+        job.state = DownloadJob.FAILED
+        job.error = message
+        with self._lock:
+            self.jobs[job.id] = job
+        self._notify("added", job)
+        self._notify("finished", job)
+
+    def set_max_workers(self, count):
+        self.max_workers = max(1, count)
+        self._schedule()
+
+    def set_per_host_limit(self, count):
+        self.per_host_limit = max(1, count)
+        self._schedule()
+
+    def set_connections(self, count):
+        # 只影响之后开始的任务
+        self.connections = max(1, count)
+
+    def set_archive_mode(self, mode):
+        self.archive_mode = mode
+
+    def set_hash_content(self, enabled):
+        self.hash_content = bool(enabled)
+
+    def set_audio_codec(self, codec):
+        self.policy.audio_codec = codec
+
+    def set_container(self, container):
+        self.policy.container = container
+
+    def set_rate_limit(self, rate):
+        """设置总下载速率上限（字节/秒），0为不限速，对正在下载的任务立即生效"""
+        self.bandwidth.set_rate(max(0, rate))
+
+    def set_bandwidth_schedule(self, schedule):
+        """设置分时段限速[(开始分钟, 结束分钟, 速率)]，不在任何时段内时使用set_rate_limit的值"""
+        self.bandwidth.set_schedule(schedule)
+
+    def set_weight(self, job_id, weight):
+        """设置任务的带宽权重，正在下载的任务立即按新权重分配"""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return False
+            job.weight = max(1, weight)
+            downloader = self._running.get(job_id)
+            if downloader is not None:
+                self.bandwidth.set_weight(downloader.throttle, job.weight)
+        self._notify("updated", job)
+        return True
+
+    def set_metrics_log(self, path):
+        """每个任务结束时向path追加一行JSON日志，None为不记录"""
+        self.metrics.log_path = path
+
+    def render_metrics(self):
+        """Prometheus文本格式的运行指标"""
+        return self.metrics.render(self.get_jobs())
+
+    def write_metrics(self, path):
+        self.metrics.write(path, self.get_jobs())
+
+    def active_count(self):
+        with self._lock:
+            return len(self._pending) + len(self._running) + len(self._processing) + self._extractors
+
+    def wait(self, timeout=None):
+        """阻塞直到所有任务和批量解析都结束，超时返回False"""
+        with self._idle:
+            return self._idle.wait_for(lambda: self.active_count() == 0, timeout)
+
+    def shutdown(self):
+        """程序退出时调用：关闭会话池中的YoutubeDL实例和连接，并写回cookies；未完成的任务留在任务日志中"""
+        self.sessions.close()
+
+    def _host_load(self, host):
+        return sum(1 for job_id in self._running if self.jobs[job_id].host == host)
+
+    def _take_next(self):
+        # 取出所在站点未达并发上限的任务中优先级最高的，优先级相同时按加入顺序
+        best = None
+        for job in self._pending:
+            if self._host_load(job.host) < self.per_host_limit and (best is None or job.priority > best.priority):
+                best = job
+        if best is not None:
+            self._pending.remove(best)
+        return best
+
+    def _preempt(self):
+        """等待中的任务优先级高于正在下载的任务时，中止优先级最低的任务让出名额，被中止的任务重新排队"""
+        # 已经在停止的任务让出的名额留给优先级最高的等待任务
+        stopping = sum(1 for downloader in self._running.values() if downloader.cancelled)
+        for job in sorted(self._pending, key=lambda job: -job.priority):
+            if stopping:
+                stopping -= 1
+                continue
+            host_full = self._host_load(job.host) >= self.per_host_limit
+            if not host_full and len(self._running) < self.max_workers:
+                continue
+            victims = [
+                self.jobs[job_id] for job_id, downloader in self._running.items()
+                if not downloader.cancelled and self.jobs[job_id].priority < job.priority
+                and (not host_full or self.jobs[job_id].host == job.host)
+            ]
+            if not victims:
+                break
+            victim = min(victims, key=lambda victim: victim.priority)
+            victim.interrupt = "preempt"
+            self._running[victim.id].cancel()
+
+    def _schedule(self):
+        started = []
+        with self._lock:
+            while len(self._running) < self.max_workers:
+                job = self._take_next()
+                if job is None:
+                    break
+                job.state = DownloadJob.RUNNING
+                self._running[job.id] = Downloader(
+                    job.url, job.download_type, job.outtmpl, job.info, self.cache, self.connections,
+                    self.archive, self.archive_mode, self.hash_content,
+                    policy=copy.copy(self.policy), profile=job.profile, throttle=self.bandwidth.register(job.weight),
+                    sessions=self.sessions, disk=self.disk,
+                    on_progress=lambda snapshot, job=job: self._on_progress(job, snapshot),
+                )
+                # 元数据交给下载器后即可释放，避免大播放列表长期占用内存
+                job.info = None
+                started.append((job, self._running[job.id]))
+            self._preempt()
+        for job, downloader in started:
+            self.journal.update(job.id, job.state)
+            self._notify("updated", job)
+            threading.Thread(target=self._run_job, args=(job, downloader), daemon=True).start()
+
+    def cancel(self, job_id):
+        """取消等待中、已暂停或正在下载的任务，任务已结束或不存在时返回False"""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or not job.is_active() or job.state == DownloadJob.PROCESSING:
+                # 后处理很快结束，不支持取消
+                return False
+            if job.id in self._running:
+                # 下载线程结束时把状态改为已取消，覆盖之前的暂停请求
+                job.interrupt = None
+                self._running[job.id].cancel()
+                return True
+            if job in self._pending:
+                self._pending.remove(job)
+            job.state = DownloadJob.CANCELLED
+            self._idle.notify_all()
+        self.journal.update(job.id, job.state)
+        self._notify("updated", job)
+        self._notify("finished", job)
+        return True
+
+    def pause(self, job_id):
+        """暂停等待中或正在下载的任务，已下载的部分保留；任务不能暂停时返回False"""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return False
+            if job.id in self._running:
+                # 下载线程结束时把状态改为已暂停
+                job.interrupt = "pause"
+                self._running[job.id].cancel()
+                return True
+            if job not in self._pending:
+                return False
+            self._pending.remove(job)
+            job.state = DownloadJob.PAUSED
+            self._idle.notify_all()
+        self.journal.update(job.id, job.state)
+        self._notify("updated", job)
+        return True
+
+    def resume(self, job_id):
+        """继续已暂停的任务，按优先级重新排队"""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.state != DownloadJob.PAUSED:
+                return False
+            job.state = DownloadJob.PENDING
+            self._pending.append(job)
+        self.journal.update(job.id, job.state)
+        self._notify("updated", job)
+        self._schedule()
+        return True
+
+    def set_priority(self, job_id, priority):
+        """修改任务的优先级，高于正在下载的任务时会抢占它们的下载名额"""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or not job.is_active():
+                return False
+            job.priority = priority
+        self.journal.set_priority(job.id, priority)
+        self._notify("updated", job)
+        self._schedule()
+        return True
+
+    def _run_job(self, job, downloader):
+        try:
+            downloader.run()
+        finally:
+            # 下载阶段结束，份额立即分给其余任务
+            downloader.throttle.close()
+            if downloader.success and downloader.task is not None:
+                # 下载完成后立即让出下载名额，合并和转码在后处理池中进行
+                job.state = DownloadJob.PROCESSING
+                job.phase = downloader.task.phase
+                job.speed = job.eta = None
+                job.title = downloader.title or job.title
+                job.timings = dict(downloader.timings)
+                job.bytes = dict(downloader.bytes)
+                job.retries = dict(downloader.retries)
+                job.plan = downloader.plan
+                job.format_id = downloader.format_id
+                self.journal.update(job.id, job.state, job.title)
+                self._notify("updated", job)
+                with self._lock:
+                    self._processing[job.id] = self._running.pop(job.id)
+                self.postprocessor.submit(self._postprocess, job, downloader)
+            else:
+                self._finish(job, downloader, self._running)
+        self._schedule()
+
+    def _postprocess(self, job, downloader):
+        try:
+            downloader.postprocess()
+        finally:
+            self._finish(job, downloader, self._processing)
+
+    def _requeue(self, job, downloader):
+        """暂停或被抢占的任务：已下载的部分保留在磁盘上，再次下载时从断点继续"""
+        # 再次下载时重新预留，等待期间空间留给其他任务
+        downloader.release_space()
+        job.phase = job.speed = job.eta = None
+        job.title = downloader.title or job.title
+        # 批量解析得到的元数据留给下次下载，不必重新解析
+        job.info = downloader.info
+        with self._lock:
+            self._running.pop(job.id, None)
+            if job.interrupt == "pause":
+                job.state = DownloadJob.PAUSED
+            else:
+                job.state = DownloadJob.PENDING
+                self._pending.appendleft(job)
+            job.interrupt = None
+            self._idle.notify_all()
+        self.journal.update(job.id, job.state, job.title)
+        self._notify("updated", job)
+
+    def _finish(self, job, downloader, stage):
+        if job.interrupt is not None and downloader.cancelled and not downloader.success:
+            self._requeue(job, downloader)
+            return
+        downloader.release_space()
+        job.interrupt = None
+        job.phase = job.speed = job.eta = None
+        job.title = downloader.title or job.title
+        job.error = downloader.error
+        job.error_category = downloader.error_category
+        job.timings = dict(downloader.timings)
+        job.bytes = dict(downloader.bytes)
+        job.retries = dict(downloader.retries)
+        job.plan = downloader.plan
+        job.format_id = downloader.format_id or job.format_id
+        if downloader.success:
+            job.state = DownloadJob.SKIPPED if downloader.skipped else DownloadJob.DONE
+            job.progress = 100.0
+            if downloader.output_path is not None:
+                job.path = downloader.output_path
+                job.checksum = downloader.checksum
+                self.journal.set_output(job.id, job.path, downloader.output_size, job.checksum)
+        elif downloader.cancelled:
+            job.state = DownloadJob.CANCELLED
+        else:
+            job.state = DownloadJob.FAILED
+        self.journal.update(job.id, job.state, job.title, job.error)
+        self._notify("updated", job)
+        self._notify("finished", job)
+        # 通知完成后才移出运行集合，wait()返回时所有事件都已送达
+        with self._lock:
+            stage.pop(job.id, None)
+            self._idle.notify_all()
+
+    def _on_progress(self, job, snapshot):
+        job.progress = snapshot.percent
+        job.phase = snapshot.phase
+        job.speed = snapshot.speed
+        job.eta = snapshot.eta
+        self._notify("updated", job)
@@ -0,0 +1,160 @@
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+# 常见的签名链接过期参数，值为unix时间戳
+EXPIRE_PARAMS = ("expire", "expires", "x-expires", "exp", "e")
+# 链接距离过期不足该秒数时视为已过期，留出下载开始前的余量
+EXPIRE_MARGIN = 300
+# 不影响内容的跟踪参数，规范化链接时去掉
+TRACKING_PARAMS = ("utm_source", "utm_medium", "utm_campaign", "utm_term", "utm_content", "si", "feature", "spm_id_from")
+
+
+def normalize_url(url):
+    """规范化链接：主机名小写、去掉锚点和跟踪参数、查询参数排序"""
+    parts = urlparse(url.strip())
+    query = sorted(
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS
+    )
+    return urlunparse((parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.params, urlencode(query), ""))
+
+
+def get_cache_key(url):
+    """优先使用"提取器:视频id"作为缓存键，不同形式的同一视频链接可以命中同一条缓存"""
+    import yt_dlp
+
+    for ie in yt_dlp.extractor.gen_extractor_classes():
+        if ie.ie_key() == "Generic" or not ie.suitable(url):
+            continue
+        try:
+            video_id = ie.get_temp_id(url)
+        except Exception:
+            video_id = None
+        if video_id:
+            return "%s:%s" % (ie.ie_key(), video_id)
+        break
+    return normalize_url(url)
+
+
+def get_url_expiry(info):
+    """返回元数据中签名媒体链接最早的过期时间，没有签名链接时返回None"""
+    urls = [info.get("url")]
+    for fmt in info.get("formats") or []:
+        urls.append(fmt.get("url"))
+        urls.append(fmt.get("manifest_url"))
+    expiry = None
+    for url in urls:
+        if not url:
+            continue
+        query = parse_qsl(urlparse(url).query)
+        # googlevideo等站点把过期时间放在路径里：/expire/1700000000/
+        path_parts = urlparse(url).path.split("/")
+        for index, part in enumerate(path_parts[:-1]):
+            if part in EXPIRE_PARAMS:
+                query.append((part, path_parts[index + 1]))
+        for key, value in query:
+            if key.lower() in EXPIRE_PARAMS and value.isdigit() and len(value) >= 9:
+                expiry = int(value) if expiry is None else min(expiry, int(value))
+    return expiry
+
+
+def is_expired(info, margin=EXPIRE_MARGIN):
+    """元数据中的签名媒体链接是否已过期（或不足margin秒即将过期）"""
+    expiry = get_url_expiry(info)
+    return expiry is not None and expiry - margin <= time.time()
+
+
+class ExtractCache:
+    """yt_dlp解析结果的磁盘缓存（sqlite），支持TTL、LRU淘汰和签名链接过期失效"""
+
+    def __init__(self, path="extract_cache.db", ttl=6 * 3600, max_entries=2000, max_bytes=200 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS extract_cache (
+                key TEXT PRIMARY KEY,
+                extractor TEXT,
+                video_id TEXT,
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS extract_cache_access ON extract_cache (last_access)")
+        self._db.commit()
+
+    def get(self, url):
+        """返回缓存的元数据，未命中或已过期返回None"""
+        key = get_cache_key(url)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT data, expires_at FROM extract_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self._db.execute("DELETE FROM extract_cache WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+            self._db.execute("UPDATE extract_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._db.commit()
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, url, info):
+        """保存单个视频的元数据，直播和播放列表不缓存"""
+        if info.get("_type") not in (None, "video") or info.get("is_live"):
+            return
+        now = time.time()
+        expires_at = now + self.ttl
+        url_expiry = get_url_expiry(info)
+        if url_expiry is not None:
+            expires_at = min(expires_at, url_expiry - EXPIRE_MARGIN)
+        if expires_at <= now:
+            return
+        import yt_dlp
+
+        data = zlib.compress(json.dumps(yt_dlp.YoutubeDL.sanitize_info(info)).encode("utf-8"))
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO extract_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (get_cache_key(url), info.get("extractor_key"), info.get("id"), data, len(data), expires_at, now),
+            )
+            self._evict()
+            self._db.commit()
+
+    def invalidate(self, url):
+        with self._lock:
+            self._db.execute("DELETE FROM extract_cache WHERE key = ?", (get_cache_key(url),))
+            self._db.commit()
+
+    def _evict(self):
+        # 先清理过期条目，再按最近访问时间淘汰，直到条数和总大小都在限制内
+        self._db.execute("DELETE FROM extract_cache WHERE expires_at <= ?", (time.time(),))
+        count, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM extract_cache").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        for key, size in self._db.execute(
+            "SELECT key, size FROM extract_cache ORDER BY last_access"
+        ).fetchall():
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM extract_cache WHERE key = ?", (key,))
+            count -= 1
+            total -= size
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,178 @@
+"""按用户约束选择格式
+
+在extract_info返回的formats中，先按最高分辨率、帧率和文件大小约束筛选，
+再按分辨率、帧率、编码偏好排序；质量相同时优先不需要合并的预合并格式和字节数更少的格式。
+"""
+from remux import codec_family
+
+
+class FormatProfile:
+    """单个任务的格式要求，所有约束为空时使用yt_dlp的默认选择"""
+    FIELDS = ("max_height", "max_fps", "video_codecs", "audio_codecs", "max_filesize", "prefer_premuxed")
+
+    def __init__(self, max_height=None, max_fps=None, video_codecs=(), audio_codecs=(), max_filesize=None,
+                 prefer_premuxed=True):
+        self.max_height = max_height
+        self.max_fps = max_fps
+        # 编码偏好，按顺序优先，如("h264", "vp9")，名称与remux.codec_family一致
+        self.video_codecs = tuple(video_codecs)
+        self.audio_codecs = tuple(audio_codecs)
+        # 字节数上限（视频和音频合计）
+        self.max_filesize = max_filesize
+        # 质量相同时优先使用预合并格式，省去合并
+        self.prefer_premuxed = prefer_premuxed
+
+    def is_default(self):
+        return not (self.max_height or self.max_fps or self.video_codecs or self.audio_codecs or self.max_filesize)
+
+    def to_dict(self):
+        return {
+            "max_height": self.max_height,
+            "max_fps": self.max_fps,
+            "video_codecs": list(self.video_codecs),
+            "audio_codecs": list(self.audio_codecs),
+            "max_filesize": self.max_filesize,
+            "prefer_premuxed": self.prefer_premuxed,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """从字典创建，字段类型不正确时抛出ValueError"""
+        if not isinstance(data, dict):
+            raise ValueError("profile必须是对象")
+        unknown = set(data) - set(cls.FIELDS)
+        if unknown:
+            raise ValueError("未知的profile字段: %s" % ", ".join(sorted(unknown)))
+        for field in ("max_height", "max_fps", "max_filesize"):
+            value = data.get(field)
+            if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value <= 0):
+                raise ValueError("%s必须是正整数" % field)
+        for field in ("video_codecs", "audio_codecs"):
+            value = data.get(field) or []
+            if not isinstance(value, list) or not all(isinstance(codec, str) for codec in value):
+                raise ValueError("%s必须是字符串列表" % field)
+        prefer_premuxed = data.get("prefer_premuxed")
+        if prefer_premuxed is None:
+            prefer_premuxed = True
+        elif not isinstance(prefer_premuxed, bool):
+            # 不能用bool()转换，JSON字符串"false"会被当作True
+            raise ValueError("prefer_premuxed必须是true或false")
+        return cls(
+            data.get("max_height"), data.get("max_fps"), data.get("video_codecs") or (),
+            data.get("audio_codecs") or (), data.get("max_filesize"), prefer_premuxed,
+        )
+
+    def describe(self):
+        parts = []
+        if self.max_height:
+            parts.append("≤%dp" % self.max_height)
+        if self.max_fps:
+            parts.append("≤%dfps" % self.max_fps)
+        parts.extend(self.video_codecs)
+        parts.extend(self.audio_codecs)
+        if self.max_filesize:
+            parts.append("≤%dMB" % (self.max_filesize // (1024 * 1024)))
+        return " ".join(parts) or "默认"
+
+
+def estimate_size(fmt, duration):
+    """估算格式的字节数，未知时返回None"""
+    size = fmt.get("filesize") or fmt.get("filesize_approx")
+    if size:
+        return size
+    if fmt.get("tbr") and duration:
+        # tbr单位为kbit/s
+        return int(fmt["tbr"] * 1000 / 8 * duration)
+    return None
+
+
+def codec_rank(codec, preferred):
+    """编码在偏好列表中的位置，越小越优先，不在列表中的排在最后"""
+    family = codec_family(codec)
+    return preferred.index(family) if family in preferred else len(preferred)
+
+
+def usable(fmt):
+    # 跳过加密格式和故事板（缩略图）
+    return not fmt.get("has_drm") and (codec_family(fmt.get("vcodec")) or codec_family(fmt.get("acodec")))
+
+
+def audio_rank(fmt, profile):
+    """音频质量的排序键：先按编码偏好，再按码率从高到低"""
+    # 预合并格式的tbr包含视频码率，只看abr
+    bitrate = fmt.get("abr") or (0 if codec_family(fmt.get("vcodec")) else fmt.get("tbr")) or 0
+    return codec_rank(fmt.get("acodec"), profile.audio_codecs), -bitrate
+
+
+def audio_formats(formats, profile):
+    """纯音频格式，按编码偏好和码率从好到差排序"""
+    candidates = [fmt for fmt in formats if codec_family(fmt.get("acodec")) and not codec_family(fmt.get("vcodec"))]
+    return sorted(candidates, key=lambda fmt: audio_rank(fmt, profile))
+
+
+def select_formats(formats, profile, download_type, duration=None):
+    """返回选中的格式列表（1个为直接下载，2个为视频+音频需要合并），没有可用格式时返回None"""
+    formats = [fmt for fmt in formats if usable(fmt)]
+    if not formats:
+        return None
+    # 所有纯音频格式都作为候选，大小上限由fit_size在其中选择，而不是只看最好的一个
+    audios = audio_formats(formats, profile)
+    if download_type != "视频":
+        # 纯音频格式优先，预合并格式作为后备（提取音频时多下载了视频部分）
+        options = [[fmt] for fmt in audios] + [
+            [fmt] for fmt in formats if codec_family(fmt.get("acodec")) and codec_family(fmt.get("vcodec"))
+        ]
+        if not options:
+            return None
+        return fit_size(options, profile, duration, lambda option: (
+            1 if codec_family(option[0].get("vcodec")) else 0,
+        ) + audio_rank(option[0], profile))
+
+    videos = [fmt for fmt in formats if codec_family(fmt.get("vcodec"))]
+    if not videos:
+        if not audios:
+            return None
+        return fit_size([[fmt] for fmt in audios], profile, duration, lambda option: audio_rank(option[0], profile))
+    allowed = [
+        fmt for fmt in videos
+        if (not profile.max_height or (fmt.get("height") or 0) <= profile.max_height)
+        and (not profile.max_fps or (fmt.get("fps") or 0) <= profile.max_fps)
+    ]
+    if not allowed:
+        # 没有满足分辨率/帧率上限的格式时，选最接近上限的（最低分辨率）
+        lowest = min(fmt.get("height") or 0 for fmt in videos)
+        allowed = [fmt for fmt in videos if (fmt.get("height") or 0) == lowest]
+    options = []
+    for fmt in allowed:
+        if codec_family(fmt.get("acodec")):
+            options.append([fmt])
+        else:
+            options.extend([fmt, audio] for audio in audios)
+    if not options:
+        return None
+
+    def rank(option):
+        video = option[0]
+        premuxed = len(option) == 1
+        return (
+            -(video.get("height") or 0), -(video.get("fps") or 0),
+            codec_rank(video.get("vcodec"), profile.video_codecs),
+            # 质量和编码相同时，预合并格式省去合并
+            0 if premuxed and profile.prefer_premuxed else 1,
+        ) + audio_rank(option[-1], profile)
+
+    return fit_size(options, profile, duration, rank)
+
+
+def fit_size(options, profile, duration, rank):
+    """在大小不超过上限的方案中按rank选最好的，同等质量时选字节数最少的；都超出时选最小的"""
+    def size(option):
+        sizes = [estimate_size(fmt, duration) for fmt in option]
+        return None if None in sizes else sum(sizes)
+
+    if profile.max_filesize:
+        fitting = [option for option in options if size(option) is None or size(option) <= profile.max_filesize]
+        if not fitting:
+            return min(options, key=lambda option: size(option))
+        options = fitting
+    return min(options, key=lambda option: rank(option) + (size(option) or 0,))
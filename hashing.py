@@ -0,0 +1,114 @@
+import hashlib
+import os
+import threading
+
+READ_SIZE = 1024 * 1024
+# 文件校验和的算法，记录在任务日志中
+CHECKSUM_ALGORITHM = "sha256"
+
+# 校验结果
+VERIFY_OK = "正常"
+VERIFY_MISSING = "文件不存在"
+VERIFY_SIZE = "大小不一致"
+VERIFY_CHECKSUM = "校验和不一致"
+
+
+class StreamingHasher:
+    """在下载过程中增量计算文件哈希
+
+    每次进度回调时只读取临时文件中新写入的部分（此时仍在页缓存中），
+    下载完成时哈希也随之完成，不需要再完整读一遍文件。
+    需要合并的任务会依次下载多个文件，content_hash为各文件哈希按完成顺序的组合。
+    """
+
+    def __init__(self, algorithm=CHECKSUM_ALGORITHM):
+        self.algorithm = algorithm
+        self.file_hashes = []
+        # 文件名 -> 该文件的哈希，下载后直接使用的文件以此作为校验和
+        self.hashes = {}
+        self._hash = None
+        self._offset = 0
+        self._inode = None
+        self._finished_files = set()
+        # 分段下载时多个线程会同时回调
+        self._lock = threading.Lock()
+
+    def update(self, d):
+        """处理yt_dlp格式的进度回调"""
+        with self._lock:
+            self._update(d)
+
+    def reset(self):
+        """丢弃正在计算的文件哈希，未完成的文件被删除后调用"""
+        with self._lock:
+            self._hash = None
+            self._offset = 0
+
+    def _update(self, d):
+        if d["status"] == "downloading":
+            # 分段下载时只有从文件开头连续完成的部分可以计入哈希
+            available = d.get("contiguous_bytes", d.get("downloaded_bytes"))
+            self._read(d.get("tmpfilename") or d.get("filename"), available)
+        elif d["status"] == "finished":
+            filename = d.get("filename")
+            if filename in self._finished_files:
+                return
+            self._finished_files.add(filename)
+            # 临时文件已改名为最终文件名，读取剩余部分
+            self._read(filename, None)
+            if self._hash is not None:
+                self.file_hashes.append(self._hash.hexdigest())
+                self.hashes[filename] = self.file_hashes[-1]
+            self._hash = None
+            self._offset = 0
+
+    def _read(self, path, limit):
+        if not path or not os.path.exists(path):
+            return
+        stat = os.stat(path)
+        if self._hash is None or stat.st_size < self._offset or stat.st_ino != self._inode:
+            # 文件被截短（服务器不支持续传时从头重新下载）或换成了另一个文件，已计入的部分作废；
+            # 下载完成时改名不改变inode
+            self._hash = hashlib.new(self.algorithm)
+            self._offset = 0
+            self._inode = stat.st_ino
+        if limit is not None and limit <= self._offset:
+            # 并发下载分片或分片重试时上报的字节数可能回退，不重新读取已计入的部分
+            return
+        with open(path, "rb") as f:
+            f.seek(self._offset)
+            while limit is None or self._offset < limit:
+                size = READ_SIZE if limit is None else min(READ_SIZE, limit - self._offset)
+                chunk = f.read(size)
+                if not chunk:
+                    break
+                self._hash.update(chunk)
+                self._offset += len(chunk)
+
+    @property
+    def content_hash(self):
+        if not self.file_hashes:
+            return None
+        if len(self.file_hashes) == 1:
+            return self.file_hashes[0]
+        return hashlib.new(self.algorithm, "".join(self.file_hashes).encode("ascii")).hexdigest()
+
+
+def hash_file(path, algorithm=CHECKSUM_ALGORITHM):
+    """完整读取文件计算哈希"""
+    file_hash = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(READ_SIZE), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def verify_file(path, size, checksum, quick=False):
+    """按记录的大小和校验和检查文件，quick时只比较大小（不读取文件内容），返回VERIFY_*之一"""
+    if not os.path.exists(path):
+        return VERIFY_MISSING
+    if size is not None and os.path.getsize(path) != size:
+        return VERIFY_SIZE
+    if not quick and checksum and hash_file(path) != checksum:
+        return VERIFY_CHECKSUM
+    return VERIFY_OK
@@ -0,0 +1,125 @@
+"""下载任务列表的表格模型：按固定频率批量刷新
+
+下载线程每秒回调很多次进度，如果每次都跨线程发信号、改写表格单元格和总进度条，
+几十个任务同时下载时界面线程会一直忙于处理信号和重绘。模型订阅引擎事件时只记下变化的任务id，
+界面线程的定时器每REFRESH_INTERVAL毫秒取出一批，重新生成这些任务的显示文本，
+只对文本真正变化的单元格发出dataChanged，视图只重绘这些单元格。
+"""
+import threading
+
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt, QTimer, pyqtSignal
+
+from progress import format_bytes, format_eta, format_timings
+
+# 刷新间隔（毫秒），进度文本每秒最多变化几次，人眼也看不出更快的变化
+REFRESH_INTERVAL = 250
+
+
+def job_row(job):
+    """任务在表格中各列的显示文本"""
+    return (
+        job.title or job.url,
+        job.download_type,
+        # 下载过程中显示具体阶段（下载/合并/后处理）
+        job.phase or job.state,
+        "%.1f%%" % job.progress,
+        format_bytes(job.speed) + "/s" if job.speed else "",
+        format_eta(job.eta),
+        # 解析、下载、合并/提取音频各阶段的耗时
+        format_timings(job.timings),
+        # 直接使用、流复制或转码
+        job.plan or "",
+    )
+
+
+class JobListModel(QAbstractTableModel):
+    """任务列表模型：引擎事件可在任意线程中到达，表格只在界面线程的定时器中批量更新"""
+    HEADERS = ["链接", "类型", "状态", "进度", "速度", "剩余时间", "耗时", "处理方式"]
+    # 取任务id的数据角色
+    JobIdRole = Qt.UserRole
+    # 一批更新应用完成，参数为这一批中结束的任务数
+    refreshed = pyqtSignal(int)
+
+    def __init__(self, queue, parent=None, interval=REFRESH_INTERVAL):
+        super().__init__(parent)
+        self.queue = queue
+        # 每行为任务的显示文本元组，行号按任务加入的顺序
+        self._rows = []
+        self._ids = []
+        self._index = {}
+        # 上次刷新后变化的任务id和结束的任务数，由引擎线程写入
+        self._dirty = set()
+        self._finished = 0
+        self._lock = threading.Lock()
+        queue.subscribe(self._on_event)
+        # 订阅之前已经存在的任务（如共享队列已读取到的任务）
+        self._dirty.update(job.id for job in queue.get_jobs())
+        self._timer = QTimer(self)
+        self._timer.setInterval(interval)
+        self._timer.timeout.connect(self.refresh)
+        self._timer.start()
+
+    def _on_event(self, event, job):
+        # 在下载线程中调用，只做记录，不发信号
+        with self._lock:
+            self._dirty.add(job.id)
+            if event == "finished":
+                self._finished += 1
+
+    def job_id(self, row):
+        return self._ids[row]
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            return self._rows[index.row()][index.column()]
+        if role == JobListModel.JobIdRole:
+            return self._ids[index.row()]
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    def refresh(self):
+        """应用上次刷新以来的变化，代价只与变化的任务数有关"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            finished, self._finished = self._finished, 0
+        if not dirty:
+            return
+        jobs = self.queue.jobs
+        added = []
+        for job_id in sorted(dirty):
+            job = jobs.get(job_id)
+            if job is None:
+                continue
+            row = self._index.get(job_id)
+            values = job_row(job)
+            if row is None:
+                added.append((job_id, values))
+                continue
+            previous = self._rows[row]
+            if values == previous:
+                continue
+            self._rows[row] = values
+            # 只重绘文本变化的列范围（通常只有进度、速度和剩余时间）
+            changed = [column for column, value in enumerate(values) if value != previous[column]]
+            self.dataChanged.emit(self.index(row, changed[0]), self.index(row, changed[-1]), [Qt.DisplayRole])
+        if added:
+            first = len(self._rows)
+            self.beginInsertRows(QModelIndex(), first, first + len(added) - 1)
+            for job_id, values in added:
+                self._index[job_id] = len(self._rows)
+                self._ids.append(job_id)
+                self._rows.append(values)
+            self.endInsertRows()
+        self.refreshed.emit(finished)
@@ -0,0 +1,468 @@
+"""共享任务队列：多个工作进程（可以在不同主机上）从同一个队列领取任务，下载到共同的媒体库
+
+提交端（图形界面、命令行）只写入任务、修改优先级或取消任务，并读取状态；工作进程（见worker.py）
+以租约领取任务，定期发送心跳延长租约并上报进度。工作进程崩溃或断网后租约过期，
+任务回到队列由其他工作进程领取，已下载的.part文件在共同的媒体库中，会从断点继续。
+
+队列是放在所有主机都能访问的目录中的sqlite文件，靠sqlite的文件锁保证同一个任务只租给一个工作进程。
+只用到JobStore的几个方法，换成其他消息队列或数据库时实现同样的方法即可。
+"""
+import json
+import sqlite3
+import sys
+import threading
+import time
+
+from engine import DownloadJob, extract_options
+from formats import FormatProfile
+from metrics import JobMetrics
+from subscriptions import SubscriptionStore, find_new_entries
+
+# 租约时长（秒），工作进程每HEARTBEAT_INTERVAL秒续约一次，连续几次心跳失败才会过期
+LEASE_DURATION = 30
+HEARTBEAT_INTERVAL = 5
+# 同一个任务的租约过期这么多次后不再分配，避免一个会让工作进程崩溃的任务反复拖垮所有进程
+MAX_LEASES = 3
+# 提交端读取状态的间隔（秒）
+POLL_INTERVAL = 1.0
+
+# 每次修改任务时写入的版本号，全局递增；提交端按版本号增量读取，不受各主机时钟误差影响
+NEXT_VERSION = "(SELECT COALESCE(MAX(version), 0) + 1 FROM queue)"
+# 租约的到期时间（Unix时间戳）由数据库计算，领取和续约用同一个时钟，不直接比较各主机time.time()的结果；
+# 换成数据库服务器时就是服务器的时钟，sqlite文件则是执行语句的进程所在主机的时钟
+STORE_NOW = "((julianday('now') - 2440587.5) * 86400.0)"
+# 已租给工作进程的状态
+LEASED_STATES = (DownloadJob.RUNNING, DownloadJob.PROCESSING)
+FINAL_STATES = (DownloadJob.DONE, DownloadJob.SKIPPED, DownloadJob.FAILED, DownloadJob.CANCELLED)
+# 工作进程上报的字段（DownloadJob.to_dict()中的键）
+DETAIL_FIELDS = ("timings", "bytes", "retries", "plan", "format", "error_category", "path", "checksum")
+
+
+class JobStore:
+    """sqlite实现的共享任务队列，每个进程打开自己的连接，可在任意线程中调用"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # 由代码显式开始和提交事务；其他进程持有写锁时最多等待30秒
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        # 不使用WAL：WAL依赖共享内存，多台主机通过网络文件系统访问同一个文件时不可用
+        self._db.execute("PRAGMA journal_mode=DELETE")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL,
+                download_type TEXT NOT NULL,
+                profile TEXT,
+                priority INTEGER NOT NULL DEFAULT 0,
+                state TEXT NOT NULL,
+                worker TEXT,
+                lease_expires REAL,
+                leases INTEGER NOT NULL DEFAULT 0,
+                title TEXT,
+                error TEXT,
+                progress REAL NOT NULL DEFAULT 0,
+                phase TEXT,
+                speed REAL,
+                eta REAL,
+                details TEXT,
+                weight INTEGER NOT NULL DEFAULT 1,
+                version INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS queue_state ON queue (state, priority)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS queue_version ON queue (version)")
+        # 旧版本的队列没有weight列
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(queue)")]
+        if "weight" not in columns:
+            self._db.execute("ALTER TABLE queue ADD COLUMN weight INTEGER NOT NULL DEFAULT 1")
+
+    def _transaction(self, fn, *args):
+        # BEGIN IMMEDIATE立即取得写锁，领取任务时不会有两个进程读到同一批等待中的任务
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(*args)
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+        return result
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    # 提交端
+
+    def submit(self, url, download_type, profile=None, priority=0):
+        """加入队列，返回任务id；profile为formats.FormatProfile"""
+        now = time.time()
+        profile = json.dumps(profile.to_dict()) if profile else None
+        return self._transaction(lambda: self._db.execute(
+            "INSERT INTO queue (url, download_type, profile, priority, state, version, created_at, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, %s, ?, ?)" % NEXT_VERSION,
+            (url, download_type, profile, priority, DownloadJob.PENDING, now, now),
+        ).lastrowid)
+
+    def cancel(self, job_id):
+        """取消未结束的任务，正在下载的工作进程在下次心跳时停止"""
+        return self._set_state(job_id, DownloadJob.CANCELLED, DownloadJob.PENDING, DownloadJob.PAUSED, *LEASED_STATES)
+
+    def pause(self, job_id):
+        """暂停任务，已下载的部分保留在媒体库中，继续后由任意工作进程从断点下载"""
+        return self._set_state(job_id, DownloadJob.PAUSED, DownloadJob.PENDING, *LEASED_STATES)
+
+    def resume(self, job_id):
+        return self._set_state(job_id, DownloadJob.PENDING, DownloadJob.PAUSED)
+
+    def set_priority(self, job_id, priority):
+        return self._transaction(lambda: self._db.execute(
+            "UPDATE queue SET priority = ?, updated_at = ?, version = %s WHERE id = ? AND state NOT IN (?, ?, ?, ?)"
+            % NEXT_VERSION,
+            (priority, time.time(), job_id) + FINAL_STATES,
+        ).rowcount > 0)
+
+    def set_weight(self, job_id, weight):
+        """设置任务的带宽权重，下载中的工作进程在下次心跳时应用"""
+        return self._transaction(lambda: self._db.execute(
+            "UPDATE queue SET weight = ?, updated_at = ?, version = %s WHERE id = ? AND state NOT IN (?, ?, ?, ?)"
+            % NEXT_VERSION,
+            (max(1, weight), time.time(), job_id) + FINAL_STATES,
+        ).rowcount > 0)
+
+    def _set_state(self, job_id, state, *from_states):
+        return self._transaction(lambda: self._db.execute(
+            "UPDATE queue SET state = ?, worker = NULL, lease_expires = NULL, phase = NULL, speed = NULL, eta = NULL,"
+            " updated_at = ?, version = %s WHERE id = ? AND state IN (%s)"
+            % (NEXT_VERSION, ", ".join("?" * len(from_states))),
+            (state, time.time(), job_id) + from_states,
+        ).rowcount > 0)
+
+    def changes(self, since=0):
+        """返回版本号大于since的任务（字典列表）和其中最大的版本号，用于增量刷新"""
+        with self._lock:
+            cursor = self._db.execute("SELECT * FROM queue WHERE version > ? ORDER BY id", (since,))
+            columns = [column[0] for column in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        return rows, max([since] + [row["version"] for row in rows])
+
+    # 工作进程
+
+    def lease(self, worker, count, duration=LEASE_DURATION):
+        """领取最多count个任务（优先级高的先领），包括租约已过期的任务；返回任务字典列表"""
+        return self._transaction(self._lease, worker, count, duration)
+
+    def _lease(self, worker, count, duration):
+        now = time.time()
+        placeholders = ", ".join("?" * len(LEASED_STATES))
+        # 租约过期次数过多的任务不再分配
+        self._db.execute(
+            "UPDATE queue SET state = ?, error = ?, worker = NULL, lease_expires = NULL, updated_at = ?, version = %s"
+            " WHERE state IN (%s) AND lease_expires < %s AND leases >= ?" % (NEXT_VERSION, placeholders, STORE_NOW),
+            (DownloadJob.FAILED, "工作进程多次中断", now) + LEASED_STATES + (MAX_LEASES,),
+        )
+        rows = self._db.execute(
+            "SELECT id, url, download_type, profile, priority, weight FROM queue"
+            " WHERE state = ? OR (state IN (%s) AND lease_expires < %s)"
+            " ORDER BY priority DESC, id LIMIT ?" % (placeholders, STORE_NOW),
+            (DownloadJob.PENDING,) + LEASED_STATES + (count,),
+        ).fetchall()
+        for row in rows:
+            self._db.execute(
+                "UPDATE queue SET state = ?, worker = ?, lease_expires = %s + ?, leases = leases + 1, progress = 0,"
+                " phase = NULL, speed = NULL, eta = NULL, updated_at = ?, version = %s WHERE id = ?"
+                % (STORE_NOW, NEXT_VERSION),
+                (DownloadJob.RUNNING, worker, duration, now, row[0]),
+            )
+        return [
+            {
+                "id": job_id, "url": url, "download_type": download_type,
+                "profile": FormatProfile.from_dict(json.loads(profile)) if profile else None, "priority": priority,
+                "weight": weight,
+            }
+            for job_id, url, download_type, profile, priority, weight in rows
+        ]
+
+    def heartbeat(self, worker, jobs, duration=LEASE_DURATION):
+        """续约并上报进度，jobs为{任务id: DownloadJob}
+
+        返回(不再属于该工作进程的任务id列表（已取消、暂停或被重新分配）, 其余任务的带宽权重{任务id: 权重})。
+        """
+        return self._transaction(self._heartbeat, worker, jobs, duration)
+
+    def _heartbeat(self, worker, jobs, duration):
+        now = time.time()
+        lost = []
+        weights = {}
+        for job_id, job in jobs.items():
+            cursor = self._db.execute(
+                "UPDATE queue SET state = ?, lease_expires = %s + ?, title = COALESCE(?, title), progress = ?, phase = ?,"
+                " speed = ?, eta = ?, updated_at = ?, version = %s WHERE id = ? AND worker = ? AND state IN (%s)"
+                % (STORE_NOW, NEXT_VERSION, ", ".join("?" * len(LEASED_STATES))),
+                (
+                    job.state if job.state in LEASED_STATES else DownloadJob.RUNNING, duration, job.title,
+                    job.progress, job.phase, job.speed, job.eta, now, job_id, worker,
+                ) + LEASED_STATES,
+            )
+            if cursor.rowcount == 0:
+                lost.append(job_id)
+            else:
+                weights[job_id] = self._db.execute("SELECT weight FROM queue WHERE id = ?", (job_id,)).fetchone()[0]
+        return lost, weights
+
+    def finish(self, worker, job_id, job):
+        """记录任务结果，任务已不属于该工作进程时忽略并返回False"""
+        details = job.to_dict()
+        return self._transaction(lambda: self._db.execute(
+            "UPDATE queue SET state = ?, worker = NULL, lease_expires = NULL, title = COALESCE(?, title), error = ?,"
+            " progress = ?, phase = NULL, speed = NULL, eta = NULL, details = ?, updated_at = ?, version = %s"
+            " WHERE id = ? AND worker = ? AND state IN (%s)" % (NEXT_VERSION, ", ".join("?" * len(LEASED_STATES))),
+            (
+                job.state, job.title, job.error, job.progress,
+                json.dumps({key: details[key] for key in DETAIL_FIELDS}, ensure_ascii=False), time.time(),
+                job_id, worker,
+            ) + LEASED_STATES,
+        ).rowcount > 0)
+
+    def release(self, worker, job_ids):
+        """工作进程正常退出时把未完成的任务放回队列，不计入租约过期次数"""
+        def release():
+            for job_id in job_ids:
+                self._db.execute(
+                    "UPDATE queue SET state = ?, worker = NULL, lease_expires = NULL, leases = MAX(leases - 1, 0),"
+                    " phase = NULL, speed = NULL, eta = NULL, updated_at = ?, version = %s WHERE id = ? AND worker = ?"
+                    " AND state IN (%s)" % (NEXT_VERSION, ", ".join("?" * len(LEASED_STATES))),
+                    (DownloadJob.PENDING, time.time(), job_id, worker) + LEASED_STATES,
+                )
+        self._transaction(release)
+
+
+class RemoteQueue:
+    """只提交和监视的下载队列：任务写入共享队列，由工作进程下载
+
+    提供与engine.DownloadEngine相同的任务接口（jobs、add、add_batch、cancel、pause、resume、set_priority、
+    set_weight、subscribe、wait），图形界面、命令行和本地接口可以直接使用；任务状态由后台线程定期从队列读取。
+    订阅保存在本地，同步时由提交端读取播放列表，新条目的链接提交到共享队列。
+    """
+
+    def __init__(self, store, poll_interval=POLL_INTERVAL):
+        self.store = store
+        self.poll_interval = poll_interval
+        self.jobs = {}
+        self._subscribers = []
+        # 已读取到的最大版本号，0表示还没有读取过
+        self._since = 0
+        self._lock = threading.RLock()
+        self._idle = threading.Condition(self._lock)
+        # 同一时间只有一个线程读取，保证版本号和任务状态按顺序更新
+        self._poll_lock = threading.Lock()
+        self._stopped = threading.Event()
+        # 运行指标按读取到的结束事件汇总，只包含本进程运行期间结束的任务
+        self.metrics = JobMetrics()
+        self._subscribers.append(self.metrics.on_event)
+        self.subscriptions = SubscriptionStore()
+        # 正在进行的订阅同步数，同步结束前wait不返回
+        self._syncing = 0
+        threading.Thread(target=self._poll_loop, daemon=True).start()
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def _notify(self, event, job):
+        for callback in list(self._subscribers):
+            callback(event, job)
+
+    def get_jobs(self):
+        with self._lock:
+            return list(self.jobs.values())
+
+    def active_count(self):
+        with self._lock:
+            return self._syncing + sum(
+                1 for job in self.jobs.values() if job.is_active() and job.state != DownloadJob.PAUSED
+            )
+
+    def wait(self, timeout=None):
+        """阻塞直到队列中所有任务都结束（包括其他提交端提交的任务），超时返回False"""
+        with self._idle:
+            return self._idle.wait_for(lambda: self.active_count() == 0, timeout)
+
+    def render_metrics(self):
+        return self.metrics.render(self.get_jobs())
+
+    def write_metrics(self, path):
+        self.metrics.write(path, self.get_jobs())
+
+    def add(self, url, download_type, info=None, profile=None, priority=0):
+        job_id = self.store.submit(url, download_type, profile, priority)
+        self.refresh()
+        return job_id
+
+    def add_batch(self, urls, download_type, profile=None, priority=0):
+        # 播放列表由领取任务的工作进程整体下载
+        for url in urls:
+            self.store.submit(url, download_type, profile, priority)
+        self.refresh()
+
+    def restore(self):
+        # 任务保存在共享队列中，第一次读取时就会全部加载
+        self.refresh()
+
+    def cancel(self, job_id):
+        return self._control(self.store.cancel(job_id))
+
+    def pause(self, job_id):
+        return self._control(self.store.pause(job_id))
+
+    def resume(self, job_id):
+        return self._control(self.store.resume(job_id))
+
+    def set_priority(self, job_id, priority):
+        return self._control(self.store.set_priority(job_id, priority))
+
+    def set_weight(self, job_id, weight):
+        return self._control(self.store.set_weight(job_id, weight))
+
+    def add_subscription(self, url, download_type, profile=None, priority=0):
+        return self.subscriptions.add(url, download_type, profile, priority)
+
+    def sync_subscriptions(self, subscription_ids=None, limit=None):
+        """在后台同步订阅（默认全部），新条目按发布顺序提交到共享队列"""
+        with self._lock:
+            self._syncing += 1
+        threading.Thread(target=self._run_sync, args=(subscription_ids, limit), daemon=True).start()
+
+    def _run_sync(self, subscription_ids, limit):
+        import yt_dlp
+
+        try:
+            for subscription in self.subscriptions.list():
+                if subscription_ids is not None and subscription.id not in subscription_ids:
+                    continue
+                try:
+                    with yt_dlp.YoutubeDL(extract_options(subscription.download_type)) as ydl:
+                        entries = find_new_entries(ydl, subscription, self.subscriptions, limit)
+                except yt_dlp.utils.DownloadError as e:
+                    print("同步订阅失败: %s: %s" % (subscription.url, e), file=sys.stderr)
+                    continue
+                if entries:
+                    self.subscriptions.mark_pending(subscription.id, [entry_id for entry_id, _ in entries])
+                    # 条目由领取任务的工作进程解析，提交到队列后即记为见过
+                    for entry_id, url in entries:
+                        self.store.submit(url, subscription.download_type, subscription.profile, subscription.priority)
+                        self.subscriptions.mark_seen(subscription.id, [entry_id])
+                    self.refresh()
+                # 更新同步时间
+                self.subscriptions.mark_seen(subscription.id, [])
+        finally:
+            with self._lock:
+                self._syncing -= 1
+                self._idle.notify_all()
+
+    def _control(self, changed):
+        self.refresh()
+        return changed
+
+    def refresh(self):
+        """立即读取一次状态，修改队列后调用，界面不必等到下次定期读取"""
+        with self._poll_lock:
+            try:
+                rows, since = self.store.changes(self._since)
+            except sqlite3.Error as e:
+                # 共享目录暂时不可用时下次再读
+                print("读取共享队列失败: %s" % e)
+                return
+            # 第一次读取到的已结束任务是历史记录，不发送结束事件
+            history = self._since == 0
+            for row in rows:
+                self._apply(row, history)
+            self._since = since
+
+    def stop(self):
+        self._stopped.set()
+
+    def shutdown(self):
+        # 与DownloadEngine.shutdown对应，共享队列模式下只需停止轮询
+        self.stop()
+
+    def _poll_loop(self):
+        while not self._stopped.is_set():
+            self.refresh()
+            self._stopped.wait(self.poll_interval)
+
+    def _apply(self, row, history):
+        with self._lock:
+            job = self.jobs.get(row["id"])
+            added = job is None
+            if added:
+                profile = FormatProfile.from_dict(json.loads(row["profile"])) if row["profile"] else None
+                job = DownloadJob(row["id"], row["url"], row["download_type"], None, title=row["title"],
+                                  profile=profile, priority=row["priority"])
+                self.jobs[job.id] = job
+            previous = None if added and history else job.state
+            job.state = row["state"]
+            job.priority = row["priority"]
+            job.weight = row["weight"]
+            job.title = row["title"] or job.title
+            job.error = row["error"]
+            job.progress = row["progress"]
+            job.phase = row["phase"]
+            job.speed = row["speed"]
+            job.eta = row["eta"]
+            details = json.loads(row["details"]) if row["details"] else {}
+            job.timings = details.get("timings") or {}
+            job.bytes = details.get("bytes") or {}
+            job.retries = details.get("retries") or {}
+            job.plan = details.get("plan")
+            job.format_id = details.get("format")
+            job.error_category = details.get("error_category")
+            job.path = details.get("path")
+            job.checksum = details.get("checksum")
+            if added:
+                self._notify("added", job)
+            self._notify("updated", job)
+            if job.state in FINAL_STATES and previous not in (None, job.state):
+                self._notify("finished", job)
+            self._idle.notify_all()
+
+    # 以下设置由各工作进程的命令行参数决定，提交端忽略
+    max_workers = per_host_limit = connections = 0
+
+    def set_max_workers(self, count):
+        pass
+
+    def set_per_host_limit(self, count):
+        pass
+
+    def set_connections(self, count):
+        pass
+
+    def set_rate_limit(self, rate):
+        pass
+
+    def set_audio_codec(self, codec):
+        pass
+
+    def set_container(self, container):
+        pass
+
+    def set_archive_mode(self, mode):
+        pass
+
+    def set_hash_content(self, enabled):
+        pass
+
+    def set_bandwidth_schedule(self, schedule):
+        pass
+
+    def set_metrics_log(self, path):
+        self.metrics.log_path = path
@@ -0,0 +1,112 @@
+import json
+import sqlite3
+import threading
+import time
+
+# 重启后需要恢复的任务状态（与engine.DownloadJob的状态一致）
+UNFINISHED_STATES = ("等待中", "下载中", "处理中", "已暂停")
+# 旧版本创建的日志缺少的列
+ADDED_COLUMNS = (
+    ("profile", "TEXT"), ("priority", "INTEGER NOT NULL DEFAULT 0"), ("path", "TEXT"), ("size", "INTEGER"),
+    ("checksum", "TEXT"),
+)
+# 输出文件可以校验的任务状态
+VERIFIABLE_STATES = ("已完成", "已存在")
+
+
+class JobJournal:
+    """持久化的任务日志（sqlite），程序关闭或崩溃后可以恢复未完成的任务"""
+
+    def __init__(self, path="jobs.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        # WAL模式下每次提交都是原子的，崩溃后不会留下半条记录
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL,
+                download_type TEXT NOT NULL,
+                outtmpl TEXT NOT NULL,
+                state TEXT NOT NULL,
+                title TEXT,
+                error TEXT,
+                profile TEXT,
+                priority INTEGER NOT NULL DEFAULT 0,
+                path TEXT,
+                size INTEGER,
+                checksum TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(jobs)")]
+        for name, definition in ADDED_COLUMNS:
+            if name not in columns:
+                self._db.execute("ALTER TABLE jobs ADD COLUMN %s %s" % (name, definition))
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)")
+        self._db.commit()
+
+    def add(self, url, download_type, outtmpl, state, title=None, error=None, profile=None, priority=0):
+        """记录新任务，返回任务id；profile为格式要求的字典"""
+        now = time.time()
+        profile = json.dumps(profile) if profile else None
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO jobs (url, download_type, outtmpl, state, title, error, profile, priority, created_at,"
+                " updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, download_type, outtmpl, state, title, error, profile, priority, now, now),
+            )
+            self._db.commit()
+        return cursor.lastrowid
+
+    def update(self, job_id, state, title=None, error=None):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET state = ?, title = COALESCE(?, title), error = ?, updated_at = ? WHERE id = ?",
+                (state, title, error, time.time(), job_id),
+            )
+            self._db.commit()
+
+    def set_priority(self, job_id, priority):
+        with self._lock:
+            self._db.execute("UPDATE jobs SET priority = ?, updated_at = ? WHERE id = ?", (priority, time.time(), job_id))
+            self._db.commit()
+
+    def set_output(self, job_id, path, size, checksum):
+        """记录任务的输出文件、大小和下载时计算的校验和（见hashing.CHECKSUM_ALGORITHM）"""
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET path = ?, size = ?, checksum = ?, updated_at = ? WHERE id = ?",
+                (path, size, checksum, time.time(), job_id),
+            )
+            self._db.commit()
+
+    def outputs(self):
+        """返回记录了输出文件的已完成任务：[(id, title, path, size, checksum)]，按创建顺序
+
+        跳过的任务使用的已有文件如果是扫描目录得到的，没有校验和（checksum为None），只能检查是否存在和大小。
+        """
+        with self._lock:
+            return self._db.execute(
+                "SELECT id, title, path, size, checksum FROM jobs WHERE path IS NOT NULL AND state IN (%s)"
+                " ORDER BY id" % ", ".join("?" * len(VERIFIABLE_STATES)),
+                VERIFIABLE_STATES,
+            ).fetchall()
+
+    def unfinished(self):
+        """返回未完成的任务：[(id, url, download_type, outtmpl, title, profile, state, priority)]，按创建顺序"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, url, download_type, outtmpl, title, profile, state, priority FROM jobs"
+                " WHERE state IN (%s) ORDER BY id" % ", ".join("?" * len(UNFINISHED_STATES)),
+                UNFINISHED_STATES,
+            ).fetchall()
+        return [row[:5] + (json.loads(row[5]) if row[5] else None,) + row[6:] for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
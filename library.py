@@ -0,0 +1,254 @@
+import os
+from datetime import datetime
+
+from PyQt5.QtCore import (
+    QAbstractTableModel,
+    QFileSystemWatcher,
+    QModelIndex,
+    QObject,
+    QSortFilterProxyModel,
+    Qt,
+    QThread,
+    QTimer,
+    pyqtSignal,
+    pyqtSlot,
+)
+
+from archive import MEDIA_EXTENSIONS, VIDEO_EXTENSIONS
+from catalog import MediaCatalog, MediaIndexer
+from progress import format_bytes
+
+# 目录变化后等待该毫秒数再扫描，合并下载过程中的连续变化
+SCAN_DELAY = 300
+
+
+def get_media_type(path):
+    return "视频" if path.lower().endswith(VIDEO_EXTENSIONS) else "音频"
+
+
+def format_duration(seconds):
+    if not seconds:
+        return ""
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return "%d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+    return "%d:%02d" % (seconds // 60, seconds % 60)
+
+
+class LibraryModel(QAbstractTableModel):
+    """媒体库表格模型，只按变化的文件增删或刷新行"""
+    HEADERS = ["文件名", "类型", "时长", "大小", "分辨率", "编码", "下载时间"]
+    # 取文件完整路径的数据角色
+    PathRole = Qt.UserRole
+    # 排序用的原始值（数字按大小排序，而不是按显示文本）
+    SortRole = Qt.UserRole + 1
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        # 每行为目录中的元数据字典，行的顺序无意义，排序由代理模型完成
+        self._rows = []
+        self._index = {}
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        record = self._rows[index.row()]
+        if role == Qt.DisplayRole:
+            return self.display_value(record, index.column())
+        if role == LibraryModel.SortRole:
+            return self.sort_value(record, index.column())
+        if role == LibraryModel.PathRole:
+            return record["path"]
+        return None
+
+    def display_value(self, record, column):
+        if column == 0:
+            return os.path.basename(record["path"])
+        if column == 1:
+            return get_media_type(record["path"])
+        if column == 2:
+            return format_duration(record.get("duration"))
+        if column == 3:
+            return format_bytes(record.get("size"))
+        if column == 4:
+            return "%sx%s" % (record["width"], record["height"]) if record.get("width") else ""
+        if column == 5:
+            return "/".join(codec for codec in (record.get("video_codec"), record.get("audio_codec")) if codec)
+        if record.get("downloaded_at"):
+            return datetime.fromtimestamp(record["downloaded_at"]).strftime("%Y-%m-%d %H:%M")
+        return ""
+
+    def sort_value(self, record, column):
+        if column == 2:
+            return record.get("duration") or 0
+        if column == 3:
+            return record.get("size") or 0
+        if column == 4:
+            return (record.get("width") or 0) * (record.get("height") or 0)
+        if column == 6:
+            return record.get("downloaded_at") or 0
+        return self.display_value(record, column)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    @pyqtSlot(object, object)
+    def apply_changes(self, added, removed):
+        """应用扫描得到的变化，added为元数据字典列表，removed为路径列表，代价只与变化的文件数有关"""
+        for path in removed:
+            self._remove(path)
+        new_records = []
+        for record in added:
+            if record["path"] in self._index:
+                self.update_record(record)
+            else:
+                new_records.append(record)
+        if not new_records:
+            return
+        first = len(self._rows)
+        self.beginInsertRows(QModelIndex(), first, first + len(new_records) - 1)
+        for record in new_records:
+            self._index[record["path"]] = len(self._rows)
+            self._rows.append(record)
+        self.endInsertRows()
+
+    @pyqtSlot(object)
+    def update_record(self, record):
+        """元数据探测完成后刷新对应的一行"""
+        row = self._index.get(record["path"])
+        if row is None:
+            return
+        self._rows[row] = record
+        self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.HEADERS) - 1))
+
+    def _remove(self, path):
+        row = self._index.pop(path, None)
+        if row is None:
+            return
+        # 用最后一行填补被删除的行，避免删除中间行时移动后面所有行
+        last = len(self._rows) - 1
+        if row != last:
+            self._rows[row] = self._rows[last]
+            self._index[self._rows[row]["path"]] = row
+            self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.HEADERS) - 1))
+        self.beginRemoveRows(QModelIndex(), last, last)
+        self._rows.pop()
+        self.endRemoveRows()
+
+
+class LibraryScanner(QObject):
+    """在后台线程中扫描目录，记住每个文件上次的大小和修改时间，只发出变化的文件
+
+    新增或修改的文件交给索引器探测元数据，删除的文件从目录中移除。
+    """
+    # 参数为新增文件的元数据字典列表和删除的文件路径列表
+    changed = pyqtSignal(object, object)
+
+    def __init__(self, folders, catalog, indexer, known):
+        super().__init__()
+        self.catalog = catalog
+        self.indexer = indexer
+        # {目录: {路径: (大小, 修改时间)}}，用目录中已有的记录初始化，启动时不会重新探测未变化的文件
+        self._known = {folder: {} for folder in folders}
+        for record in known.values():
+            folder = os.path.dirname(record["path"])
+            if folder in self._known:
+                self._known[folder][record["path"]] = (record["size"], record["mtime"])
+
+    @pyqtSlot(str)
+    def scan(self, folder):
+        current = {}
+        if os.path.isdir(folder):
+            for entry in os.scandir(folder):
+                if entry.is_file() and entry.name.lower().endswith(MEDIA_EXTENSIONS):
+                    stat = entry.stat()
+                    current[os.path.normpath(entry.path)] = (stat.st_size, stat.st_mtime)
+        known = self._known.get(folder, {})
+        added = [path for path in current if path not in known]
+        removed = [path for path in known if path not in current]
+        modified = [path for path in current if path in known and known[path] != current[path]]
+        self._known[folder] = current
+        for path in added + modified:
+            self.indexer.submit(path, *current[path])
+        if removed:
+            self.catalog.remove(removed)
+        if added or removed:
+            records = [{"path": path, "size": current[path][0], "mtime": current[path][1]} for path in added]
+            self.changed.emit(records, removed)
+
+
+class MediaLibrary(QObject):
+    """媒体库：启动时直接从元数据目录加载，再监听视频/音频目录的变化，在后台扫描并增量更新模型"""
+    scan_requested = pyqtSignal(str)
+    # 索引器在线程池中完成探测后，通过该信号回到界面线程
+    indexed = pyqtSignal(object)
+
+    def __init__(self, folders, parent=None):
+        super().__init__(parent)
+        self.folders = [os.path.normpath(folder) for folder in folders]
+        self.catalog = MediaCatalog()
+        self.indexer = MediaIndexer(self.catalog, self.indexed.emit)
+        self.model = LibraryModel(self)
+        self.indexed.connect(self.model.update_record)
+        # 排序和筛选在代理模型中完成
+        self.proxy = QSortFilterProxyModel(self)
+        self.proxy.setSourceModel(self.model)
+        self.proxy.setSortRole(LibraryModel.SortRole)
+        self.proxy.setFilterCaseSensitivity(Qt.CaseInsensitive)
+        self.proxy.setFilterKeyColumn(0)
+        self.proxy.setDynamicSortFilter(True)
+
+        self._thread = QThread(self)
+        self._scanner = None
+
+        self._timers = {}
+        for folder in self.folders:
+            timer = QTimer(self)
+            timer.setSingleShot(True)
+            timer.setInterval(SCAN_DELAY)
+            timer.timeout.connect(lambda folder=folder: self.scan_requested.emit(folder))
+            self._timers[folder] = timer
+        self._watcher = QFileSystemWatcher(self)
+        self._watcher.directoryChanged.connect(self._on_directory_changed)
+
+    def start(self):
+        """显示目录中已有的记录，开始监听目录并在后台核对变化"""
+        known = self.catalog.all()
+        self._scanner = LibraryScanner(self.folders, self.catalog, self.indexer, known)
+        self._scanner.moveToThread(self._thread)
+        self.scan_requested.connect(self._scanner.scan)
+        self._scanner.changed.connect(self.model.apply_changes)
+        self.model.apply_changes(list(known.values()), [])
+        for folder in self.folders:
+            os.makedirs(folder, exist_ok=True)
+        self._watcher.addPaths(self.folders)
+        self._thread.start()
+        for folder in self.folders:
+            self.scan_requested.emit(folder)
+
+    def stop(self):
+        self.indexer.shutdown()
+        self._thread.quit()
+        self._thread.wait()
+
+    def set_filter(self, text):
+        self.proxy.setFilterFixedString(text)
+
+    def path(self, proxy_index):
+        """返回代理模型中某行对应的文件路径"""
+        if not proxy_index.isValid():
+            return None
+        return self.proxy.data(proxy_index.siblingAtColumn(0), LibraryModel.PathRole)
+
+    def _on_directory_changed(self, folder):
+        timer = self._timers.get(os.path.normpath(folder))
+        if timer is not None:
+            timer.start()
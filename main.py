@@ -1,3 +1,4 @@
+import argparse
 import sys
 
 from PyQt5.QtWidgets import QApplication
@@ -5,7 +6,12 @@ from PyQt5.QtWidgets import QApplication
 from ui import MainWindow
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    window = MainWindow()
+    parser = argparse.ArgumentParser(description="视频下载器")
+    parser.add_argument("--store", metavar="PATH",
+                        help="共享任务队列文件，只提交和监视任务，由工作进程（python -m cli --worker）下载")
+    # 其余参数留给Qt
+    args, qt_args = parser.parse_known_args()
+    app = QApplication(sys.argv[:1] + qt_args)
+    window = MainWindow(args.store)
     window.show()
     sys.exit(app.exec_())
\ No newline at end of file
@@ -0,0 +1,152 @@
+"""运行指标：按阶段统计每个任务的耗时、字节数和重试次数，汇总为计数器和直方图
+
+导出方式：
+    Prometheus文本格式  本地接口的 GET /metrics，或定期写入文件（供node_exporter的textfile收集器读取）
+    JSON日志            每个任务结束时追加一行，包含任务的全部状态和各阶段统计
+"""
+import json
+import os
+import threading
+import time
+
+# 阶段耗时（秒）和下载速度（字节/秒）直方图的桶上限
+DURATION_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+THROUGHPUT_BUCKETS = tuple(64 * 1024 * 4 ** i for i in range(8))
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        '%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{%s}" % ",".join(escaped)
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # 每个桶的计数（不累计），最后一个为+Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """线程安全的计数器和直方图，按(指标名, 标签)区分"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, kind, help_text, buckets=None):
+        """登记指标，kind为"counter"、"gauge"或"histogram" """
+        self._metrics[name] = (kind, help_text, buckets)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._values.get(key)
+            if histogram is None:
+                histogram = self._values[key] = Histogram(self._metrics[name][2])
+            histogram.observe(value)
+
+    def render(self, gauges=None):
+        """生成Prometheus文本格式，gauges为{指标名: {标签元组: 值}}，在导出时计算"""
+        lines = []
+        with self._lock:
+            values = dict(self._values)
+            for name, (kind, help_text, _) in self._metrics.items():
+                lines.append("# HELP %s %s" % (name, help_text))
+                lines.append("# TYPE %s %s" % (name, kind))
+                if kind == "gauge":
+                    for labels, value in sorted((gauges or {}).get(name, {}).items()):
+                        lines.append("%s%s %s" % (name, format_labels(labels), format_value(value)))
+                    continue
+                for (metric, labels), value in sorted(values.items(), key=lambda item: item[0]):
+                    if metric != name:
+                        continue
+                    if kind == "counter":
+                        lines.append("%s%s %s" % (name, format_labels(labels), format_value(value)))
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(value.buckets + ("+Inf",), value.counts):
+                        cumulative += count
+                        bucket_labels = labels + (("le", bound if bound == "+Inf" else format_value(bound)),)
+                        lines.append("%s_bucket%s %d" % (name, format_labels(bucket_labels), cumulative))
+                    lines.append("%s_sum%s %s" % (name, format_labels(labels), format_value(value.sum)))
+                    lines.append("%s_count%s %d" % (name, format_labels(labels), value.count))
+        return "\n".join(lines) + "\n"
+
+
+class JobMetrics:
+    """订阅下载引擎的事件，任务结束时更新指标并写一行JSON日志"""
+
+    def __init__(self, log_path=None):
+        self.log_path = log_path
+        self._log_lock = threading.Lock()
+        self.registry = MetricsRegistry()
+        self.registry.describe("ytdl_jobs", "gauge", "当前各状态的任务数")
+        self.registry.describe("ytdl_jobs_total", "counter", "结束的任务数")
+        self.registry.describe("ytdl_phase_duration_seconds", "histogram", "各阶段耗时", DURATION_BUCKETS)
+        self.registry.describe("ytdl_phase_bytes_total", "counter", "各阶段下载或写出的字节数")
+        self.registry.describe("ytdl_retries_total", "counter", "各阶段的重试次数")
+        self.registry.describe("ytdl_failures_total", "counter", "按类别统计的失败任务数")
+        self.registry.describe(
+            "ytdl_download_speed_bytes_per_second", "histogram", "每个任务下载阶段的平均速度", THROUGHPUT_BUCKETS
+        )
+
+    def on_event(self, event, job):
+        if event != "finished":
+            return
+        self.registry.inc("ytdl_jobs_total", type=job.download_type, state=job.state)
+        if job.error_category:
+            self.registry.inc("ytdl_failures_total", category=job.error_category)
+        for phase, seconds in job.timings.items():
+            self.registry.observe("ytdl_phase_duration_seconds", seconds, phase=phase)
+        for phase, count in job.bytes.items():
+            self.registry.inc("ytdl_phase_bytes_total", count, phase=phase)
+        for phase, count in job.retries.items():
+            self.registry.inc("ytdl_retries_total", count, phase=phase)
+        seconds = job.timings.get("下载")
+        if seconds and job.bytes.get("下载"):
+            self.registry.observe("ytdl_download_speed_bytes_per_second", job.bytes["下载"] / seconds)
+        if self.log_path:
+            self.log(job)
+
+    def log(self, job):
+        record = dict(job.to_dict(), time=time.strftime("%Y-%m-%dT%H:%M:%S%z"), event="finished")
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._log_lock:
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def render(self, jobs):
+        states = {}
+        for job in jobs:
+            key = (("state", job.state),)
+            states[key] = states.get(key, 0) + 1
+        return self.registry.render({"ytdl_jobs": states})
+
+    def write(self, path, jobs):
+        """写入Prometheus文本文件，先写临时文件再替换，读取方不会看到写了一半的文件"""
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(self.render(jobs))
+        os.replace(path + ".tmp", path)
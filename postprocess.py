@@ -0,0 +1,68 @@
+"""后处理阶段：合并音视频、提取音频或转码（具体方案由remux模块决定）
+
+下载线程只负责下载，后处理任务交给独立的工作池执行，下载名额在下载完成后立即释放给后面的任务。
+"""
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+FFMPEG = "ffmpeg"
+
+
+class PostProcessError(Exception):
+    pass
+
+
+class PostProcessTask:
+    """用ffmpeg把inputs处理为output，成功后删除inputs"""
+
+    def __init__(self, name, phase, inputs, output, args):
+        # 用于耗时统计的阶段名称，如"合并"、"提取音频"
+        self.name = name
+        self.phase = phase
+        self.inputs = inputs
+        self.output = output
+        self.args = args
+
+    def command(self, output):
+        command = [FFMPEG, "-y", "-nostdin", "-loglevel", "error"]
+        for path in self.inputs:
+            command += ["-i", path]
+        return command + self.args + [output]
+
+    def run(self):
+        """执行后处理，返回输出文件路径"""
+        base, ext = os.path.splitext(self.output)
+        # ffmpeg按扩展名选择封装格式，临时文件保留原扩展名
+        temp = base + ".temp" + ext
+        try:
+            subprocess.run(self.command(temp), capture_output=True, check=True)
+        except FileNotFoundError:
+            raise PostProcessError("未找到ffmpeg")
+        except subprocess.CalledProcessError as e:
+            if os.path.exists(temp):
+                os.remove(temp)
+            message = e.stderr.decode("utf-8", "replace").strip().splitlines()
+            raise PostProcessError("%s失败: %s" % (self.name, message[-1] if message else e.returncode))
+        os.replace(temp, self.output)
+        for path in self.inputs:
+            if path != self.output and os.path.exists(path):
+                os.remove(path)
+        return self.output
+
+
+class PostProcessPool:
+    """后处理工作池，大小为CPU核心数
+
+    转码由ffmpeg子进程完成，已经在独立进程中运行并可以使用多个核心，工作线程只负责启动和等待，
+    因此用线程池限制同时运行的ffmpeg数量即可，不需要再经过进程池传递数据。
+    """
+
+    def __init__(self, max_workers=None):
+        self._pool = ThreadPoolExecutor(max_workers or os.cpu_count() or 1, thread_name_prefix="postprocess")
+
+    def submit(self, fn, *args):
+        return self._pool.submit(fn, *args)
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,168 @@
+import threading
+import time
+
+# 下载阶段
+PHASE_DOWNLOADING = "下载中"
+PHASE_MERGING = "合并中"
+PHASE_POSTPROCESSING = "后处理中"
+PHASE_WAITING = "等待重试"
+PHASE_DISK = "等待磁盘空间"
+PHASE_FINISHED = "已完成"
+
+
+def format_bytes(count):
+    """把字节数格式化为便于阅读的字符串"""
+    if count is None:
+        return ""
+    for unit in ("B", "KB", "MB", "GB"):
+        if count < 1024:
+            return "%.1f%s" % (count, unit)
+        count /= 1024.0
+    return "%.1fTB" % count
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return ""
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return "%d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+    return "%02d:%02d" % (seconds // 60, seconds % 60)
+
+
+def format_timings(timings):
+    """把各阶段耗时格式化为"解析 0.8s / 下载 12.3s / 合并 1.1s"的形式"""
+    return " / ".join("%s %.1fs" % (stage, seconds) for stage, seconds in timings.items())
+
+
+class ProgressSnapshot:
+    """某一时刻的任务进度"""
+
+    def __init__(self, phase, downloaded_bytes, total_bytes, speed, eta):
+        self.phase = phase
+        self.downloaded_bytes = downloaded_bytes
+        self.total_bytes = total_bytes
+        # 字节/秒，未知时为None
+        self.speed = speed
+        # 剩余秒数，未知时为None
+        self.eta = eta
+
+    @property
+    def percent(self):
+        if self.phase == PHASE_FINISHED:
+            return 100.0
+        if not self.total_bytes:
+            return 0.0
+        return min(100.0, 100.0 * self.downloaded_bytes / self.total_bytes)
+
+
+class ProgressTracker:
+    """把yt_dlp的进度回调转换为进度快照
+
+    直接读取downloaded_bytes/total_bytes等数值字段，自己计算平滑后的速度和剩余时间，
+    并把更新合并到每min_interval秒最多一次；阶段变化（合并、后处理）总是立即上报。
+    """
+
+    def __init__(self, min_interval=0.25, smoothing=0.3):
+        self.min_interval = min_interval
+        # 速度指数平滑系数，越大越接近瞬时速度
+        self.smoothing = smoothing
+        self.phase = PHASE_DOWNLOADING
+        self.speed = None
+        # 需要合并的任务会依次下载多个文件，已完成文件的字节数累计在这里
+        self._finished_bytes = 0
+        self._finished_files = set()
+        self._downloaded = 0
+        self._total = None
+        self._sample_time = None
+        self._sample_bytes = 0
+        self._emitted_at = 0
+        self._lock = threading.Lock()
+
+    def update(self, d):
+        """处理yt_dlp的progress_hooks回调，需要上报时返回快照，否则返回None"""
+        with self._lock:
+            now = time.monotonic()
+            downloaded = d.get("downloaded_bytes") or 0
+            total = d.get("total_bytes") or d.get("total_bytes_estimate")
+            if d["status"] == "finished":
+                filename = d.get("filename")
+                if filename not in self._finished_files:
+                    self._finished_files.add(filename)
+                    self._finished_bytes += total or downloaded
+                self._downloaded = 0
+                self._total = None
+                self._sample_time = None
+                return self._snapshot(now)
+            if d["status"] != "downloading":
+                return None
+            if self.phase in (PHASE_WAITING, PHASE_DISK):
+                # 重试或等到磁盘空间后恢复下载，立即上报阶段变化
+                self.phase = PHASE_DOWNLOADING
+                self._emitted_at = 0
+            self._downloaded = downloaded
+            self._total = total
+            self._sample(now, self._finished_bytes + downloaded)
+            if now - self._emitted_at < self.min_interval:
+                return None
+            return self._snapshot(now)
+
+    def update_phase(self, d):
+        """处理yt_dlp的postprocessor_hooks回调，进入合并或后处理阶段时返回快照"""
+        if d["status"] != "started":
+            return None
+        with self._lock:
+            self.phase = PHASE_MERGING if d.get("postprocessor") == "Merger" else PHASE_POSTPROCESSING
+            self.speed = None
+            return self._snapshot(time.monotonic())
+
+    def waiting(self, seconds, phase=PHASE_WAITING):
+        """失败后等待重试（剩余时间显示为等待的秒数），或等待磁盘空间（seconds为None）"""
+        with self._lock:
+            self.phase = phase
+            self.speed = None
+            snapshot = self._snapshot(time.monotonic())
+            snapshot.eta = seconds
+            return snapshot
+
+    @property
+    def downloaded_bytes(self):
+        """到目前为止下载的总字节数"""
+        with self._lock:
+            return self._finished_bytes + self._downloaded
+
+    def finish(self):
+        with self._lock:
+            self.phase = PHASE_FINISHED
+            self.speed = None
+            return self._snapshot(time.monotonic())
+
+    def _sample(self, now, current_bytes):
+        if self._sample_time is None:
+            self._sample_time = now
+            self._sample_bytes = current_bytes
+            return
+        elapsed = now - self._sample_time
+        # 采样间隔太短时误差很大，累积到一定时间再计算
+        if elapsed < 0.1:
+            return
+        instant = (current_bytes - self._sample_bytes) / elapsed
+        if self.speed is None:
+            self.speed = instant
+        else:
+            self.speed = self.smoothing * instant + (1 - self.smoothing) * self.speed
+        self._sample_time = now
+        self._sample_bytes = current_bytes
+
+    def _snapshot(self, now):
+        self._emitted_at = now
+        downloaded = self._finished_bytes + self._downloaded
+        if self._total:
+            total = self._finished_bytes + self._total
+        else:
+            # 两个文件之间（或当前文件大小未知）时以已完成的部分为准
+            total = self._finished_bytes if not self._downloaded else None
+        eta = None
+        if total and self.speed:
+            eta = max(0.0, (total - downloaded) / self.speed)
+        return ProgressSnapshot(self.phase, downloaded, total, self.speed, eta)
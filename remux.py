@@ -0,0 +1,174 @@
+"""输出方案：根据选中格式的编码和用户的目标封装/编码，选择代价最小的处理方式
+
+    直接使用  下载的文件已经符合要求
+    流复制    只改变封装（合并音视频、换容器），不重新编码
+    转码      编码不符合要求的流才重新编码，其余流仍然复制
+"""
+import os
+
+from postprocess import PostProcessTask
+from progress import PHASE_MERGING, PHASE_POSTPROCESSING
+
+PLAN_DIRECT = "直接使用"
+PLAN_COPY = "流复制"
+PLAN_TRANSCODE = "转码"
+
+# 编码名称归一化，yt_dlp的vcodec/acodec形如"avc1.64001F"、"mp4a.40.2"
+CODEC_FAMILIES = {
+    "avc1": "h264", "avc3": "h264", "h264": "h264",
+    "hev1": "h265", "hvc1": "h265", "h265": "h265", "hevc": "h265",
+    "vp09": "vp9", "vp9": "vp9", "vp8": "vp8",
+    "av01": "av1", "av1": "av1",
+    "mp4a": "aac", "aac": "aac", "opus": "opus", "vorbis": "vorbis",
+    "mp3": "mp3", "flac": "flac", "ac-3": "ac3", "ec-3": "eac3",
+}
+
+# 各封装格式可以直接容纳的编码，None表示不限
+CONTAINER_CODECS = {
+    "mp4": ({"h264", "h265", "av1", "vp9"}, {"aac", "mp3", "opus", "ac3", "eac3", "flac"}),
+    "webm": ({"vp8", "vp9", "av1"}, {"opus", "vorbis"}),
+    "mkv": (None, None),
+}
+# 封装格式不支持时使用的视频/音频编码器
+CONTAINER_ENCODERS = {
+    "mp4": (["-c:v", "libx264"], ["-c:a", "aac"]),
+    "webm": (["-c:v", "libvpx-vp9"], ["-c:a", "libopus"]),
+}
+
+# 音频编码对应的文件扩展名和编码器
+AUDIO_FORMATS = {
+    "mp3": ("mp3", ["-c:a", "libmp3lame"]),
+    "aac": ("m4a", ["-c:a", "aac"]),
+    "opus": ("opus", ["-c:a", "libopus"]),
+    "vorbis": ("ogg", ["-c:a", "libvorbis"]),
+    "flac": ("flac", ["-c:a", "flac"]),
+}
+
+# 预合并格式的总码率至少为视频+音频总码率的这个比例才算质量相当
+PREMUXED_MIN_TBR_RATIO = 0.85
+
+
+def codec_family(codec):
+    if not codec or codec == "none":
+        return None
+    codec = codec.lower()
+    return CODEC_FAMILIES.get(codec.split(".")[0], codec)
+
+
+class OutputPolicy:
+    """用户的输出要求
+
+    audio_codec为"auto"时保留AAC/Opus/MP3等常见编码，只有其他编码才转为mp3；
+    container为"auto"时使用yt_dlp按格式选择的扩展名。
+    """
+
+    def __init__(self, audio_codec="auto", audio_bitrate="192k", container="auto"):
+        self.audio_codec = audio_codec
+        self.audio_bitrate = audio_bitrate
+        self.container = container
+
+
+def find_premuxed(selected):
+    """在全部格式中找与选中的视频质量相当、同时包含音频的预合并格式，没有则返回None
+
+    分辨率和帧率不低于选中的视频，总码率都已知时不低于视频+音频的PREMUXED_MIN_TBR_RATIO，
+    同样分辨率下码率低得多的预合并格式不会替换质量更好的组合；优先与选中视频编码相同的格式。
+    """
+    requested = selected.get("requested_formats") or []
+    video = next((fmt for fmt in requested if fmt.get("vcodec") != "none"), None)
+    if video is None or not any(fmt.get("acodec") != "none" for fmt in requested):
+        return None
+    rates = [fmt.get("tbr") for fmt in requested]
+    pair_tbr = sum(rates) if all(rates) else None
+    candidates = [
+        fmt for fmt in selected.get("formats") or []
+        if codec_family(fmt.get("vcodec")) and codec_family(fmt.get("acodec"))
+        and (fmt.get("height") or 0) >= (video.get("height") or 0) > 0
+        and (fmt.get("fps") or 30) >= (video.get("fps") or 30) - 1
+        and not (pair_tbr and fmt.get("tbr") and fmt["tbr"] < pair_tbr * PREMUXED_MIN_TBR_RATIO)
+    ]
+    if not candidates:
+        return None
+    family = codec_family(video.get("vcodec"))
+    return max(candidates, key=lambda fmt: (
+        codec_family(fmt.get("vcodec")) == family,
+        fmt.get("height") or 0, fmt.get("fps") or 0, fmt.get("tbr") or 0,
+    ))
+
+
+def use_premuxed(selected, fmt):
+    """用预合并格式替换选中的组合格式"""
+    result = dict(selected)
+    result.pop("requested_formats", None)
+    result.update(fmt)
+    return result
+
+
+def plan_audio(fmt, path, policy):
+    """音频模式：返回(后处理任务或None, 方案说明)"""
+    source = codec_family(fmt.get("acodec"))
+    if policy.audio_codec == "auto":
+        target = source if source in AUDIO_FORMATS else "mp3"
+    else:
+        target = policy.audio_codec
+    ext, encoder = AUDIO_FORMATS[target]
+    output = os.path.splitext(path)[0] + "." + ext
+    has_video = codec_family(fmt.get("vcodec")) is not None
+    if target == source:
+        if path.lower().endswith("." + ext) and not has_video:
+            return None, "%s (%s)" % (PLAN_DIRECT, target)
+        args = ["-vn", "-c:a", "copy"]
+        if target == "aac" and str(fmt.get("protocol", "")).startswith("m3u8"):
+            args += ["-bsf:a", "aac_adtstoasc"]
+        task = PostProcessTask("提取音频", PHASE_POSTPROCESSING, [path], output, args)
+        return task, "%s %s → %s" % (PLAN_COPY, target, ext)
+    args = ["-vn"] + encoder
+    if target not in ("flac",):
+        args += ["-b:a", policy.audio_bitrate]
+    task = PostProcessTask("转码", PHASE_POSTPROCESSING, [path], output, args)
+    return task, "%s %s → %s" % (PLAN_TRANSCODE, source or "未知", target)
+
+
+def plan_video(selected, downloads, path, policy):
+    """视频模式：downloads为[(格式, 路径)]，返回(后处理任务或None, 方案说明)"""
+    container = selected.get("ext") if policy.container == "auto" else policy.container
+    output = os.path.splitext(path)[0] + "." + container
+    hls_in_mp4 = container == "mp4" and any(str(fmt.get("protocol", "")).startswith("m3u8") for fmt, _ in downloads)
+    # HLS下载的mp4实际是TS封装，需要重新封装（与yt_dlp的FixupM3u8相同）
+    if len(downloads) == 1 and downloads[0][1] == output and not hls_in_mp4:
+        return None, "%s (%s)" % (PLAN_DIRECT, container)
+    video_codecs, audio_codecs = CONTAINER_CODECS.get(container, (None, None))
+    video_encoder, audio_encoder = CONTAINER_ENCODERS.get(container, (["-c:v", "libx264"], ["-c:a", "aac"]))
+    # 视频取第一个含视频的文件，音频取最后一个含音频的文件（bestvideo+bestaudio中的音频）
+    video = next((index for index, (fmt, _) in enumerate(downloads) if codec_family(fmt.get("vcodec"))), None)
+    audio = next(
+        (index for index in reversed(range(len(downloads))) if codec_family(downloads[index][0].get("acodec"))), None
+    )
+    args = []
+    transcoded = []
+    if video is not None:
+        fmt = downloads[video][0]
+        vcodec = codec_family(fmt.get("vcodec"))
+        args += ["-map", "%d:v:0" % video]
+        if video_codecs is None or vcodec in video_codecs:
+            args += ["-c:v", "copy"]
+        else:
+            args += video_encoder
+            transcoded.append(vcodec)
+    if audio is not None:
+        fmt = downloads[audio][0]
+        acodec = codec_family(fmt.get("acodec"))
+        args += ["-map", "%d:a:0" % audio]
+        if audio_codecs is None or acodec in audio_codecs:
+            args += ["-c:a", "copy"]
+            if acodec == "aac" and hls_in_mp4:
+                args += ["-bsf:a", "aac_adtstoasc"]
+        else:
+            args += audio_encoder
+            transcoded.append(acodec)
+    inputs = [download for _, download in downloads]
+    name = "合并" if len(downloads) > 1 else "封装转换"
+    if transcoded:
+        task = PostProcessTask("转码", PHASE_POSTPROCESSING, inputs, output, args)
+        return task, "%s %s → %s" % (PLAN_TRANSCODE, "+".join(transcoded), container)
+    return PostProcessTask(name, PHASE_MERGING, inputs, output, args), "%s %s → %s" % (PLAN_COPY, name, container)
@@ -0,0 +1,117 @@
+"""失败分类和重试间隔
+
+把下载失败分为几类，决定是否重试以及等待多久：
+    transient    网络中断、超时、5xx等临时错误，退避后重试
+    throttled    429或服务器要求降速，用更长的退避间隔重试
+    unavailable  格式不可用（链接失效、403/404/410等），换下一个最好的格式
+    auth         需要登录、会员或cookies，重试没有意义
+    fatal        其他错误，以及磁盘已满、没有权限、只读文件系统等本地文件错误
+退避间隔为带随机抖动的指数退避（full jitter），同时失败的任务不会在同一时刻一起重试。
+"""
+import errno
+import random
+import re
+
+TRANSIENT = "transient"
+THROTTLED = "throttled"
+UNAVAILABLE = "unavailable"
+AUTH = "auth"
+FATAL = "fatal"
+
+# yt_dlp内部的重试次数（单个请求和单个分片）
+HTTP_RETRIES = 10
+FRAGMENT_RETRIES = 10
+# 整个任务的最多尝试次数，已下载的分片和分段在重试之间保留
+JOB_ATTEMPTS = 4
+# 指数退避的初始间隔和上限（秒）
+BASE_DELAY = 1.0
+MAX_DELAY = 30.0
+# 被限速时的初始间隔和上限（秒）
+THROTTLED_BASE_DELAY = 10.0
+THROTTLED_MAX_DELAY = 300.0
+
+# 本地文件系统的错误：磁盘已满、超出配额、没有权限、只读，重试也不会成功
+FATAL_ERRNOS = (errno.ENOSPC, errno.EDQUOT, errno.EACCES, errno.EPERM, errno.EROFS)
+ERRNO_PATTERN = re.compile(r"\[Errno (\d+)\]")
+
+# 按顺序匹配，先匹配到的类别优先
+PATTERNS = (
+    (AUTH, re.compile(
+        r"HTTP Error 401|sign in|\blog ?in\b|cookies|private video|members[- ]only|"
+        r"premium|confirm your age|age[- ]restricted",
+        re.I,
+    )),
+    (THROTTLED, re.compile(r"HTTP Error 429|Too Many Requests|rate[- ]limit|throttl", re.I)),
+    (UNAVAILABLE, re.compile(
+        r"Requested format is not available|format is not available|No video formats|HTTP Error (403|404|410)",
+        re.I,
+    )),
+    (TRANSIENT, re.compile(
+        r"HTTP Error 5\d\d|timed? ?out|Connection|reset by peer|Broken pipe|IncompleteRead|"
+        r"Remote end closed|temporar|Network is unreachable|Name or service not known|"
+        r"getaddrinfo|EOF occurred|SSL|did not get any data|downloaded file is empty|下载不完整",
+        re.I,
+    )),
+)
+
+
+def original_error(error):
+    """yt_dlp的DownloadError等包装的原始异常，没有包装时返回error本身"""
+    exc_info = getattr(error, "exc_info", None)
+    if exc_info and isinstance(exc_info[1], BaseException):
+        return exc_info[1]
+    if isinstance(error, BaseException) and error.__cause__ is not None:
+        return error.__cause__
+    return error
+
+
+def error_number(error):
+    """错误的errno：先看原始异常，再从错误信息中的[Errno N]取得，没有时返回None"""
+    original = original_error(error)
+    if isinstance(original, OSError) and original.errno is not None:
+        return original.errno
+    match = ERRNO_PATTERN.search(str(error))
+    return int(match.group(1)) if match else None
+
+
+def classify(error):
+    """判断失败的类别，error为异常或错误信息"""
+    if error_number(error) in FATAL_ERRNOS:
+        return FATAL
+    original = original_error(error)
+    if isinstance(original, (ConnectionError, TimeoutError)):
+        return TRANSIENT
+    message = str(error)
+    for category, pattern in PATTERNS:
+        if pattern.search(message):
+            return category
+    if isinstance(original, OSError):
+        return TRANSIENT
+    return FATAL
+
+
+def is_retryable(category):
+    return category in (TRANSIENT, THROTTLED)
+
+
+def backoff(attempt, base=BASE_DELAY, cap=MAX_DELAY):
+    """第attempt次重试（从0开始）前等待的秒数，在[0, min(cap, base * 2^attempt)]中均匀随机"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def job_delay(category, attempt):
+    """整个任务重试前等待的秒数"""
+    if category == THROTTLED:
+        return backoff(attempt, THROTTLED_BASE_DELAY, THROTTLED_MAX_DELAY)
+    # 任务级重试之前yt_dlp已经重试过多次，从稍长的间隔开始
+    return backoff(attempt + 2)
+
+
+def sleep_http(n):
+    """yt_dlp的retry_sleep_functions，n为已重试的次数"""
+    return backoff(n)
+
+
+def sleep_fragment(n):
+    # 分片很小，失败多为瞬时错误，间隔从更短开始
+    return backoff(n, BASE_DELAY / 4, MAX_DELAY / 2)
@@ -0,0 +1,226 @@
+import http.client
+import json
+import os
+import threading
+import time
+import urllib.request
+
+from retry import HTTP_RETRIES, classify, is_retryable, sleep_http
+
+# 每次从连接读取并写盘的块大小，整个文件不会缓存在内存中
+CHUNK_SIZE = 256 * 1024
+# 分段进度文件的最短保存间隔（秒）
+STATE_SAVE_INTERVAL = 1.0
+
+
+class SegmentedDownloadError(Exception):
+    def __init__(self, message, resumable=False):
+        super().__init__(message)
+        # 为True时已下载的分段保存在磁盘上，重新下载会从断点继续
+        self.resumable = resumable
+
+
+def probe(url, headers=None, timeout=20):
+    """用Range: bytes=0-0探测文件大小和是否支持分段，返回(总大小, 是否支持Range)"""
+    request = urllib.request.Request(url, headers=dict(headers or {}, Range="bytes=0-0"))
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        if response.status == 206:
+            content_range = response.headers.get("Content-Range", "")
+            total = content_range.rpartition("/")[2]
+            return (int(total) if total.isdigit() else None), True
+        length = response.headers.get("Content-Length")
+        return (int(length) if length and length.isdigit() else None), False
+
+
+def split_ranges(total, segments):
+    """把[0, total)平均切成segments段，返回[(start, end)]，end包含在内"""
+    size = -(-total // segments)
+    return [(start, min(start + size, total) - 1) for start in range(0, total, size)]
+
+
+class SegmentedDownloader:
+    """多连接分段下载：每个连接下载一个字节区间，直接写入预分配文件的对应位置
+
+    各分段的进度保存在 <文件名>.segpart.json 中，中断后再次下载会从每个分段的断点继续。
+    """
+
+    def __init__(self, url, filename, headers=None, segments=8, min_segment_size=1024 * 1024,
+                 progress_hook=None, timeout=20, retries=HTTP_RETRIES, on_retry=None):
+        self.url = url
+        self.filename = filename
+        # 与yt_dlp的.part文件区分，避免yt_dlp把带空洞的预分配文件当作可续传文件
+        self.tmpfilename = filename + ".segpart"
+        self.statefilename = self.tmpfilename + ".json"
+        self.headers = dict(headers or {})
+        self.segments = max(1, segments)
+        self.min_segment_size = min_segment_size
+        self.progress_hook = progress_hook
+        self.timeout = timeout
+        # 单个分段失败后的重试次数，已下载的部分保留，从断点继续
+        self.retries = retries
+        self.on_retry = on_retry
+        self.total_bytes = None
+        self.downloaded_bytes = 0
+        # 每个分段为[起始偏移, 结束偏移(包含), 已下载字节数]，结束偏移为None表示不分段
+        self._ranges = []
+        self._lock = threading.Lock()
+        self._error = None
+        self._saved_at = 0
+        self._cancelled = threading.Event()
+
+    def download(self):
+        """下载到filename，服务器不支持Range时退化为单连接"""
+        try:
+            total, ranged = probe(self.url, self.headers, self.timeout)
+        except OSError as e:
+            raise SegmentedDownloadError("探测失败: %s" % e) from e
+        self.total_bytes = total
+        ranged = ranged and bool(total)
+        ranges = self._load_state(total) if ranged else None
+        if ranges is None:
+            if ranged:
+                count = max(1, min(self.segments, total // self.min_segment_size))
+                ranges = [[start, end, 0] for start, end in split_ranges(total, count)]
+            else:
+                ranges = [[0, None, 0]]
+            # 预分配文件，各分段按偏移写入，下载完成后文件内容即为正确顺序
+            with open(self.tmpfilename, "wb") as f:
+                if total:
+                    f.truncate(total)
+        self._ranges = ranges
+        self.downloaded_bytes = sum(done for _, _, done in ranges)
+        if ranged:
+            self._save_state(force=True)
+        self._report("downloading")
+        threads = [
+            threading.Thread(target=self._download_range, args=(index,), daemon=True)
+            for index, (start, end, done) in enumerate(ranges)
+            if end is None or start + done <= end
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self._error is None and total and self.downloaded_bytes != total:
+            self._error = SegmentedDownloadError(
+                "下载不完整: %d/%d 字节" % (self.downloaded_bytes, total), resumable=True
+            )
+        if self._error is not None:
+            if ranged:
+                self._save_state(force=True)
+            resumable = ranged and getattr(self._error, "resumable", True)
+            raise SegmentedDownloadError(str(self._error), resumable=resumable) from self._error
+        os.replace(self.tmpfilename, self.filename)
+        if os.path.exists(self.statefilename):
+            os.remove(self.statefilename)
+        self._report("finished")
+        return self.filename
+
+    def contiguous_bytes(self):
+        """从文件开头起连续下载完成的字节数"""
+        for start, end, done in self._ranges:
+            if end is None or start + done <= end:
+                return start + done
+        return self.total_bytes or self.downloaded_bytes
+
+    def cancel(self):
+        """中止下载（可在任意线程中调用），已下载的分段保留"""
+        self._error = self._error or SegmentedDownloadError("已取消", resumable=True)
+        self._cancelled.set()
+
+    def discard(self):
+        """删除未完成的临时文件和进度文件"""
+        for path in (self.tmpfilename, self.statefilename):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _load_state(self, total):
+        # 临时文件和进度文件都存在且总大小一致时才续传
+        if not (os.path.exists(self.statefilename) and os.path.exists(self.tmpfilename)):
+            return None
+        try:
+            with open(self.statefilename, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get("total") != total or os.path.getsize(self.tmpfilename) != total:
+            return None
+        return state["ranges"]
+
+    def _save_state(self, force=False):
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._saved_at < STATE_SAVE_INTERVAL:
+                return
+            self._saved_at = now
+            state = json.dumps({"total": self.total_bytes, "ranges": self._ranges})
+        # 先写临时文件再替换，崩溃时不会留下损坏的进度文件
+        with open(self.statefilename + ".tmp", "w", encoding="utf-8") as f:
+            f.write(state)
+        os.replace(self.statefilename + ".tmp", self.statefilename)
+
+    def _download_range(self, index):
+        segment = self._ranges[index]
+        attempt = 0
+        while True:
+            try:
+                self._fetch_range(segment)
+                return
+            except (OSError, http.client.HTTPException) as e:
+                # 网络错误和5xx/429可以重试，其余错误（如404）重试也不会成功
+                if self._error is not None or attempt >= self.retries or not is_retryable(classify(e)):
+                    self._error = self._error or e
+                    return
+                if segment[1] is None and segment[2]:
+                    # 不支持Range时重试只能从头下载整个文件，不能接在已写入的部分后面，交给yt_dlp重新下载
+                    self._error = SegmentedDownloadError("连接中断且服务器不支持续传: %s" % e, resumable=False)
+                    return
+            except Exception as e:
+                # 任意分段失败时让其他分段尽快停止
+                self._error = self._error or e
+                return
+            if self.on_retry is not None:
+                self.on_retry()
+            if self._cancelled.wait(sleep_http(attempt)):
+                return
+            attempt += 1
+
+    def _fetch_range(self, segment):
+        start, end, done = segment
+        headers = dict(self.headers)
+        if end is not None:
+            headers["Range"] = "bytes=%d-%d" % (start + done, end)
+        request = urllib.request.Request(self.url, headers=headers)
+        with urllib.request.urlopen(request, timeout=self.timeout) as response, \
+                open(self.tmpfilename, "r+b") as f:
+            if end is not None and response.status != 206:
+                raise SegmentedDownloadError("服务器忽略了Range请求", resumable=False)
+            f.seek(start + done)
+            while self._error is None:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+                # 数据写入文件后才记录进度，保证进度文件不会超前于实际数据
+                f.flush()
+                with self._lock:
+                    segment[2] += len(chunk)
+                    self.downloaded_bytes += len(chunk)
+                if end is not None:
+                    self._save_state()
+                self._report("downloading")
+        if self._error is None and end is not None and start + segment[2] <= end:
+            # 服务器提前关闭了连接，http.client此时不报错，只返回空数据
+            raise ConnectionError("连接提前关闭: %d/%d 字节" % (segment[2], end - start + 1))
+
+    def _report(self, status):
+        if self.progress_hook is None:
+            return
+        self.progress_hook({
+            "status": status,
+            "filename": self.filename,
+            "tmpfilename": self.tmpfilename,
+            "downloaded_bytes": self.downloaded_bytes,
+            "total_bytes": self.total_bytes,
+            "contiguous_bytes": self.contiguous_bytes(),
+        })
@@ -0,0 +1,201 @@
+"""共享的yt_dlp会话：按选项复用长期存在的YoutubeDL实例
+
+每个任务新建YoutubeDL都要重新读取cookies.txt、初始化提取器，并重新与同一个CDN建立TLS连接。
+会话池按选项（格式、输出模板、分片并发数等）保存空闲的YoutubeDL实例，任务开始时借出、结束时归还：
+提取器实例和请求处理器（安装了requests时为带keep-alive连接池的会话）在任务之间复用；
+所有实例共用一个cookie jar，cookies文件只在修改后重新读取，任务结束时最多每COOKIE_SAVE_INTERVAL秒写回一次，
+关闭会话池时再写回一次。
+
+YoutubeDL不是线程安全的，同一时间一个实例只借给一个任务，并发的任务各自借出不同的实例。
+进度回调和日志对象随任务变化，借出时转接给当前任务，不参与选项的比较。
+"""
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+# 随任务变化的选项，由会话转接，不区分实例
+JOB_OPTIONS = ("progress_hooks", "postprocessor_hooks", "logger")
+# 每种选项最多保留的空闲实例数
+MAX_IDLE = 4
+# 空闲超过这个时间（秒）的实例关闭，服务器早已断开它的keep-alive连接
+IDLE_TIMEOUT = 300
+# 归还实例时写回cookies文件的最短间隔（秒），并发任务频繁归还时不每次重写整个文件
+COOKIE_SAVE_INTERVAL = 60
+
+
+def session_key(opts):
+    """选项中决定实例行为的部分，相同时可以共用实例"""
+    shared = {key: value for key, value in opts.items() if key not in JOB_OPTIONS}
+    return json.dumps(shared, sort_keys=True, default=repr)
+
+
+class PooledSession:
+    """池中的一个YoutubeDL实例，进度回调和日志转接给当前借用它的任务"""
+
+    def __init__(self, key, opts, cookiejar):
+        import yt_dlp
+
+        self.key = key
+        self.quiet = opts.get("quiet", False)
+        self.progress_hooks = []
+        self.postprocessor_hooks = []
+        self.logger = None
+        self.released_at = None
+        opts = dict(opts, progress_hooks=[self._progress_hook], postprocessor_hooks=[self._pp_hook], logger=self)
+        # cookies由会话池统一读取和保存
+        opts.pop("cookiefile", None)
+        self.ydl = yt_dlp.YoutubeDL(opts)
+        # 在发出第一个请求之前替换，请求处理器创建时会绑定这个cookie jar
+        self.ydl.cookiejar = cookiejar
+
+    def attach(self, opts):
+        self.progress_hooks = list(opts.get("progress_hooks") or [])
+        self.postprocessor_hooks = list(opts.get("postprocessor_hooks") or [])
+        self.logger = opts.get("logger")
+
+    def detach(self):
+        self.progress_hooks = []
+        self.postprocessor_hooks = []
+        self.logger = None
+        self.released_at = time.monotonic()
+
+    def close(self):
+        self.ydl.close()
+
+    def _progress_hook(self, d):
+        for hook in self.progress_hooks:
+            hook(d)
+
+    def _pp_hook(self, d):
+        for hook in self.postprocessor_hooks:
+            hook(d)
+
+    # yt_dlp的日志接口，没有任务日志对象时按quiet选项输出
+    def debug(self, msg):
+        if self.logger is not None:
+            self.logger.debug(msg)
+        elif not self.quiet and not msg.startswith("[debug] "):
+            print(msg)
+
+    def warning(self, msg):
+        if self.logger is not None:
+            self.logger.warning(msg)
+        else:
+            print("WARNING: %s" % msg, file=sys.stderr)
+
+    def error(self, msg):
+        if self.logger is not None:
+            self.logger.error(msg)
+        else:
+            print(msg, file=sys.stderr)
+
+
+class SessionPool:
+    """按选项保存空闲的YoutubeDL实例，可在任意线程中借出和归还"""
+
+    def __init__(self, max_idle=MAX_IDLE, idle_timeout=IDLE_TIMEOUT):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        # 选项 -> [空闲的PooledSession]
+        self._idle = {}
+        # cookies文件路径（None为不使用文件）-> [cookie jar, 读取时的修改时间]
+        self._cookies = {}
+        # 新建和复用的实例数
+        self.created = 0
+        self.reused = 0
+        self._saved_at = time.monotonic()
+        self._closed = False
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def session(self, opts):
+        """借出一个按opts配置的YoutubeDL实例，with块结束时归还"""
+        session = self.acquire(opts)
+        try:
+            yield session.ydl
+        finally:
+            self.release(session)
+
+    def acquire(self, opts):
+        key = session_key(opts)
+        with self._lock:
+            self._expire(time.monotonic())
+            idle = self._idle.get(key)
+            session = idle.pop() if idle else None
+            cookiejar = self._cookiejar(opts.get("cookiefile"))
+            if session is not None:
+                self.reused += 1
+        if session is None:
+            # 创建实例较慢（初始化提取器），不占用锁
+            session = PooledSession(key, opts, cookiejar)
+            with self._lock:
+                self.created += 1
+        session.attach(opts)
+        return session
+
+    def release(self, session):
+        session.detach()
+        with self._lock:
+            now = time.monotonic()
+            # 会话池关闭后归还的实例（关闭时仍在下载的任务）写回cookies后直接关闭
+            if self._closed or now - self._saved_at >= COOKIE_SAVE_INTERVAL:
+                self._saved_at = now
+                self._save_cookies(session.ydl.cookiejar)
+            if not self._closed:
+                idle = self._idle.setdefault(session.key, [])
+                if len(idle) < self.max_idle:
+                    idle.append(session)
+                    session = None
+        if session is not None:
+            session.close()
+
+    def close(self):
+        """关闭所有空闲实例并写回cookies，由DownloadEngine.shutdown调用"""
+        with self._lock:
+            self._closed = True
+            sessions = [session for idle in self._idle.values() for session in idle]
+            self._idle.clear()
+            for cookiejar, _ in self._cookies.values():
+                self._save_cookies(cookiejar)
+        for session in sessions:
+            session.close()
+
+    def _expire(self, now):
+        for key, idle in list(self._idle.items()):
+            expired = [session for session in idle if now - session.released_at > self.idle_timeout]
+            for session in expired:
+                idle.remove(session)
+                session.close()
+            if not idle:
+                del self._idle[key]
+
+    def _cookiejar(self, path):
+        """返回共用的cookie jar，cookies文件被替换或修改后重新读取（不更换jar对象）"""
+        from yt_dlp.cookies import YoutubeDLCookieJar
+
+        mtime = os.path.getmtime(path) if path and os.path.exists(path) else None
+        entry = self._cookies.get(path)
+        if entry is None:
+            entry = self._cookies[path] = [YoutubeDLCookieJar(path), None]
+        cookiejar, loaded = entry
+        if mtime is not None and mtime != loaded:
+            fresh = YoutubeDLCookieJar(path)
+            fresh.load()
+            # 正在下载的任务也在使用这个jar，在它的锁内替换全部cookies，其他线程不会看到空的jar
+            with cookiejar._cookies_lock:
+                cookiejar.clear()
+                for cookie in fresh:
+                    cookiejar.set_cookie(cookie)
+            entry[1] = mtime
+        return cookiejar
+
+    def _save_cookies(self, cookiejar):
+        if not cookiejar.filename:
+            return
+        # 持有jar的锁，写文件时其他线程不能修改cookies
+        with cookiejar._cookies_lock:
+            cookiejar.save()
+        self._cookies[cookiejar.filename][1] = os.path.getmtime(cookiejar.filename)
@@ -0,0 +1,185 @@
+"""订阅：定期下载播放列表或频道中新增的视频
+
+每个订阅记住见过的条目id。同步时只读取播放列表本身（不解析条目），按网站给出的顺序逐页读取条目，
+连续遇到KNOWN_STREAK个见过的条目就停止，后面的页不再请求；新条目再交给批量解析并下载，
+写入任务日志后才记为见过。
+频道的视频列表为最新的在前，一个有5000个视频的频道每天同步一次，通常只需请求第一页。
+
+订阅频道时应使用按发布时间排序的列表页（如YouTube频道的/videos），频道首页的条目是各个标签页而不是视频。
+"""
+import json
+import sqlite3
+import threading
+import time
+
+from formats import FormatProfile
+
+# 连续遇到这么多个见过的条目时停止读取，置顶或顺序稍有变化的视频不会让同步提前结束
+KNOWN_STREAK = 3
+
+
+class Subscription:
+    """一个订阅：播放列表或频道的链接，以及新视频的下载类型、格式要求和优先级"""
+
+    def __init__(self, subscription_id, url, download_type, profile=None, priority=0, last_sync=None):
+        self.id = subscription_id
+        self.url = url
+        self.download_type = download_type
+        self.profile = profile
+        self.priority = priority
+        # 上次同步的时间，从未同步时为None
+        self.last_sync = last_sync
+
+
+class SubscriptionStore:
+    """持久化的订阅列表和每个订阅见过的条目（sqlite）"""
+
+    def __init__(self, path="subscriptions.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS subscriptions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL UNIQUE,
+                download_type TEXT NOT NULL,
+                profile TEXT,
+                priority INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                last_sync REAL
+            )
+            """
+        )
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS seen (
+                subscription_id INTEGER NOT NULL,
+                entry_id TEXT NOT NULL,
+                seen_at REAL NOT NULL,
+                queued INTEGER NOT NULL DEFAULT 1,
+                PRIMARY KEY (subscription_id, entry_id)
+            ) WITHOUT ROWID
+            """
+        )
+        # 旧版本的表没有queued列，已有的条目都已加入过下载队列
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(seen)")]
+        if "queued" not in columns:
+            self._db.execute("ALTER TABLE seen ADD COLUMN queued INTEGER NOT NULL DEFAULT 1")
+        self._db.commit()
+
+    def add(self, url, download_type, profile=None, priority=0):
+        """添加订阅并返回订阅id；已订阅的链接更新下载类型、格式要求和优先级，见过的条目保留"""
+        profile = json.dumps(profile.to_dict()) if profile else None
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO subscriptions (url, download_type, profile, priority, created_at) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (url) DO UPDATE SET download_type = excluded.download_type,"
+                " profile = excluded.profile, priority = excluded.priority",
+                (url, download_type, profile, priority, time.time()),
+            )
+            self._db.commit()
+            return self._db.execute("SELECT id FROM subscriptions WHERE url = ?", (url,)).fetchone()[0]
+
+    def remove(self, subscription_id):
+        with self._lock:
+            self._db.execute("DELETE FROM seen WHERE subscription_id = ?", (subscription_id,))
+            cursor = self._db.execute("DELETE FROM subscriptions WHERE id = ?", (subscription_id,))
+            self._db.commit()
+        return cursor.rowcount > 0
+
+    def list(self):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, url, download_type, profile, priority, last_sync FROM subscriptions ORDER BY id"
+            ).fetchall()
+        return [
+            Subscription(
+                subscription_id, url, download_type, FormatProfile.from_dict(json.loads(profile)) if profile else None,
+                priority, last_sync,
+            )
+            for subscription_id, url, download_type, profile, priority, last_sync in rows
+        ]
+
+    def entry_state(self, subscription_id, entry_id):
+        """条目的状态：None为没见过，False为同步时取到但还没有加入下载队列，True为已加入"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT queued FROM seen WHERE subscription_id = ? AND entry_id = ?", (subscription_id, entry_id)
+            ).fetchone()
+        return None if row is None else bool(row[0])
+
+    def mark_pending(self, subscription_id, entry_ids):
+        """记录同步时取到的新条目，加入下载队列之前在以后的同步中仍会重新取到"""
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO seen (subscription_id, entry_id, seen_at, queued) VALUES (?, ?, ?, 0)",
+                [(subscription_id, entry_id, now) for entry_id in entry_ids],
+            )
+            self._db.commit()
+
+    def mark_seen(self, subscription_id, entry_ids):
+        """记录已加入下载队列的条目并更新同步时间"""
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT INTO seen (subscription_id, entry_id, seen_at, queued) VALUES (?, ?, ?, 1)"
+                " ON CONFLICT (subscription_id, entry_id) DO UPDATE SET queued = 1",
+                [(subscription_id, entry_id, now) for entry_id in entry_ids],
+            )
+            self._db.execute("UPDATE subscriptions SET last_sync = ? WHERE id = ?", (now, subscription_id))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def iter_entries(entries):
+    """逐个返回播放列表的条目；分页的列表只在读到某一页时才请求这一页"""
+    from yt_dlp.utils import PagedList
+
+    if isinstance(entries, PagedList):
+        index = 0
+        while True:
+            try:
+                yield entries[index]
+            except PagedList.IndexError:
+                return
+            index += 1
+    # 生成器和LazyList本身就是按需读取的
+    yield from entries
+
+
+def find_new_entries(ydl, subscription, store, limit=None):
+    """读取订阅的播放列表直到遇到见过的条目，返回新条目[(条目id, 链接)]（最早发布的在前）
+
+    这里不写入store：调用方先用store.mark_pending记录取到的条目，加入下载队列（写入任务日志）后
+    再调用store.mark_seen，解析失败或加入之前进程退出的条目在下次同步时重新取到。
+    limit限制一次最多取多少个新条目，第一次同步很长的频道时只下载最新的一部分；
+    没有取到的旧条目不会在以后的同步中补上。
+    """
+    info = ydl.extract_info(subscription.url, download=False, process=False)
+    if info.get("_type") not in ("playlist", "multi_video"):
+        # 单个视频也可以订阅，只下载一次
+        entries = [info]
+    else:
+        entries = iter_entries(info.get("entries") or [])
+    new = []
+    streak = 0
+    for entry in entries:
+        url = entry.get("webpage_url") or entry.get("url") if entry else None
+        if not url:
+            continue
+        entry_id = entry.get("id") or entry.get("url")
+        state = store.entry_state(subscription.id, entry_id)
+        # 上次取到但没有加入下载队列的条目（解析失败或进程退出）重新取出，但和见过的条目一样计入连续数，
+        # 在它之后没见过的旧条目（如第一次同步时limit之外的）不会因此被读取
+        streak = 0 if state is None else streak + 1
+        if not state:
+            new.append((entry_id, url))
+        if streak >= KNOWN_STREAK or (limit is not None and len(new) >= limit):
+            break
+    return list(reversed(new))
@@ -1,10 +1,9 @@
 import os
 import subprocess
 import sys
-from datetime import datetime
 
-from PyQt5.QtCore import pyqtSignal, QSize, pyqtSlot
-from PyQt5.QtGui import QColor, QIcon
+from PyQt5.QtCore import pyqtSignal, QSize, pyqtSlot, Qt, QTimer
+from PyQt5.QtGui import QIcon
 from PyQt5.QtWidgets import (
     QMainWindow,
     QPushButton,
@@ -12,22 +11,144 @@ from PyQt5.QtWidgets import (
     QWidget,
     QLabel,
     QLineEdit,
+    QPlainTextEdit,
     QProgressBar,
     QComboBox,
-    QTableWidgetItem,
-    QTableWidget,
+    QTableView,
     QHBoxLayout,
     QHeaderView,
-    QGraphicsDropShadowEffect,
     QMessageBox,
     QTextEdit,
     QDesktopWidget,
     QMenu,
     QAction,
     QSizePolicy,
+    QSpinBox,
+    QCheckBox,
 )
 
-from core import DownloadThread
+from api_server import DEFAULT_PORT, ApiServer
+from core import DownloadQueue
+from engine import preload
+from formats import FormatProfile
+from job_list import JobListModel
+from library import MediaLibrary
+
+
+# 样式表只在模块加载时生成一次，所有控件共用同一个字符串，不在每次更新或弹出菜单时重新拼接
+BUTTON_STYLE = """
+    QPushButton {
+        background-color: #007BFF; /* 科技蓝 */
+        color: white; /* 文字颜色为白色 */
+        border: none;
+        padding: 15px 32px;
+        text-align: center;
+        text-decoration: none;
+        font-size: 16px;
+        margin: 4px 2px;
+        border: 1px solid #007BFF;
+        border-radius: 4px;
+    }
+    QPushButton:hover {
+        background-color: #0062cc; /* 鼠标悬停时的颜色 */
+    }
+    QPushButton:pressed {
+        background-color: #0056b3; /* 按钮被按下时的颜色 */
+        border: 1px solid #0056b3; /* 边框颜色与背景一致 */
+    }
+"""
+WINDOW_STYLE = """
+    QMainWindow {
+        background-color: #A9A9A9; /* 科技浅灰色 */
+    }
+    QWidget {
+        background-color: #2b2b2b;
+    }
+    QPushButton {
+        background-color: #007BFF; /* 科技蓝 */
+        border: none;
+        color: white;
+        padding: 15px 32px;
+        text-align: center;
+        text-decoration: none;
+        font-size: 16px;
+        margin: 4px 2px;
+        border: 1px solid #007BFF;
+        border-radius: 4px;
+    }
+    QPushButton:hover {
+        background-color: #0062cc; /* 鼠标悬停时的颜色 */
+    }
+    QPushButton:pressed {
+        background-color: #0056b3; /* 按钮被按下时的颜色 */
+        border: 1px solid #0056b3; /* 边框颜色与背景一致 */
+    }
+    QProgressBar {
+        border: 2px solid #007BFF;
+        border-radius: 5px;
+        text-align: center;
+        color: #007BFF;
+    }
+    QProgressBar::chunk {
+        background-color: #007BFF;
+        width: 20px;
+    }
+    QLabel, QCheckBox {
+        color: white;
+    }
+    QLineEdit, QPlainTextEdit {
+        background-color: #2b2b2b;
+        color: white;
+        border: 2px solid #007BFF;  /* 科技蓝 */
+        border-radius: 4px;
+    }
+    QTextEdit {
+        background-color: #2b2b2b;
+        color: white;
+        border: 2px solid #007BFF;  /* 科技蓝 */
+        border-radius: 4px;
+    }
+    QSpinBox {
+        background-color: #2b2b2b;
+        color: white;
+        border: 2px solid #007BFF;  /* 科技蓝 */
+        border-radius: 4px;
+    }
+    QTableWidget, QTableView {
+        background-color: #2b2b2b;
+        color: white;
+    }
+    QTableWidget QHeaderView::section, QTableView QHeaderView::section {
+        background-color: #2b2b2b;
+        color: white;
+    }
+    QComboBox {
+        background-color: #2b2b2b; /* 背景色 */
+        color: white; /* 文字颜色 */
+        border: 2px solid #007BFF; /* 边框颜色 */
+        border-radius: 4px; /* 边框圆角 */
+    }
+    QComboBox::drop-down {
+        border: none; /* 去掉下拉箭头的边框 */
+    }
+
+    QComboBox QAbstractItemView {
+        background-color: #0062cc; /* 下拉选项的背景色 */
+        color: white; /* 下拉选项的文字颜色 */
+    }
+    QComboBox QAbstractItemView::item:hover {
+        background-color: #0062cc; /* 鼠标悬停时的颜色 */
+    }
+"""
+MENU_STYLE = """
+    QMenu {
+        background-color: white; /* 菜单的背景色 */
+        color: black; /* 菜单的文字颜色 */
+    }
+    QMenu::item:selected {
+        background-color: lightblue; /* 选中项的背景色 */
+    }
+"""
 
 
 class MainWindow(QMainWindow):
@@ -108,21 +229,35 @@ class MainWindow(QMainWindow):
 
 class MainWindow(QMainWindow):
     # 初始化方法
-    def __init__(self):
+    def __init__(self, store=None):
         super().__init__()
+        # 下载队列，任务行号映射；指定共享任务队列时只提交和监视任务，由工作进程下载
+        self.store = store
+        self.download_queue = DownloadQueue('视频', '音频', max_workers=3, per_host_limit=2, store=store)
+        # 任务列表按固定频率批量刷新，不随每个进度事件重绘
+        self.job_model = JobListModel(self.download_queue, self)
+        self.job_model.refreshed.connect(self.jobs_refreshed)
+        self.api_server = None
+        self._started = False
         self.initUI()
-        self.download_thread = None
         self.load_cookies()
-        
-        
-        # 检查cookies.txt文件是否存在
-        if os.path.exists("cookies.txt"):
-            # 如果存在，设置DownloadThread类的cookies参数
-            self.download_thread = DownloadThread(None, None, '视频', '音频')
-            self.download_thread.set_cookies("cookies.txt")
-            # 读取cookies.txt文件的内容到cookies_input文本框中
-            with open("cookies.txt", "r") as f:
-                self.cookies_input.setPlainText(f.read())
+        if store:
+            self.disable_local_settings()
+    
+    # 窗口第一次显示后再加载媒体库和恢复任务，不推迟首次绘制
+    def showEvent(self, event):
+        super().showEvent(event)
+        if not self._started:
+            self._started = True
+            QTimer.singleShot(0, self.start_background)
+    
+    def start_background(self):
+        # 在后台线程中导入yt_dlp
+        preload()
+        # 加载媒体库目录并在后台扫描视频和音频目录
+        self.library.start()
+        # 恢复上次未完成的下载任务
+        self.download_queue.restore()
     
     # 界面初始化方法
     def initUI(self):
@@ -140,7 +275,10 @@ class MainWindow(QMainWindow):
         
         url_layout = QHBoxLayout()
         url_layout.addWidget(QLabel("URL:"))
-        self.url_input = QLineEdit()
+        # 支持一次粘贴多个链接（每行一个），也可以是播放列表或频道链接
+        self.url_input = QPlainTextEdit()
+        self.url_input.setPlaceholderText("每行一个链接，支持播放列表和频道")
+        self.url_input.setMaximumHeight(100)
         url_layout.addWidget(self.url_input)
         self.download_button = QPushButton("下载")
         self.download_button.setIcon(QIcon(icon_path))
@@ -153,14 +291,112 @@ class MainWindow(QMainWindow):
         download_type_layout.addWidget(QLabel("下载类型:"))
         self.download_type = QComboBox()
         self.download_type.addItems(["视频", "音频"])
-        # 连接currentIndexChanged信号到槽函数
-        self.download_type.currentIndexChanged.connect(self.update_download_type)
         # 设置选择框的尺寸策略为自适应
         self.download_type.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Preferred)
         download_type_layout.addWidget(self.download_type)
+        # 同时下载的任务数
+        download_type_layout.addWidget(QLabel("并发数:"))
+        self.workers_input = QSpinBox()
+        self.workers_input.setRange(1, 16)
+        self.workers_input.setValue(self.download_queue.max_workers)
+        self.workers_input.valueChanged.connect(self.download_queue.set_max_workers)
+        download_type_layout.addWidget(self.workers_input)
+        # 同一站点同时下载的任务数
+        download_type_layout.addWidget(QLabel("单站点上限:"))
+        self.host_limit_input = QSpinBox()
+        self.host_limit_input.setRange(1, 16)
+        self.host_limit_input.setValue(self.download_queue.per_host_limit)
+        self.host_limit_input.valueChanged.connect(self.download_queue.set_per_host_limit)
+        download_type_layout.addWidget(self.host_limit_input)
+        # 每个任务的连接数（直链分段数/分片并发数）
+        download_type_layout.addWidget(QLabel("每任务连接数:"))
+        self.connections_input = QSpinBox()
+        self.connections_input.setRange(1, 32)
+        self.connections_input.setValue(self.download_queue.connections)
+        self.connections_input.valueChanged.connect(self.download_queue.set_connections)
+        download_type_layout.addWidget(self.connections_input)
+        # 所有任务合计的速率上限，正在下载的任务按权重共享
+        download_type_layout.addWidget(QLabel("总限速(KB/s):"))
+        self.rate_limit_input = QSpinBox()
+        self.rate_limit_input.setRange(0, 1000000)
+        self.rate_limit_input.setSingleStep(100)
+        self.rate_limit_input.setSpecialValueText("不限")
+        self.rate_limit_input.valueChanged.connect(lambda value: self.download_queue.set_rate_limit(value * 1024))
+        download_type_layout.addWidget(self.rate_limit_input)
         download_type_layout.addStretch()  # 添加弹性空间使得选择框靠左对齐
         layout.addLayout(download_type_layout)
         
+        # 输出格式：自动时尽量直接使用或流复制，只在编码不符合要求时转码
+        output_layout = QHBoxLayout()
+        output_layout.addWidget(QLabel("音频格式:"))
+        self.audio_codec_input = QComboBox()
+        for label, codec in (("自动（不转码）", "auto"), ("mp3", "mp3"), ("m4a (AAC)", "aac"), ("opus", "opus")):
+            self.audio_codec_input.addItem(label, codec)
+        self.audio_codec_input.currentIndexChanged.connect(
+            lambda index: self.download_queue.set_audio_codec(self.audio_codec_input.itemData(index))
+        )
+        output_layout.addWidget(self.audio_codec_input)
+        output_layout.addWidget(QLabel("视频封装:"))
+        self.container_input = QComboBox()
+        for label, container in (("自动", "auto"), ("mp4", "mp4"), ("mkv", "mkv"), ("webm", "webm")):
+            self.container_input.addItem(label, container)
+        self.container_input.currentIndexChanged.connect(
+            lambda index: self.download_queue.set_container(self.container_input.itemData(index))
+        )
+        output_layout.addWidget(self.container_input)
+        output_layout.addStretch()
+        layout.addLayout(output_layout)
+        
+        # 格式要求：对之后添加的任务生效，满足上限的格式中选画质最好、字节数最少、不需要合并的
+        profile_layout = QHBoxLayout()
+        profile_layout.addWidget(QLabel("最高分辨率:"))
+        self.max_height_input = QComboBox()
+        for label, height in (("不限", None), ("2160p", 2160), ("1440p", 1440), ("1080p", 1080), ("720p", 720),
+                              ("480p", 480), ("360p", 360)):
+            self.max_height_input.addItem(label, height)
+        profile_layout.addWidget(self.max_height_input)
+        profile_layout.addWidget(QLabel("最高帧率:"))
+        self.max_fps_input = QComboBox()
+        for label, fps in (("不限", None), ("60", 60), ("30", 30)):
+            self.max_fps_input.addItem(label, fps)
+        profile_layout.addWidget(self.max_fps_input)
+        profile_layout.addWidget(QLabel("视频编码:"))
+        self.video_codec_input = QComboBox()
+        for label, codec in (("不限", None), ("H.264", "h264"), ("VP9", "vp9"), ("AV1", "av1")):
+            self.video_codec_input.addItem(label, codec)
+        profile_layout.addWidget(self.video_codec_input)
+        profile_layout.addWidget(QLabel("文件上限(MB):"))
+        # 0表示不限
+        self.max_size_input = QSpinBox()
+        self.max_size_input.setRange(0, 100000)
+        self.max_size_input.setSpecialValueText("不限")
+        profile_layout.addWidget(self.max_size_input)
+        self.premuxed_input = QCheckBox("优先预合并格式")
+        self.premuxed_input.setChecked(True)
+        profile_layout.addWidget(self.premuxed_input)
+        profile_layout.addStretch()
+        layout.addLayout(profile_layout)
+        
+        # 去重设置：已下载过的视频跳过或链接已有文件，可选按内容哈希识别重复上传
+        archive_layout = QHBoxLayout()
+        archive_layout.addWidget(QLabel("已下载过的视频:"))
+        self.archive_mode = QComboBox()
+        self.archive_mode.addItem("跳过", "skip")
+        self.archive_mode.addItem("链接已有文件", "link")
+        self.archive_mode.currentIndexChanged.connect(
+            lambda index: self.download_queue.set_archive_mode(self.archive_mode.itemData(index))
+        )
+        archive_layout.addWidget(self.archive_mode)
+        self.hash_content_input = QCheckBox("按内容哈希识别重复视频")
+        self.hash_content_input.toggled.connect(self.download_queue.set_hash_content)
+        archive_layout.addWidget(self.hash_content_input)
+        # 本地HTTP接口，供自动化脚本提交任务和查询进度
+        self.api_input = QCheckBox("开启本地接口 (127.0.0.1:%d)" % DEFAULT_PORT)
+        self.api_input.toggled.connect(self.toggle_api_server)
+        archive_layout.addWidget(self.api_input)
+        archive_layout.addStretch()
+        layout.addLayout(archive_layout)
+        
         cookies_layout = QHBoxLayout()
         cookies_layout.addWidget(QLabel("Cookies:"))
         self.cookies_input = QTextEdit()
@@ -183,33 +419,51 @@ class MainWindow(QMainWindow):
         # 将水平布局添加到主布局
         layout.addLayout(progress_layout)
         
-        # 添加表格用于展示文件
-        self.file_table = QTableWidget()
-        self.file_table.setColumnCount(2)  # 两列，一列是文件名，一列是类型
-        self.file_table.setHorizontalHeaderLabels(["文件名", "类型"])
-        self.file_table.horizontalHeader().setSectionResizeMode(
+        # 添加表格用于展示下载队列中的任务
+        self.job_table = QTableView()
+        self.job_table.setModel(self.job_model)
+        self.job_table.setSelectionBehavior(QTableView.SelectRows)
+        self.job_table.verticalHeader().setVisible(False)
+        # 按内容自适应列宽时每次刷新都要测量所有行的文本，使用固定的可调列宽
+        self.job_table.horizontalHeader().setSectionResizeMode(
             0, QHeaderView.ResizeMode.Stretch
         )
+        self.job_table.horizontalHeader().setDefaultSectionSize(100)
+        # 行高固定，滚动和刷新时不必逐行计算
+        self.job_table.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        layout.addWidget(self.job_table)
+        
+        # 媒体库：后台扫描视频/音频目录，并根据目录变化增量更新
+        self.library = MediaLibrary(['视频', '音频'], self)
+        filter_layout = QHBoxLayout()
+        filter_layout.addWidget(QLabel("搜索:"))
+        self.filter_input = QLineEdit()
+        self.filter_input.textChanged.connect(self.library.set_filter)
+        filter_layout.addWidget(self.filter_input)
+        layout.addLayout(filter_layout)
+        
+        # 添加表格用于展示文件
+        self.file_table = QTableView()
+        self.file_table.setModel(self.library.proxy)
+        self.file_table.setSortingEnabled(True)
+        self.file_table.setSelectionBehavior(QTableView.SelectRows)
+        self.file_table.verticalHeader().setVisible(False)
+        # 文件很多时按内容自适应列宽代价很高，除文件名外使用固定的可调列宽
         self.file_table.horizontalHeader().setSectionResizeMode(
-            1, QHeaderView.ResizeMode.ResizeToContents
+            0, QHeaderView.ResizeMode.Stretch
         )
-        self.file_table.mouseDoubleClickEvent = self.play_selected_file  # 双击播放
+        self.file_table.horizontalHeader().setDefaultSectionSize(120)
+        # 默认按下载时间倒序
+        self.file_table.sortByColumn(6, Qt.DescendingOrder)
+        self.file_table.doubleClicked.connect(self.play_selected_file)  # 双击播放
         layout.addWidget(self.file_table)
         
-        # 初始化时加载当前目录下的媒体文件
-        self.update_file_table()
-        
         central_widget = QWidget()
         central_layout = QHBoxLayout(central_widget)
         container = QWidget()
         container.setLayout(layout)
+        # 不给容器加阴影效果：图形效果会让任意子控件的重绘都重新渲染并模糊整个窗口
         container.setStyleSheet("background-color: #2b2b2b; border-radius: 10px;")
-        shadow_effect = QGraphicsDropShadowEffect(self)
-        shadow_effect.setBlurRadius(15)
-        shadow_effect.setXOffset(0)
-        shadow_effect.setYOffset(0)
-        shadow_effect.setColor(QColor(0, 0, 0, 80))
-        container.setGraphicsEffect(shadow_effect)
         central_layout.addWidget(container)
         central_layout.setContentsMargins(10, 10, 10, 10)
         self.setCentralWidget(central_widget)
@@ -220,134 +474,9 @@ class MainWindow(QMainWindow):
         self.save_button.setIcon(QIcon(save_icon_path))
         self.save_button.setIconSize(QSize(64, 64))
         
-        self.save_button.setStyleSheet(
-            """
-            QPushButton {
-                background-color: #007BFF; /* 科技蓝 */
-                color: white; /* 文字颜色为白色 */
-                border: none;
-                padding: 15px 32px;
-                text-align: center;
-                text-decoration: none;
-                font-size: 16px;
-                margin: 4px 2px;
-                border: 1px solid #007BFF;
-                border-radius: 4px;
-            }
-            QPushButton:hover {
-                background-color: #0062cc; /* 鼠标悬停时的颜色 */
-            }
-            QPushButton:pressed {
-                background-color: #0056b3; /* 按钮被按下时的颜色 */
-                border: 1px solid #0056b3; /* 边框颜色与背景一致 */
-            }
-        """
-        )
-        
-        self.download_button.setStyleSheet(
-            """
-            QPushButton {
-                background-color: #007BFF; /* 科技蓝 */
-                color: white; /* 文字颜色为白色 */
-                border: none;
-                padding: 15px 32px;
-                text-align: center;
-                text-decoration: none;
-                font-size: 16px;
-                margin: 4px 2px;
-                border: 1px solid #007BFF;
-                border-radius: 4px;
-            }
-            QPushButton:hover {
-                background-color: #0062cc; /* 鼠标悬停时的颜色 */
-            }
-            QPushButton:pressed {
-                background-color: #0056b3; /* 按钮被按下时的颜色 */
-                border: 1px solid #0056b3; /* 边框颜色与背景一致 */
-            }
-        """
-        )
-        self.setStyleSheet(
-            """
-                QMainWindow {
-                    background-color: #A9A9A9; /* 科技浅灰色 */
-                }
-                QWidget {
-                    background-color: #2b2b2b;
-                }
-                QPushButton {
-                    background-color: #007BFF; /* 科技蓝 */
-                    border: none;
-                    color: white;
-                    padding: 15px 32px;
-                    text-align: center;
-                    text-decoration: none;
-                    font-size: 16px;
-                    margin: 4px 2px;
-                    border: 1px solid #007BFF;
-                    border-radius: 4px;
-                }
-                QPushButton:hover {
-                    background-color: #0062cc; /* 鼠标悬停时的颜色 */
-                }
-                QPushButton:pressed {
-                    background-color: #0056b3; /* 按钮被按下时的颜色 */
-                    border: 1px solid #0056b3; /* 边框颜色与背景一致 */
-                }
-                QProgressBar {
-                    border: 2px solid #007BFF;
-                    border-radius: 5px;
-                    text-align: center;
-                    color: #007BFF;
-                }
-                QProgressBar::chunk {
-                    background-color: #007BFF;
-                    width: 20px;
-                }
-                QLabel {
-                    color: white;
-                }
-                QLineEdit {
-                    background-color: #2b2b2b;
-                    color: white;
-                    border: 2px solid #007BFF;  /* 科技蓝 */
-                    border-radius: 4px;
-                }
-                QTextEdit {
-                    background-color: #2b2b2b;
-                    color: white;
-                    border: 2px solid #007BFF;  /* 科技蓝 */
-                    border-radius: 4px;
-                }
-                QTableWidget {
-                    background-color: #2b2b2b;
-                    color: white;
-                }
-                QTableWidget QHeaderView::section {
-                    background-color: #2b2b2b;
-                    color: white;
-                }
-                QComboBox {
-                    background-color: #2b2b2b; /* 背景色 */
-                    color: white; /* 文字颜色 */
-                    border: 2px solid #007BFF; /* 边框颜色 */
-                    border-radius: 4px; /* 边框圆角 */
-                }
-                QComboBox::drop-down {
-                    border: none; /* 去掉下拉箭头的边框 */
-                }
-
-                QComboBox QAbstractItemView {
-                    background-color: #0062cc; /* 下拉选项的背景色 */
-                    color: white; /* 下拉选项的文字颜色 */
-                }
-                QComboBox QAbstractItemView::item:hover {
-                    background-color: #0062cc; /* 鼠标悬停时的颜色 */
-                }
-            """
-        )
-        
-        self.download_thread = None
+        self.save_button.setStyleSheet(BUTTON_STYLE)
+        self.download_button.setStyleSheet(BUTTON_STYLE)
+        self.setStyleSheet(WINDOW_STYLE)
     
     def load_cookies(self):
         if os.path.exists("cookies.txt"):
@@ -364,190 +493,137 @@ class MainWindow(QMainWindow):
             with open("cookies.txt", "w") as f:
                 f.write(cookies)
             QMessageBox.information(self, "信息", "Cookies已保存。")
-            if self.download_thread:
-                self.download_thread.set_cookies("cookies.txt")
-    def get_download_time(self, file_name):
-        # 这里根据实际情况调整，如果是使用下载完成时间，您可能需要设计一个机制来存储这些时间
-        # 作为示例，这里使用文件的修改时间作为替代
-        return datetime.fromtimestamp(os.path.getmtime(file_name))
     
-    # 更新文件表格的方法
-    def update_file_table(self):
-        """更新文件展示表格，列出当前目录下的视频和音频文件"""
-        while self.file_table.rowCount() > 0:
-            self.file_table.removeRow(0)
-        # 判断当前目录下是否存在视频和音频文件夹 不存在则创建
-        if not os.path.exists("视频"):
-            os.mkdir("视频")
-        if not os.path.exists("音频"):
-            os.mkdir("音频")
-        
-        # 搜索视频和音频文件夹
-        folders = ['视频', '音频']
-        media_files = []
-        for folder in folders:
-            folder_path = os.path.join(".", folder)
-            if os.path.exists(folder_path):
-                files = os.listdir(folder_path)
-                media_files.extend([
-                    f
-                    for f in files
-                    if f.lower().endswith((".mp4", ".mkv", ".avi", ".mp3", ".wav"))
-                ])
-        
-        for file in media_files:
-            row_position = self.file_table.rowCount()
-            self.file_table.insertRow(row_position)
-            file_item = QTableWidgetItem(file)
-            
-            type_indicator = QTableWidgetItem(
-                "视频" if file.lower().endswith((".mp4", ".mkv", ".avi")) else "音频"
-            )
-            self.file_table.setItem(row_position, 0, file_item)
-            self.file_table.setItem(row_position, 1, type_indicator)
+    # 使用共享任务队列时，并发数、限速、输出格式和查重方式由各工作进程的参数决定
+    def disable_local_settings(self):
+        self.setWindowTitle("禹驰技术-视频下载器 - 共享队列 %s" % self.store)
+        for widget in (
+            self.workers_input, self.host_limit_input, self.connections_input, self.rate_limit_input,
+            self.audio_codec_input, self.container_input, self.archive_mode, self.hash_content_input,
+        ):
+            widget.setEnabled(False)
+            widget.setToolTip("由工作进程的命令行参数决定")
     
-    def update_download_type(self, index):
-        # 根据选择的下载类型更新ydl_opts
-        download_type = self.download_type.itemText(index)
-        
-        if self.download_thread:
-            self.download_thread.update_format(download_type)
+    # 更新进度条进度：显示所有未结束任务的平均进度
+    def update_progress(self):
+        active = [job for job in self.download_queue.get_jobs() if job.is_active()]
+        if active:
+            self.progress_bar.setValue(int(sum(job.progress for job in active) / len(active)))
+        else:
+            self.progress_bar.reset()
     
-    # 更新进度条进度的槽函数
-    @pyqtSlot(int)
-    def update_progress(self, progress):
-        self.progress_bar.setValue(progress)
+    # 开启或关闭本地HTTP接口
+    def toggle_api_server(self, enabled):
+        if enabled and self.api_server is None:
+            try:
+                self.api_server = ApiServer(self.download_queue.engine).start()
+            except OSError as e:
+                self.show_error_message("本地接口启动失败: %s" % e)
+                self.api_input.setChecked(False)
+        elif not enabled and self.api_server is not None:
+            self.api_server.stop()
+            self.api_server = None
     
-    # 下载完成的槽函数
-    @pyqtSlot()
-    def download_complete(self):
-        self.download_button.setEnabled(False)
-        # 判断下载是否成功
-        success = self.download_thread.success
-        if success:
-            self.download_button.setStyleSheet(
-                """
-                        QPushButton {
-                            background-color: #007BFF; /* 恢复原始颜色 */
-                            /* 其他样式保持不变 */
-                        }
-                        QPushButton:hover {
-                            background-color: #0062cc;
-                        }
-                        QPushButton:pressed {
-                            background-color: #0056b3;
-                        }
-                    """
-            )
+    # 任务列表每批刷新后更新总进度条，finished为这一批中结束的任务数
+    @pyqtSlot(int)
+    def jobs_refreshed(self, finished):
+        self.update_progress()
+        # 下载的文件由媒体库监听目录变化自动加入文件表格
+        if finished and self.download_queue.active_count() == 0:
             self.download_button.setText("下载")
-        else:
-            # 可以在这里处理下载失败的情况
-            self.download_button.setText("下载失败.")
-            pass
-        self.download_thread = None
-        
-        self.update_file_table()  # 下载完成后更新文件表格
-        # 清空url输入框
-        self.url_input.clear()
-        # 重置进度条
-        self.progress_bar.reset()
-        # 重新启用下载按钮
-        self.download_button.setEnabled(True)
     
-    # 下载方法
+    # 下载方法：把URL加入下载队列，正在下载时也可以继续添加
     def download(self):
-        # 检查URL是否为空
-        url = self.url_input.text().strip()
-        if not url:
+        # 检查URL是否为空，多个链接可以用换行或空格分隔
+        urls = self.url_input.toPlainText().split()
+        if not urls:
             self.show_error_message("请输入有效的视频链接。")
             return
         
-        # 如果已有下载线程正在运行，则不执行下载
-        if self.download_thread and self.download_thread.isRunning():
-            return  # If a download is already running, do nothing
-        
-        # 获取输入的URL和选择的下载类型
-        url = self.url_input.text()
+        # 获取选择的下载类型
         download_type = self.download_type.currentText()
-        
-        # 更改按钮文本和样式为"下载中..."
-        self.download_button.setText("下载中...")
-        self.download_button.setEnabled(False)  # 禁用按钮防止重复点击
-        self.download_button.setStyleSheet(
-            """
-                QPushButton {
-                    background-color: #0056b3; /* 模拟按下颜色 */
-                    border: none;
-                    color: white;
-                    padding: 15px 32px;
-                    text-align: center;
-                    text-decoration: none;
-                    font-size: 16px;
-                    margin: 4px 2px;
-                    border: 1px solid #0056b3; /* 边框颜色与背景一致 */
-                    border-radius: 4px;
-                }
-                QPushButton:hover { /* 由于禁用，此样式不再应用 */
-                    background-color: #0062cc;
-                }
-                QPushButton:pressed { /* 同上 */
-                    background-color: #0056b3;
-                }
-            """
+        # 先并行解析元数据（展开播放列表），解析完成的条目立即开始下载
+        self.download_queue.add_batch(urls, download_type, self.format_profile())
+        self.download_button.setText("添加下载")
+        # 清空url输入框，方便继续输入下一个链接
+        self.url_input.clear()
+    
+    # 根据格式要求控件生成任务的格式要求
+    def format_profile(self):
+        video_codec = self.video_codec_input.currentData()
+        max_size = self.max_size_input.value()
+        return FormatProfile(
+            self.max_height_input.currentData(), self.max_fps_input.currentData(),
+            [video_codec] if video_codec else [], max_filesize=max_size * 1024 * 1024 if max_size else None,
+            prefer_premuxed=self.premuxed_input.isChecked(),
         )
-        
-        # 创建新的下载线程
-        self.download_thread = DownloadThread(url, download_type, '视频', '音频')
-        # 连接下载进度和完成信号到相应的槽函数
-        self.download_thread.progress.connect(self.update_progress)
-        self.download_thread.finished.connect(self.download_complete)
-        # 启动下载线程
-        self.download_thread.start()
+    
+    # 用系统默认程序打开文件或目录
+    def open_path(self, path):
+        if sys.platform.startswith("linux"):
+            subprocess.run(["xdg-open", path])
+        elif sys.platform.startswith("darwin"):
+            subprocess.run(["open", path])
+        elif sys.platform.startswith("win"):
+            os.startfile(path)
     
     # 双击播放选中文件
-    def play_selected_file(self, event):
-        row = self.file_table.currentRow()
-        file_item = self.file_table.item(row, 0)
-        if file_item:
-            file_name = file_item.text()
-            if file_name.lower().endswith((".mp4", ".mkv", ".avi", ".mp3", ".wav")):
-                if sys.platform.startswith("linux"):
-                    subprocess.run(["xdg-open", file_name])
-                elif sys.platform.startswith("darwin"):
-                    subprocess.run(["open", file_name])
-                elif sys.platform.startswith("win"):
-                    os.startfile(file_name)
+    def play_selected_file(self, index=None):
+        path = self.library.path(self.file_table.currentIndex())
+        if path:
+            self.open_path(path)
     
     # 右键菜单
     def contextMenuEvent(self, event):
         context_menu = QMenu(self)
-        context_menu.setStyleSheet(
-            """
-            QMenu {
-                background-color: white; /* 菜单的背景色 */
-                color: black; /* 菜单的文字颜色 */
-            }
-            QMenu::item:selected {
-                background-color: lightblue; /* 选中项的背景色 */
-            }
-        """
-        )
+        context_menu.setStyleSheet(MENU_STYLE)
+        # 在任务表格上右键时显示任务操作
+        child = self.childAt(event.pos())
+        if child is not None and self.job_table.isAncestorOf(child):
+            self.job_context_menu(context_menu, event)
+            return
         play_action = QAction("播放选中文件", self)
         open_dir_action = QAction("打开文件目录", self)
         context_menu.addAction(play_action)
         context_menu.addAction(open_dir_action)
         action = context_menu.exec_(self.mapToGlobal(event.pos()))
         if action == play_action:
-            self.play_selected_file(None)
+            self.play_selected_file()
         elif action == open_dir_action:
-            row = self.file_table.currentRow()
-            file_item = self.file_table.item(row, 0)
-            if file_item:
-                file_name = file_item.text()
-                if file_name.lower().endswith((".mp4", ".mkv", ".avi", ".mp3", ".wav")):
-                    if sys.platform.startswith("linux"):
-                        subprocess.run(["xdg-open", file_name])
-                    elif sys.platform.startswith("darwin"):
-                        subprocess.run(["open", file_name])
-                    elif sys.platform.startswith("win"):
-                        os.startfile(file_name)
\ No newline at end of file
+            path = self.library.path(self.file_table.currentIndex())
+            if path:
+                self.open_path(os.path.dirname(os.path.abspath(path)))
+    
+    # 任务表格的右键菜单：暂停、继续、优先下载和取消选中的任务
+    def job_context_menu(self, context_menu, event):
+        job_ids = [self.job_model.job_id(index.row()) for index in self.job_table.selectionModel().selectedRows()]
+        if not job_ids:
+            return
+        pause_action = QAction("暂停", self)
+        resume_action = QAction("继续", self)
+        priority_action = QAction("优先下载", self)
+        cancel_action = QAction("取消", self)
+        for action in (pause_action, resume_action, priority_action, cancel_action):
+            context_menu.addAction(action)
+        action = context_menu.exec_(self.mapToGlobal(event.pos()))
+        if action == priority_action:
+            # 优先级高于所有任务，正在下载的任务会让出名额
+            priority = max(job.priority for job in self.download_queue.get_jobs()) + 1
+        for job_id in job_ids:
+            if action == pause_action:
+                self.download_queue.pause(job_id)
+            elif action == resume_action:
+                self.download_queue.resume(job_id)
+            elif action == priority_action:
+                self.download_queue.set_priority(job_id, priority)
+            elif action == cancel_action:
+                self.download_queue.cancel(job_id)
+    
+    def closeEvent(self, event):
+        # 停止媒体库的后台扫描线程
+        self.library.stop()
+        if self.api_server is not None:
+            self.api_server.stop()
+        # 关闭复用的下载会话并写回cookies
+        self.download_queue.shutdown()
+        super().closeEvent(event)
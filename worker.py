@@ -0,0 +1,115 @@
+"""工作进程：从共享任务队列（见job_store.py）领取任务，用本地的下载引擎下载到共同的媒体库
+
+启动：python -m cli --store 队列文件 --worker --video-dir 媒体库/视频 --audio-dir 媒体库/音频
+每个工作进程按自己的-j/--per-host/-c等参数下载，同一台主机上也可以启动多个（各自在不同的工作目录中运行，
+任务日志、下载索引和解析缓存等本地数据库不共用）。
+"""
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from engine import DownloadJob
+from job_store import HEARTBEAT_INTERVAL, LEASE_DURATION
+
+
+class Worker:
+    """把共享队列中的任务交给下载引擎，定期续约并上报进度，任务结束时写回结果"""
+
+    def __init__(self, store, engine, name=None, capacity=None):
+        self.store = store
+        self.engine = engine
+        self.name = name or "%s-%d" % (socket.gethostname(), os.getpid())
+        # 同时领取的任务数，默认等于引擎的下载名额；正在后处理的任务不占名额
+        self.capacity = capacity or engine.max_workers
+        # 本地任务id -> 队列中的任务id
+        self._leased = {}
+        self._lock = threading.Lock()
+        engine.subscribe(self._on_event)
+
+    def run(self, stop_event):
+        """领取和执行任务，直到stop_event被设置；退出时把未完成的任务放回队列"""
+        next_heartbeat = 0
+        try:
+            while not stop_event.is_set():
+                try:
+                    if time.monotonic() >= next_heartbeat:
+                        self._heartbeat()
+                        next_heartbeat = time.monotonic() + HEARTBEAT_INTERVAL
+                    self._fill()
+                except sqlite3.Error as e:
+                    # 共享目录暂时不可用：租约有余量，下次再试
+                    print("访问共享队列失败: %s" % e)
+                stop_event.wait(1)
+        finally:
+            self.shutdown()
+
+    def shutdown(self, timeout=LEASE_DURATION):
+        with self._lock:
+            leased = {
+                local_id: job_id for local_id, job_id in self._leased.items()
+                if self.engine.jobs[local_id].state != DownloadJob.PROCESSING
+            }
+            for local_id in leased:
+                del self._leased[local_id]
+        if leased:
+            # 先放回队列再停止下载，停止时的取消事件不会写回队列；已下载的部分留给下一个领取的工作进程
+            self.store.release(self.name, list(leased.values()))
+            for local_id in leased:
+                self.engine.cancel(local_id)
+        # 正在合并或转码的任务很快结束，等它们写回结果
+        deadline = time.monotonic() + timeout
+        while self._leased and time.monotonic() < deadline:
+            time.sleep(0.2)
+
+    def _fill(self):
+        with self._lock:
+            downloading = sum(
+                1 for local_id in self._leased if self.engine.jobs[local_id].state != DownloadJob.PROCESSING
+            )
+        free = self.capacity - downloading
+        if free <= 0:
+            return
+        for job in self.store.lease(self.name, free, LEASE_DURATION):
+            # 在锁内加入引擎，很快结束的任务（如已存在）发出结束事件时已能找到队列中的id
+            with self._lock:
+                local_id = self.engine.add(job["url"], job["download_type"], profile=job["profile"],
+                                           priority=job["priority"])
+                self._leased[local_id] = job["id"]
+            if job["weight"] != 1:
+                self.engine.set_weight(local_id, job["weight"])
+
+    def _heartbeat(self):
+        with self._lock:
+            jobs = {job_id: self.engine.jobs[local_id] for local_id, job_id in self._leased.items()}
+        if not jobs:
+            return
+        lost, weights = self.store.heartbeat(self.name, jobs, LEASE_DURATION)
+        # 提交端修改的带宽权重
+        for job_id, weight in weights.items():
+            if jobs[job_id].weight != weight:
+                self.engine.set_weight(jobs[job_id].id, weight)
+        if not lost:
+            return
+        lost = set(lost)
+        # 在队列中被取消、暂停或租约已过期被重新分配的任务，停止本地下载
+        with self._lock:
+            lost_local = [local_id for local_id, job_id in self._leased.items() if job_id in lost]
+            for local_id in lost_local:
+                del self._leased[local_id]
+        for local_id in lost_local:
+            self.engine.cancel(local_id)
+
+    def _on_event(self, event, job):
+        if event != "finished":
+            return
+        with self._lock:
+            job_id = self._leased.pop(job.id, None)
+        if job_id is None:
+            return
+        try:
+            self.store.finish(self.name, job_id, job)
+        except sqlite3.Error as e:
+            # 写回失败时租约到期后任务会被重新领取，已完成的文件会被识别为已存在
+            print("写回任务结果失败: %s" % e)